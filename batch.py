@@ -0,0 +1,82 @@
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Ends the queue of futures filled by stream_map's input thread
+END_OF_INPUT = object()
+
+
+def map_files(func, filenames, jobs: int = 1):
+    """Run func over filenames, yielding results in input order.
+
+    With jobs > 1 the files are spread over a process pool in chunks, so the
+    per-file work must be a picklable module-level function.
+    """
+    if jobs is None or jobs <= 1:
+        yield from map(func, filenames)
+        return
+
+    # A few chunks per worker keeps the pool busy without one task per file
+    chunksize = max(1, len(filenames) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(func, filenames, chunksize=chunksize)
+
+
+def stream_map(func, items, jobs: int = 1):
+    """Run func over a stream of items, yielding results in input order.
+
+    Unlike map_files the items are not collected first: each result is
+    yielded as soon as it and all earlier ones are done, also while the
+    next item is still awaited, and about jobs * 4 items are in flight at
+    most, so memory stays bounded on endless input.
+    """
+    if jobs is None or jobs <= 1:
+        yield from map(func, items)
+        return
+
+    # Items are read and submitted by a separate thread, so waiting for the
+    # next input never holds back a result that is already done
+    futures = queue.Queue(maxsize=jobs * 4)
+    stopped = threading.Event()
+
+    def submit_items(pool):
+        try:
+            for item in items:
+                if stopped.is_set():
+                    return
+                futures.put(pool.submit(func, item))
+        except BaseException as e:
+            futures.put(e)
+        else:
+            futures.put(END_OF_INPUT)
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        reader = threading.Thread(target=submit_items, args=(pool,), daemon=True)
+        reader.start()
+        try:
+            while True:
+                future = futures.get()
+                if future is END_OF_INPUT:
+                    return
+                if isinstance(future, BaseException):
+                    raise future
+                yield future.result()
+        finally:
+            # On early exit, unblock the input thread and drop queued work
+            stopped.set()
+            while True:
+                try:
+                    future = futures.get_nowait()
+                except queue.Empty:
+                    break
+                if hasattr(future, "cancel"):
+                    future.cancel()
+
+
+def print_summary(action: str, total: int, errors, up_to_date: int = None):
+    # up_to_date is only given by incremental builds
+    skipped = "" if up_to_date is None else f", {up_to_date} up to date"
+    print(f"\n{action} {total} file(s), {len(errors)} failed{skipped}")
+    for filename, message in errors:
+        # Only the first line of multi-line parser messages
+        print(f"  {filename}: {message.splitlines()[0]}")
@@ -0,0 +1,185 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict
+
+from cache import COMPILER_VERSION
+from parser import CodeGenerator, Optimizer, Parser, TableParser, decode_asts, encode_asts, process_files, write_ast_to_file
+from tokenizer import Scanner, TokenType, process_folder
+from workload import QueryGenerator, WorkloadOptions, add_workload_arguments, workload_options
+
+def measure(stage, repeat: int = 3):
+    """Time stage() as the best of repeat runs, then run it once more under
+    tracemalloc for its peak memory. Returns (result, seconds, peak bytes)."""
+    if repeat < 1:
+        raise ValueError(f"repeat must be at least 1, got {repeat}")
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = stage()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    del result
+    tracemalloc.start()
+    try:
+        result = stage()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, best, peak
+
+def stage_report(seconds: float, peak: int, queries: int, tokens: int) -> dict:
+    return {
+        "seconds": round(seconds, 6),
+        "queries_per_second": round(queries / seconds, 1) if seconds else None,
+        "tokens_per_second": round(tokens / seconds, 1) if seconds else None,
+        "peak_memory_bytes": peak,
+    }
+
+def run_benchmark(queries: int = 1000, options: WorkloadOptions = None, seed: int = 0, repeat: int = 3,
+                  batch: bool = True, jobs: int = 1) -> dict:
+    # Each stage consumes the previous stage's output, so per-stage figures
+    # exclude the work before it
+    options = options or WorkloadOptions()
+    documents = QueryGenerator(options, seed).queries(queries)
+    stages = {}
+
+    token_lists, seconds, peak = measure(lambda: [Scanner(document).scan() for document in documents], repeat)
+    token_lists = [[token for token in tokens if token.type != TokenType.COMMENT] for tokens in token_lists]
+    tokens = sum(len(tokens) for tokens in token_lists)
+    stages["Scanner.scan"] = stage_report(seconds, peak, queries, tokens)
+
+    asts, seconds, peak = measure(lambda: [Parser(tokens).parse() for tokens in token_lists], repeat)
+    stages["Parser.parse"] = stage_report(seconds, peak, queries, tokens)
+    asts, seconds, peak = measure(lambda: [TableParser(tokens).parse() for tokens in token_lists], repeat)
+    stages["TableParser.parse"] = stage_report(seconds, peak, queries, tokens)
+
+    _, seconds, peak = measure(lambda: [Optimizer().optimize(ast) for ast in asts], repeat)
+    stages["Optimizer.optimize"] = stage_report(seconds, peak, queries, tokens)
+    _, seconds, peak = measure(lambda: [CodeGenerator(ast).generate() for ast in asts], repeat)
+    stages["CodeGenerator.generate"] = stage_report(seconds, peak, queries, tokens)
+
+    def write_asts():
+        output = io.StringIO()
+        for ast in asts:
+            write_ast_to_file(ast, output)
+        return output.tell()
+    _, seconds, peak = measure(write_asts, repeat)
+    stages["write_ast_to_file"] = stage_report(seconds, peak, queries, tokens)
+
+    # Reloading saved ASTs, the alternative to scanning and parsing again
+    data, seconds, peak = measure(lambda: encode_asts(asts), repeat)
+    stages["encode_asts"] = stage_report(seconds, peak, queries, tokens)
+    _, seconds, peak = measure(lambda: decode_asts(data), repeat)
+    stages["decode_asts"] = stage_report(seconds, peak, queries, tokens)
+
+    if batch:
+        # The file based drivers, one query per file, with their console output dropped
+        root = tempfile.mkdtemp(prefix="xql_bench_")
+        try:
+            input_dir = os.path.join(root, "input")
+            os.makedirs(input_dir)
+            for index, document in enumerate(documents):
+                with open(os.path.join(input_dir, f"gen_{index:06d}.xml"), 'w') as f:
+                    f.write(document)
+            lexer_dir, parser_dir, codegen_dir = (os.path.join(root, name) for name in ("lexer", "parser", "codegen"))
+            with contextlib.redirect_stdout(io.StringIO()):
+                _, seconds, peak = measure(lambda: process_folder(input_dir, lexer_dir, jobs=jobs), repeat)
+                stages["tokenizer.process_folder"] = stage_report(seconds, peak, queries, tokens)
+                _, seconds, peak = measure(lambda: process_files(lexer_dir, parser_dir, codegen_dir, jobs=jobs), repeat)
+                stages["parser.process_files"] = stage_report(seconds, peak, queries, tokens)
+        finally:
+            shutil.rmtree(root)
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "compiler_version": COMPILER_VERSION,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "queries": queries,
+            "tokens": tokens,
+            "seed": seed,
+            "repeat": repeat,
+            "jobs": jobs,
+            "options": asdict(options),
+        },
+        "stages": stages,
+    }
+
+def compare_results(baseline: dict, current: dict, threshold: float = 0.1) -> list:
+    # One row per stage in both runs: (stage, baseline q/s, current q/s,
+    # speed ratio, memory ratio, regressed), where a regression is a drop in
+    # throughput of more than threshold
+    rows = []
+    for stage, old in baseline["stages"].items():
+        new = current["stages"].get(stage)
+        if new is None or not old["queries_per_second"] or not new["queries_per_second"]:
+            continue
+        speed = new["queries_per_second"] / old["queries_per_second"]
+        memory = new["peak_memory_bytes"] / old["peak_memory_bytes"] if old["peak_memory_bytes"] else None
+        rows.append((stage, old["queries_per_second"], new["queries_per_second"], speed, memory, speed < 1 - threshold))
+    return rows
+
+def print_report(result: dict):
+    meta = result["meta"]
+    print(f"{meta['queries']} queries, {meta['tokens']} tokens, best of {meta['repeat']}")
+    print(f"{'stage':<26} {'queries/s':>12} {'tokens/s':>14} {'peak memory':>14}")
+    for stage, report in result["stages"].items():
+        print(f"{stage:<26} {report['queries_per_second']:>12,.0f} {report['tokens_per_second']:>14,.0f} "
+              f"{report['peak_memory_bytes'] / 1e6:>11.1f} MB")
+
+def print_comparison(rows):
+    print(f"{'stage':<26} {'before q/s':>12} {'after q/s':>12} {'speed':>7} {'memory':>7}")
+    for stage, old, new, speed, memory, regressed in rows:
+        memory = "-" if memory is None else f"{memory:.2f}x"
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{stage:<26} {old:>12,.0f} {new:>12,.0f} {speed:>6.2f}x {memory:>7}{flag}")
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Benchmark each compiler stage on a synthetic workload')
+    parser.add_argument('--queries', type=int, default=1000,
+                      help='Number of generated queries (default: 1000)')
+    parser.add_argument('--seed', type=int, default=0,
+                      help='Random seed of the workload (default: 0)')
+    parser.add_argument('--repeat', type=int, default=3,
+                      help='Runs per stage, the fastest is reported (default: 3)')
+    parser.add_argument('--jobs', type=int, default=1,
+                      help='Worker processes for the batch drivers (default: 1)')
+    parser.add_argument('--no-batch', action='store_true',
+                      help='Skip the file based batch drivers')
+    parser.add_argument('--output', default=None,
+                      help='Write the results to this JSON file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), default=None,
+                      help='Compare two result files instead of running; exits with 1 on a regression')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                      help='Throughput drop reported as a regression (default: 0.1)')
+    add_workload_arguments(parser)
+
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        rows = compare_results(baseline, current, args.threshold)
+        print_comparison(rows)
+        sys.exit(1 if any(row[-1] for row in rows) else 0)
+
+    result = run_benchmark(args.queries, workload_options(args), args.seed, args.repeat, not args.no_batch, args.jobs)
+    print_report(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\nResults written to {args.output}")
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+
+from cache import COMPILER_VERSION
+
+MANIFEST_NAME = ".manifest.json"
+
+def file_hash(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_state(path: str) -> dict:
+    stat = os.stat(path)
+    return {"hash": file_hash(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def state_matches(path: str, state: dict) -> bool:
+    # Same size and mtime is taken as unchanged without reading the file;
+    # otherwise the content hash decides, so a touched file is not rebuilt
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    if stat.st_size != state["size"]:
+        return False
+    if stat.st_mtime_ns == state["mtime_ns"]:
+        return True
+    if file_hash(path) != state["hash"]:
+        return False
+    state["mtime_ns"] = stat.st_mtime_ns
+    return True
+
+class Manifest:
+    """Build record of one batch stage, kept next to its outputs.
+
+    Each input is recorded with its content hash, its outputs and their
+    hashes, and the error it failed with. The whole record is dropped when
+    the compiler version or the stage options change.
+    """
+    def __init__(self, path: str, stage: str, options: dict = None):
+        self.path = path
+        self.header = {"stage": stage, "version": COMPILER_VERSION, "options": options or {}}
+        self.files = {}
+        self.changed = False
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+        if isinstance(data, dict) and data.get("header") == self.header:
+            self.files = data.get("files", {})
+        elif data is not None:
+            # Outputs of an incompatible build are not trusted, only cleaned up
+            self.files = {name: {"outputs": entry.get("outputs", {})} for name, entry in data.get("files", {}).items()}
+            self.changed = True
+
+    def is_fresh(self, name: str, input_path: str) -> bool:
+        entry = self.files.get(name)
+        if entry is None or "input" not in entry:
+            return False
+        if not state_matches(input_path, entry["input"]):
+            return False
+        return all(state_matches(path, state) for path, state in entry["outputs"].items())
+
+    def error(self, name: str):
+        return self.files[name].get("error")
+
+    def remove_outputs(self, name: str):
+        # Delete everything a previous build of this input produced
+        entry = self.files.get(name)
+        if entry is None:
+            return
+        for path in entry["outputs"]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def record(self, name: str, input_path: str, outputs, error=None):
+        self.files[name] = {
+            "input": file_state(input_path),
+            "outputs": {path: file_state(path) for path in outputs if os.path.exists(path)},
+            "error": error,
+        }
+        self.changed = True
+
+    def remove_stale(self, names):
+        # Drop inputs that no longer exist, along with their outputs
+        removed = [name for name in self.files if name not in names]
+        for name in removed:
+            self.remove_outputs(name)
+            del self.files[name]
+        if removed:
+            self.changed = True
+        return removed
+
+    def save(self):
+        if not self.changed:
+            return
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({"header": self.header, "files": self.files}, f)
+        os.replace(temp_path, self.path)
+        self.changed = False
+
+def incremental_build(manifest: Manifest, filenames, input_dir: str, outputs_for):
+    # Split filenames into those to rebuild and those already up to date;
+    # outputs of the rebuilt ones are removed first so only fresh files remain.
+    manifest.remove_stale(set(filenames))
+    dirty, fresh = [], []
+    for filename in filenames:
+        if manifest.is_fresh(filename, os.path.join(input_dir, filename)):
+            fresh.append(filename)
+        else:
+            manifest.remove_outputs(filename)
+            for path in outputs_for(filename):
+                if os.path.exists(path):
+                    os.remove(path)
+            dirty.append(filename)
+    return dirty, fresh
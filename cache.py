@@ -0,0 +1,104 @@
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+
+# Part of every cache key: bump it whenever tokens, ASTs or generated SQL
+# change, so outcomes cached by an older compiler are never reused
+COMPILER_VERSION = "4"
+
+def normalize_source(source) -> bytes:
+    # str and UTF-8 bytes of the same document share a key; the bytes are
+    # hashed exactly, since any whitespace can change an error message
+    if isinstance(source, str):
+        source = source.encode('utf-8')
+    return bytes(source)
+
+def cache_key(source, namespace: str = "sql") -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{COMPILER_VERSION}\0{namespace}\0".encode())
+    digest.update(normalize_source(source))
+    return digest.hexdigest()
+
+class CompilationCache:
+    """Content-addressed cache of compilation outcomes.
+
+    Entries live in a bounded in-process LRU and, when a path is given, in a
+    SQLite file that survives restarts and can be shared between processes.
+    Values must be JSON serializable.
+    """
+    def __init__(self, max_entries: int = 1024, path: str = None):
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.db = None
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS outcomes (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def get(self, key: str):
+        # Returns the cached value, or None on a miss
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+        if self.db is not None:
+            row = self.db.execute("SELECT value FROM outcomes WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                value = json.loads(row[0])
+                self.remember(key, value)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value):
+        self.remember(key, value)
+        if self.db is not None:
+            self.db.execute("INSERT OR REPLACE INTO outcomes (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def remember(self, key: str, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+        }
+
+    def clear(self):
+        self.entries.clear()
+        if self.db is not None:
+            self.db.execute("DELETE FROM outcomes")
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+@functools.lru_cache(maxsize=None)
+def shared_cache(path: str) -> CompilationCache:
+    # One cache per process and path, so batch workers keep their memory tier
+    # between files and share the disk tier through the SQLite file
+    return CompilationCache(path=path)
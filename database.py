@@ -0,0 +1,414 @@
+import contextlib
+import itertools
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Union
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from parser import CodeGenError, QueryNode, generate_sql_from_ast, generate_sql_from_xml, optimize_ast
+from template import Template, batch_columns
+
+# Numbers the shared-cache memory databases of ":memory:" pools
+MEMORY_DATABASES = itertools.count()
+
+class StatementCache:
+    """LRU of the SQL texts prepared on one connection.
+
+    sqlite3 keeps up to cached_statements prepared statements per
+    connection, least recently used first out, keyed by SQL text. This
+    mirrors that cache with the same capacity so its hits, misses and
+    evictions can be reported.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def use(self, sql: str) -> bool:
+        # Record one execution of sql; True when it was already prepared
+        if sql in self.entries:
+            self.entries.move_to_end(sql)
+            self.hits += 1
+            return True
+        self.misses += 1
+        self.entries[sql] = None
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return False
+
+class PooledConnection:
+    """A SQLite connection of a ConnectionPool with its statement cache."""
+    def __init__(self, connection: sqlite3.Connection, capacity: int):
+        self.connection = connection
+        self.statements = StatementCache(capacity)
+
+    def execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        # A statement that fails to prepare is not cached, so count it after
+        cursor = self.connection.execute(sql, parameters)
+        self.statements.use(sql)
+        return cursor
+
+class ConnectionPool:
+    """At most size connections to one SQLite database, shared by threads.
+
+    Connections are opened on first demand and kept open; acquire blocks
+    while all of them are in use and raises TimeoutError after timeout
+    seconds. ":memory:" is opened as a named shared-cache memory database,
+    so every connection of the pool sees the same tables. It lives as long
+    as the pool keeps a connection open, and a write to it fails with
+    "database table is locked" while another connection reads that table.
+    """
+    def __init__(self, path: str = ":memory:", size: int = 4, cached_statements: int = 128,
+                 timeout: float = 30.0):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.path = path
+        self.size = size
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self.uri = f"file:xql-memory-{next(MEMORY_DATABASES)}?mode=memory&cache=shared" if path == ":memory:" else None
+        self.connections = []
+        self.idle = []
+        self.waits = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def connect(self) -> PooledConnection:
+        if self.uri is not None:
+            connection = sqlite3.connect(self.uri, uri=True, check_same_thread=False,
+                                         cached_statements=self.cached_statements)
+        else:
+            connection = sqlite3.connect(self.path, check_same_thread=False,
+                                         cached_statements=self.cached_statements)
+        return PooledConnection(connection, self.cached_statements)
+
+    def acquire(self, timeout: Optional[float] = None) -> PooledConnection:
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        waited = False
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise ValueError("Connection pool is closed")
+                if self.idle:
+                    return self.idle.pop()
+                if len(self.connections) < self.size:
+                    # Opened while holding the lock; opening SQLite connections is quick
+                    pooled = self.connect()
+                    self.connections.append(pooled)
+                    return pooled
+                if not waited:
+                    self.waits += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.condition.wait(remaining):
+                    raise TimeoutError(f"No connection available within {timeout} seconds")
+
+    def release(self, pooled: PooledConnection):
+        with self.condition:
+            if self.closed:
+                pooled.connection.close()
+                return
+            # Roll back a transaction left open by a connection() user, so the
+            # next user starts clean; ResultStream commits its own changes
+            if pooled.connection.in_transaction:
+                pooled.connection.rollback()
+            self.idle.append(pooled)
+            self.condition.notify()
+
+    @contextlib.contextmanager
+    def connection(self):
+        pooled = self.acquire()
+        try:
+            yield pooled
+        finally:
+            self.release(pooled)
+
+    def close(self):
+        # Close the idle connections now and the others when they are released
+        with self.condition:
+            self.closed = True
+            for pooled in self.idle:
+                pooled.connection.close()
+            self.idle.clear()
+            self.condition.notify_all()
+
+class ResultStream:
+    """Rows read from a cursor as they are iterated.
+
+    Holds its pool connection until the rows run out or close() is called,
+    so read it to the end or use it as a context manager.
+    """
+    def __init__(self, pool: ConnectionPool, pooled: PooledConnection, rows, cursor: sqlite3.Cursor = None):
+        self.pool = pool
+        self.pooled = pooled
+        self.rows = rows
+        self.cursor = cursor
+
+    @property
+    def columns(self) -> list:
+        if self.cursor is None or self.cursor.description is None:
+            return []
+        return [description[0] for description in self.cursor.description]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.rows is None:
+            raise StopIteration
+        try:
+            return next(self.rows)
+        except StopIteration:
+            self.close()
+            raise
+        except BaseException:
+            self.close(commit=False)
+            raise
+
+    def close(self, commit: bool = True):
+        # A data change made by the statement is committed when the stream
+        # ends normally and rolled back when an error ends it
+        if self.rows is not None:
+            rows, self.rows = self.rows, None
+            connection = self.pooled.connection
+            try:
+                rows.close()
+                if connection.in_transaction:
+                    if commit:
+                        connection.commit()
+                    else:
+                        connection.rollback()
+            finally:
+                self.pool.release(self.pooled)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(commit=exc_type is None)
+
+    def __del__(self):
+        self.close()
+
+class Database:
+    """Runs generated SQL on a SQLite file or ":memory:" database.
+
+    Statements go through a ConnectionPool of pool_size connections, each
+    keeping its last cached_statements prepared statements, so repeated
+    query texts are not compiled again. Results stream back from the
+    cursor one row at a time. An INSERT, UPDATE or DELETE run by execute
+    is committed once its stream is read to the end or closed.
+    """
+    def __init__(self, path: str = ":memory:", pool_size: int = 4, cached_statements: int = 128,
+                 timeout: float = 30.0):
+        self.pool = ConnectionPool(path, pool_size, cached_statements, timeout)
+
+    def execute(self, sql: str, parameters=()) -> ResultStream:
+        pooled = self.pool.acquire()
+        try:
+            cursor = pooled.execute(sql, parameters)
+        except BaseException:
+            self.pool.release(pooled)
+            raise
+        return ResultStream(self.pool, pooled, cursor, cursor)
+
+    def fetchall(self, sql: str, parameters=()) -> list:
+        with self.execute(sql, parameters) as rows:
+            return list(rows)
+
+    def execute_ast(self, ast: QueryNode, optimize: bool = False) -> ResultStream:
+        return self.execute(generate_sql_from_ast(optimize_ast(ast) if optimize else ast))
+
+    def execute_xml(self, source: Union[str, bytes], cache=None, optimize: bool = False) -> ResultStream:
+        return self.execute(generate_sql_from_xml(source, cache, optimize))
+
+    def execute_template(self, template: Template, values: Optional[dict] = None, **params) -> ResultStream:
+        # Bind the parameters instead of rendering them into the SQL text, so
+        # every call of a template reuses one prepared statement
+        if values is not None:
+            params = {**values, **params}
+        missing = [name for name in template.names if name not in params]
+        if missing:
+            raise ValueError(f"Missing template parameter(s): {', '.join(missing)}")
+        sql, order = template.parameterized()
+        return self.execute(sql, [params[name] for name in order])
+
+    def execute_batch(self, template: Template, columns: dict) -> ResultStream:
+        """Run template once per row of columns on one connection.
+
+        columns is given as to Template.iter_batch. Every row binds its
+        values to the same prepared statement; the stream yields
+        (row number, result row) pairs in row order.
+        """
+        sql, order = template.parameterized()
+        rows = parameter_rows(template, order, columns)
+        pooled = self.pool.acquire()
+        return ResultStream(self.pool, pooled, batch_results(pooled, sql, rows))
+
+    def executemany(self, sql: str, rows) -> int:
+        # Insert, update or delete with one execution per parameter row,
+        # committed together; returns the number of rows changed
+        with self.pool.connection() as pooled:
+            pooled.statements.use(sql)
+            with pooled.connection:
+                return pooled.connection.executemany(sql, rows).rowcount
+
+    def executescript(self, script: str):
+        with self.pool.connection() as pooled:
+            pooled.connection.executescript(script)
+
+    @contextlib.contextmanager
+    def connection(self):
+        # A pooled sqlite3.Connection for setup, e.g. executor.create_sqlite_tables
+        with self.pool.connection() as pooled:
+            yield pooled.connection
+
+    def stats(self) -> dict:
+        with self.pool.condition:
+            caches = [pooled.statements for pooled in self.pool.connections]
+            return {
+                "connections": len(self.pool.connections),
+                "idle": len(self.pool.idle),
+                "waits": self.pool.waits,
+                "statement_hits": sum(cache.hits for cache in caches),
+                "statement_misses": sum(cache.misses for cache in caches),
+                "statement_evictions": sum(cache.evictions for cache in caches),
+            }
+
+    def close(self):
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def parameter_rows(template: Template, order, columns: dict):
+    # One tuple of bound values per row, in placeholder order. A single
+    # value is used for every row, as in Template.iter_batch.
+    _, sequences, count = batch_columns(template.names, columns)
+    values = []
+    for name in template.names:
+        if name in sequences:
+            column = sequences[name]
+            values.append(column.tolist() if numpy is not None and isinstance(column, numpy.ndarray) else column)
+        else:
+            value = columns[name]
+            values.append(itertools.repeat(value.item() if numpy is not None and isinstance(value, numpy.generic)
+                                           else value, count))
+    rows = zip(*values)
+    if tuple(order) == template.names:
+        return rows
+    positions = [template.names.index(name) for name in order]
+    return (tuple(row[position] for position in positions) for row in rows)
+
+def batch_results(pooled: PooledConnection, sql: str, rows):
+    cursor = None
+    try:
+        for number, parameters in enumerate(rows):
+            cursor = pooled.execute(sql, parameters)
+            for row in cursor:
+                yield number, row
+    finally:
+        if cursor is not None:
+            cursor.close()
+
+def run_load(database: Database, statements: list, requests: int = 10000, threads: int = 8) -> dict:
+    """Execute requests statements, in rotation, from threads threads and time each one."""
+    from loadgen import percentile
+
+    counter = itertools.count()
+    latencies = []
+    outcomes = {"rows": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            index = next(counter)
+            if index >= requests:
+                return
+            start = time.perf_counter()
+            try:
+                with database.execute(statements[index % len(statements)]) as rows:
+                    count = sum(1 for _ in rows)
+                error = 0
+            except sqlite3.Error:
+                count, error = 0, 1
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                outcomes["rows"] += count
+                outcomes["errors"] += error
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "rows": outcomes["rows"],
+        "errors": outcomes["errors"],
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        **database.stats(),
+    }
+
+if __name__ == "__main__":
+    import argparse
+
+    from loadgen import load_documents
+
+    parser = argparse.ArgumentParser(description='Run the translated queries against a SQLite database and time them')
+    parser.add_argument('--database', default=':memory:',
+                      help='SQLite database file (default: :memory:)')
+    parser.add_argument('--setup', default=None,
+                      help='SQL script run once before the load, e.g. to create and fill the tables')
+    parser.add_argument('--input', default='./tests',
+                      help='Directory of XML queries to run, in rotation (default: ./tests)')
+    parser.add_argument('--requests', type=int, default=10000,
+                      help='Total number of statements to run (default: 10000)')
+    parser.add_argument('--threads', type=int, default=8,
+                      help='Number of client threads (default: 8)')
+    parser.add_argument('--pool-size', type=int, default=4,
+                      help='Maximum number of SQLite connections (default: 4)')
+    parser.add_argument('--cached-statements', type=int, default=128,
+                      help='Prepared statements kept per connection (default: 128)')
+    parser.add_argument('--optimize', action='store_true',
+                      help='Run the optimizer pass before generating SQL')
+
+    args = parser.parse_args()
+    statements = []
+    for document in load_documents(args.input):
+        try:
+            statements.append(generate_sql_from_xml(document, optimize=args.optimize))
+        except (ValueError, SyntaxError, CodeGenError) as e:
+            print(f"Skipping a query that does not translate: {e}")
+    if not statements:
+        raise SystemExit("No query translated")
+
+    with Database(args.database, args.pool_size, args.cached_statements) as database:
+        if args.setup is not None:
+            with open(args.setup) as f:
+                database.executescript(f.read())
+        report = run_load(database, statements, args.requests, args.threads)
+    for name, value in report.items():
+        print(f"{name}: {value}")
@@ -0,0 +1,411 @@
+import math
+import re
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from parser import (AliasNode, BracketNode, CodeGenerator, ComparisonNode, FunctionNode, InNode, LogicalNode,
+                    ParamNode, QueryNode, TableColumnRef, optimize_ast, parse_xml_string)
+
+# Text that SQLite turns into a number when it is compared with a numeric column
+NUMERIC_TEXT = re.compile(r"\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*")
+
+COMPARISONS = {"eq": "equal", "ne": "not_equal", "gt": "greater", "ge": "greater_equal", "lt": "less", "le": "less_equal"}
+
+class ExecutionError(Exception):
+    """Exception raised when a query cannot run against a catalog"""
+    def __init__(self, message):
+        self.message = message
+        super().__init__(message)
+
+@dataclass
+class ResultSet:
+    """Rows of a query as one NumPy array per output column."""
+    names: Tuple[str, ...]
+    columns: Tuple['numpy.ndarray', ...]
+
+    def __len__(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def rows(self) -> list:
+        # As sqlite3 returns them: a list of tuples of Python values
+        return list(zip(*(column.tolist() for column in self.columns)))
+
+class Rows:
+    """Rows of the FROM tables as an index array per table, None for all of them."""
+    def __init__(self, executor: 'Executor', indices: dict, count: int):
+        self.executor = executor
+        self.indices = indices
+        self.count = count
+        self.gathered = {}
+
+    def column(self, table: str, name: str):
+        key = (table, name)
+        if key not in self.gathered:
+            values = self.executor.tables[table][name]
+            index = self.indices[table]
+            self.gathered[key] = values if index is None else values[index]
+        return self.gathered[key]
+
+    def codes(self, table: str, name: str):
+        # (codes of the values in sorted order, number of codes). After
+        # a join a table's rows repeat, so its own column is sorted instead
+        # when that is smaller.
+        values = self.executor.tables[table][name]
+        index = self.indices[table]
+        if (values.dtype.kind in "bi" or values.dtype.kind == "u" and values.dtype.itemsize < 8) and len(values):
+            # Integers in a small range are their own codes, without sorting
+            low, high = int(values.min()), int(values.max())
+            if high - low <= 4 * len(values):
+                codes = self.column(table, name).astype(numpy.intp)
+                return codes - low if low else codes, high - low + 1
+        if index is not None and len(index) > len(values):
+            uniques, inverse = numpy.unique(values, return_inverse=True)
+            return inverse.reshape(-1)[index], len(uniques)
+        uniques, inverse = numpy.unique(self.column(table, name), return_inverse=True)
+        return inverse.reshape(-1), len(uniques)
+
+    def filter(self, mask) -> 'Rows':
+        selected = numpy.flatnonzero(mask)
+        indices = {table: selected if index is None else index[selected] for table, index in self.indices.items()}
+        return Rows(self.executor, indices, len(selected))
+
+    def operand(self, scope: 'Scope', operand):
+        # (values, affinity) of a WHERE operand
+        if isinstance(operand, FunctionNode):
+            raise ExecutionError(f"misuse of aggregate function {operand.name}()")
+        table, name = scope.resolve(operand)
+        return self.column(table, name), scope.affinity(table, name)
+
+class Groups:
+    """The rows of a Rows split by the values of the GROUP BY columns.
+
+    Without GROUP BY all rows form one group, even when there are none.
+    """
+    def __init__(self, rows: Rows, keys):
+        self.rows = rows
+        self.keys = tuple(keys)
+        if not self.keys:
+            self.inverse = numpy.zeros(rows.count, dtype=numpy.intp)
+            self.first = numpy.zeros(min(rows.count, 1), dtype=numpy.intp)
+            self.count = 1
+        else:
+            # Each key column becomes codes, combined into one code per row in
+            # mixed radix; the codes that occur are then renumbered densely
+            inverse, count = rows.codes(*self.keys[0])
+            for key in self.keys[1:]:
+                codes, size = rows.codes(*key)
+                if count * size >= 2 ** 62:
+                    uniques, inverse = numpy.unique(inverse, return_inverse=True)
+                    inverse, count = inverse.reshape(-1), len(uniques)
+                inverse = inverse * size + codes
+                count *= size
+            if count <= 4 * max(rows.count, 1):
+                present = numpy.bincount(inverse, minlength=count) > 0
+                inverse = (numpy.cumsum(present) - 1)[inverse]
+                count = int(present.sum())
+            else:
+                uniques, inverse = numpy.unique(inverse, return_inverse=True)
+                inverse, count = inverse.reshape(-1), len(uniques)
+            self.inverse = inverse
+            self.count = count
+            # The first row of each group: assigned in reverse, the first write wins last
+            self.first = numpy.empty(count, dtype=numpy.intp)
+            self.first[inverse[::-1]] = numpy.arange(rows.count - 1, -1, -1)
+        self.sizes = numpy.bincount(self.inverse, minlength=self.count)
+
+    def operand(self, scope: 'Scope', operand):
+        # (values per group, affinity); aggregates have no affinity
+        if isinstance(operand, FunctionNode):
+            return self.aggregate(scope, operand), None
+        key = scope.resolve(operand)
+        if key not in self.keys:
+            name = operand if isinstance(operand, str) else f"{operand.table}.{operand.column}"
+            raise ExecutionError(f"Column {name} must appear in GROUP BY or be used in an aggregate function")
+        return self.rows.column(*key)[self.first], scope.affinity(*key)
+
+    def aggregate(self, scope: 'Scope', node: FunctionNode):
+        name = node.name.lower()
+        if len(node.arguments) != 1:
+            raise ExecutionError(f"Wrong number of arguments to function {name}()")
+        argument = node.arguments[0]
+        if name == "count":
+            # Columns hold no NULLs, so count(column) is count(*)
+            if argument != "*":
+                scope.resolve(argument)
+            return self.sizes
+        if name == "max":
+            values = self.rows.column(*scope.resolve(argument))
+            if self.rows.count == 0:
+                return numpy.array([None] * self.count, dtype=object)
+            if values.dtype.kind == "U":
+                # The last row of each group once sorted by group, then value
+                order = numpy.lexsort((values, self.inverse))
+                return values[order[numpy.cumsum(self.sizes) - 1]]
+            result = values[self.first].copy()
+            numpy.maximum.at(result, self.inverse, values)
+            return result
+        raise ExecutionError(f"Unsupported function {name}()")
+
+class Scope:
+    """Resolves column names against the tables of one FROM clause."""
+    def __init__(self, executor: 'Executor', tables):
+        self.executor = executor
+        self.tables = tuple(tables)
+        for table in self.tables:
+            if table not in executor.tables:
+                raise ExecutionError(f"no such table: {table}")
+        if len(set(self.tables)) != len(self.tables):
+            raise ExecutionError("A table may only appear once in FROM")
+
+    def resolve(self, operand) -> Tuple[str, str]:
+        if isinstance(operand, TableColumnRef):
+            table, name = operand.table, operand.column
+        elif isinstance(operand, str):
+            table, _, name = operand.strip('"').strip("'").rpartition(".")
+        elif isinstance(operand, ParamNode):
+            raise ExecutionError(f"Unbound parameter '{operand.name}'")
+        else:
+            raise ExecutionError(f"Unsupported operand {type(operand).__name__}")
+        if table:
+            if table not in self.tables or name not in self.executor.tables[table]:
+                raise ExecutionError(f"no such column: {table}.{name}")
+            return table, name
+        matches = [table for table in self.tables if name in self.executor.tables[table]]
+        if not matches:
+            raise ExecutionError(f"no such column: {name}")
+        if len(matches) > 1:
+            raise ExecutionError(f"ambiguous column name: {name}")
+        return matches[0], name
+
+    def affinity(self, table: str, name: str) -> str:
+        return "text" if self.executor.tables[table][name].dtype.kind == "U" else "numeric"
+
+    def tables_of(self, condition) -> set:
+        # Tables whose columns a condition reads
+        tables = set()
+        stack = [condition]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, LogicalNode):
+                stack.extend(node.operands)
+            elif isinstance(node, BracketNode):
+                stack.append(node.expression)
+            elif isinstance(node, ComparisonNode) and not isinstance(node.left, FunctionNode):
+                tables.add(self.resolve(node.left)[0])
+            elif isinstance(node, InNode):
+                tables.add(self.resolve(node.column)[0])
+        return tables
+
+class Executor:
+    """Runs parsed queries against in-memory tables of NumPy columns.
+
+    catalog maps each table name to a mapping of column names to
+    one-dimensional arrays of the same length: integers, floats, booleans
+    or strings, without NULLs (NaN is not supported either). Conditions are
+    evaluated as boolean masks over whole columns, and those on a single
+    table before the FROM tables are joined. GROUP BY, count and max run as
+    vectorized group operations, HAVING masks the groups and ORDER BY sorts
+    with argsort.
+
+    Results match SQLite on the same data loaded by create_sqlite_tables,
+    including its type affinity rules for comparisons: rows are the same
+    multiset, in the same order of the ORDER BY column, with ties in either
+    order. A selected column that is neither grouped nor aggregated raises
+    ExecutionError, where SQLite takes it from an arbitrary row.
+    """
+    def __init__(self, catalog: dict):
+        if numpy is None:
+            raise ImportError("The executor needs NumPy")
+        self.tables = {}
+        self.sizes = {}
+        for table, columns in catalog.items():
+            arrays = {name: numpy.asarray(values) for name, values in columns.items()}
+            for name, values in arrays.items():
+                if values.ndim != 1 or values.dtype.kind not in "biufU":
+                    raise ValueError(f"Column {table}.{name} must be a one-dimensional array of numbers or strings")
+            lengths = {len(values) for values in arrays.values()}
+            if len(lengths) > 1:
+                raise ValueError(f"Columns of table {table} differ in length")
+            self.tables[table] = arrays
+            self.sizes[table] = lengths.pop() if lengths else 0
+
+    def execute(self, ast: QueryNode) -> ResultSet:
+        scope = Scope(self, ast.from_.tables)
+        rows = self.select_rows(scope, ast.where.condition if ast.where else None)
+
+        columns = [column.value for column in ast.select.columns]
+        expressions = [column.expression if isinstance(column, AliasNode) else column for column in columns]
+        grouped = ast.group_by is not None or any(isinstance(expression, FunctionNode) for expression in expressions)
+        if ast.having and not grouped:
+            raise ExecutionError("HAVING clause on a non-aggregate query")
+        if grouped:
+            keys = [scope.resolve(column) for column in ast.group_by.columns] if ast.group_by else []
+            context = Groups(rows, keys)
+        else:
+            context = rows
+
+        names, outputs, aliases = [], [], {}
+        generator = CodeGenerator(None)
+        for column, expression in zip(columns, expressions):
+            if expression == "*":
+                if grouped:
+                    raise ExecutionError("SELECT * cannot be used with aggregates or GROUP BY")
+                for table in scope.tables:
+                    for name in self.tables[table]:
+                        names.append(name)
+                        outputs.append(rows.column(table, name))
+                continue
+            values, _ = context.operand(scope, expression)
+            if isinstance(column, AliasNode):
+                name = column.alias.strip('"').strip("'")
+                aliases.setdefault(name, len(outputs))
+            elif isinstance(expression, FunctionNode):
+                name = generator.process_function(expression)
+            else:
+                name = expression.rpartition(".")[2]
+            names.append(name)
+            outputs.append(values)
+
+        # ORDER BY names an output alias or a column, as in SQLite
+        key = None
+        if ast.order_by:
+            column = ast.order_by.column
+            key = outputs[aliases[column]] if column in aliases else context.operand(scope, column)[0]
+        if ast.having:
+            mask = condition_mask(ast.having.condition, scope, context)
+            outputs = [values[mask] for values in outputs]
+            key = None if key is None else key[mask]
+        if key is not None:
+            order = numpy.argsort(key, kind="stable")
+            if ast.order_by.direction.lower() == "desc":
+                order = order[::-1]
+            outputs = [values[order] for values in outputs]
+        return ResultSet(tuple(names), tuple(outputs))
+
+    def select_rows(self, scope: Scope, condition) -> Rows:
+        # The rows of the FROM tables that pass the WHERE condition. The
+        # parts of an AND that read a single table filter that table before
+        # the join; the rest are applied to the joined rows.
+        parts = {table: Rows(self, {table: None}, self.sizes[table]) for table in scope.tables}
+        late = []
+        if condition is not None:
+            for conjunct in conjuncts(condition):
+                tables = scope.tables_of(conjunct) if len(parts) > 1 else set(parts)
+                if len(tables) == 1:
+                    table, = tables
+                    parts[table] = parts[table].filter(condition_mask(conjunct, scope, parts[table]))
+                else:
+                    late.append(conjunct)
+        rows = cross_join(list(parts.values()))
+        for conjunct in late:
+            rows = rows.filter(condition_mask(conjunct, scope, rows))
+        return rows
+
+def cross_join(parts) -> Rows:
+    # One Rows per table in, their cross product out; the first table varies
+    # slowest, like nested loops
+    if len(parts) == 1:
+        return parts[0]
+    counts = [part.count for part in parts]
+    total = math.prod(counts)
+    indices = {}
+    for position, part in enumerate(parts):
+        (table, index), = part.indices.items()
+        index = numpy.arange(part.count) if index is None else index
+        inner = math.prod(counts[position + 1:])
+        outer = math.prod(counts[:position])
+        indices[table] = numpy.tile(numpy.repeat(index, inner), outer)
+    return Rows(parts[0].executor, indices, total)
+
+def conjuncts(condition) -> list:
+    # The operands of a top-level AND, through brackets
+    result = []
+    stack = [condition]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, BracketNode):
+            stack.append(node.expression)
+        elif isinstance(node, LogicalNode) and node.operator == "and":
+            stack.extend(reversed(node.operands))
+        else:
+            result.append(node)
+    return result
+
+def condition_mask(condition, scope: Scope, context):
+    # Boolean mask of a condition over the rows or groups of context, with
+    # an explicit stack like CodeGenerator.condition_fragments
+    masks = []
+    stack = [condition]
+    while stack:
+        node = stack.pop()
+        if type(node) is tuple:
+            operator, count = node
+            operands = masks[len(masks) - count:]
+            del masks[len(masks) - count:]
+            combine = numpy.logical_and if operator == "and" else numpy.logical_or
+            masks.append(combine.reduce(operands))
+        elif isinstance(node, BracketNode):
+            stack.append(node.expression)
+        elif isinstance(node, LogicalNode):
+            stack.append((node.operator, len(node.operands)))
+            stack.extend(reversed(node.operands))
+        elif isinstance(node, ComparisonNode):
+            values, affinity = context.operand(scope, node.left)
+            masks.append(compare(values, affinity, node.operator, constant(node.right)))
+        elif isinstance(node, InNode):
+            values, affinity = context.operand(scope, node.column)
+            masks.append(numpy.logical_or.reduce([compare(values, affinity, "eq", constant(value)) for value in node.values]))
+        else:
+            raise ExecutionError(f"Unsupported condition {type(node).__name__}")
+    return masks[0]
+
+def constant(value):
+    if isinstance(value, ParamNode):
+        raise ExecutionError(f"Unbound parameter '{value.name}'")
+    if isinstance(value, str):
+        # As the code generator writes it
+        return value.strip('"').strip("'")
+    return value
+
+def compare(values, affinity: Optional[str], operator: str, value):
+    # SQLite rules: a numeric column turns numeric text into a number and a
+    # text column turns a number into text; otherwise numbers sort before text
+    if operator not in COMPARISONS:
+        raise ExecutionError(f"Unsupported operator {operator}")
+    if affinity == "numeric" and isinstance(value, str) and NUMERIC_TEXT.fullmatch(value):
+        number = float(value)
+        value = int(number) if number.is_integer() and abs(number) < 2 ** 63 else number
+    elif affinity == "text" and isinstance(value, int):
+        value = str(value)
+    if values.dtype.kind == "O":
+        # max() of no rows is NULL, which compares as false
+        return numpy.zeros(len(values), dtype=bool)
+    if (values.dtype.kind == "U") == isinstance(value, str):
+        return getattr(numpy, COMPARISONS[operator])(values, value)
+    text_side_greater = operator in ("lt", "le", "ne") if isinstance(value, str) else operator in ("gt", "ge", "ne")
+    return numpy.full(len(values), text_side_greater)
+
+def execute(ast: QueryNode, catalog: dict) -> ResultSet:
+    return Executor(catalog).execute(ast)
+
+def execute_xml(source, catalog: dict, optimize: bool = False) -> ResultSet:
+    ast = parse_xml_string(source)
+    return Executor(catalog).execute(optimize_ast(ast) if optimize else ast)
+
+def create_sqlite_tables(connection, catalog: dict):
+    # Load a catalog into SQLite with the column types the executor assumes
+    for table, columns in catalog.items():
+        arrays = {name: numpy.asarray(values) for name, values in columns.items()}
+        types = {name: "TEXT" if values.dtype.kind == "U" else "REAL" if values.dtype.kind == "f" else "INTEGER"
+                 for name, values in arrays.items()}
+        definition = ", ".join(f'"{name}" {kind}' for name, kind in types.items())
+        connection.execute(f'CREATE TABLE "{table}" ({definition})')
+        placeholders = ", ".join("?" * len(arrays))
+        connection.executemany(f'INSERT INTO "{table}" VALUES ({placeholders})',
+                               zip(*(values.tolist() for values in arrays.values())))
+    connection.commit()
@@ -0,0 +1,107 @@
+import contextlib
+import cProfile
+import io
+import json
+import pstats
+import time
+
+# Shared by every stage of a run without instrumentation, so a disabled
+# stage costs one function call and an empty with block
+NULL_STAGE = contextlib.nullcontext()
+
+class FileProfile:
+    """Stage timings and counters of one input file.
+
+    Filled in by the worker that processes the file and sent back with its
+    result, so it works the same with a process pool.
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.stages = {}
+        self.counts = {}
+        self.error = None
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name: str, amount: int):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def as_dict(self) -> dict:
+        return {"file": self.filename, "stages": self.stages, "counts": self.counts, "error": self.error}
+
+def timed(profile, name: str):
+    # with timed(profile, "scan"): ... times the block only when profiling
+    return NULL_STAGE if profile is None else profile.stage(name)
+
+class Observer:
+    """Receives the measurements of a batch run; every hook is optional.
+
+    run is "tokenize" or "parse". file_done gets the FileProfile.as_dict()
+    of each processed file, in input order.
+    """
+    def start_run(self, run: str, filenames):
+        pass
+
+    def file_done(self, run: str, profile: dict):
+        pass
+
+    def end_run(self, run: str, seconds: float):
+        pass
+
+class ProfileReport(Observer):
+    """Collects per-file and total figures of one or more runs as JSON."""
+    def __init__(self):
+        self.runs = {}
+
+    def start_run(self, run: str, filenames):
+        self.runs[run] = {"files": [], "stages": {}, "counts": {}, "errors": 0, "seconds": None}
+
+    def file_done(self, run: str, profile: dict):
+        summary = self.runs[run]
+        summary["files"].append(profile)
+        for name, seconds in profile["stages"].items():
+            summary["stages"][name] = summary["stages"].get(name, 0.0) + seconds
+        for name, amount in profile["counts"].items():
+            summary["counts"][name] = summary["counts"].get(name, 0) + amount
+        if profile["error"] is not None:
+            summary["errors"] += 1
+
+    def end_run(self, run: str, seconds: float):
+        self.runs[run]["seconds"] = seconds
+
+    def write(self, path: str, profiler: cProfile.Profile = None, top: int = 25):
+        report = {"runs": self.runs}
+        if profiler is not None:
+            # The slowest functions by cumulative time, as pstats prints them
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(top)
+            report["cprofile"] = output.getvalue().splitlines()
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+def notify(observers, method: str, *args):
+    for observer in observers:
+        getattr(observer, method)(*args)
+
+def run_profiled(func, profile_path: str = None, use_cprofile: bool = False, **kwargs):
+    # Run a batch driver for the command line --profile/--cprofile flags.
+    # cProfile only sees the main process, so use it with --jobs 1.
+    if profile_path is None:
+        return func(**kwargs)
+    report = ProfileReport()
+    profiler = cProfile.Profile() if use_cprofile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        return func(observers=[report], **kwargs)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        report.write(profile_path, profiler)
+        print(f"Profile written to {profile_path}")
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import os
+import time
+
+def percentile(sorted_values, fraction: float) -> float:
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def load_documents(folder: str) -> list:
+    documents = []
+    for filename in sorted(os.listdir(folder)):
+        if filename.endswith(".xml"):
+            with open(os.path.join(folder, filename), 'rb') as f:
+                documents.append(f.read())
+    if not documents:
+        raise ValueError(f"No .xml documents found in {folder}")
+    return documents
+
+async def open_connection(host: str, port: int, unix_path: str = None):
+    if unix_path is not None:
+        return await asyncio.open_unix_connection(unix_path)
+    return await asyncio.open_connection(host, port)
+
+async def post(reader, writer, host: str, path: str, body: bytes):
+    # One keep-alive HTTP request; returns (status, decoded JSON body)
+    writer.write((f"POST {path} HTTP/1.1\r\nHost: {host}\r\n"
+                  f"Content-Length: {len(body)}\r\n\r\n").encode('latin-1') + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode('latin-1').partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+async def client(host, port, unix_path, documents, counter, latencies, outcomes):
+    # One connection sending requests back to back until the shared counter runs out
+    reader, writer = await open_connection(host, port, unix_path)
+    try:
+        while counter[0] > 0:
+            counter[0] -= 1
+            document = documents[counter[0] % len(documents)]
+            start = time.perf_counter()
+            status, payload = await post(reader, writer, host, "/translate", document)
+            latencies.append(time.perf_counter() - start)
+            outcomes["sql" if "sql" in payload else "error"] += 1
+    finally:
+        writer.close()
+
+async def run_load(host: str = "127.0.0.1", port: int = 8765, unix_path: str = None,
+                   documents=None, requests: int = 10000, concurrency: int = 64) -> dict:
+    """Send requests over concurrency keep-alive connections and time each one."""
+    counter = [requests]
+    latencies = []
+    outcomes = {"sql": 0, "error": 0}
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, unix_path, documents, counter, latencies, outcomes)
+                           for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "sql": outcomes["sql"],
+        "errors": outcomes["error"],
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Measure latency of a running server.py')
+    parser.add_argument('--host', default='127.0.0.1',
+                      help='Server address (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765,
+                      help='Server port (default: 8765)')
+    parser.add_argument('--unix', default=None,
+                      help='Connect to this Unix socket instead of a TCP port')
+    parser.add_argument('--input', default='./tests',
+                      help='Directory of XML documents to send, in rotation (default: ./tests)')
+    parser.add_argument('--requests', type=int, default=10000,
+                      help='Total number of requests (default: 10000)')
+    parser.add_argument('--concurrency', type=int, default=64,
+                      help='Number of concurrent connections (default: 64)')
+
+    args = parser.parse_args()
+    report = asyncio.run(run_load(args.host, args.port, args.unix, load_documents(args.input),
+                                  args.requests, args.concurrency))
+    for name, value in report.items():
+        print(f"{name}: {value}")
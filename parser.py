@@ -1,7 +1,21 @@
+import base64
+import functools
+import io
+import itertools
+import json
 import os
-from dataclasses import dataclass
-from typing import List, Optional, Union
-from enum import Enum
+import struct
+import sys
+import time
+from array import array
+from dataclasses import dataclass, fields
+from typing import List, Optional, Tuple, Union
+
+from batch import map_files, print_summary, stream_map
+from build import MANIFEST_NAME, Manifest, incremental_build
+from cache import CompilationCache, cache_key, shared_cache
+from instrument import FileProfile, notify, run_profiled, timed
+from tokenizer import ScanError, Scanner, Token, TokenBuffer, TokenType, TokenView, TOKEN_FILE_HEADER, TOKEN_FILE_MAGIC, TOKEN_FILE_VERSION, TOKEN_RECORD, TOKEN_TYPES_BY_CODE
 
 class CodeGenerator:
     def __init__(self, ast):
@@ -84,21 +98,38 @@ class CodeGenerator:
         return "WHERE " + condition
 
     def process_condition(self, node):
-        if isinstance(node, ComparisonNode):
-            left = self.process_operand(node.left)
-            right = self.process_operand(node.right, wrap_strings=True)
-            operator = self.get_operator(node.operator)
-            return f"{left} {operator} {right}"
-        elif isinstance(node, LogicalNode):
-            left = self.process_condition(node.left)
-            right = self.process_condition(node.right)
-            operator = node.operator.upper()
-            return f"({left} {operator} {right})"
-        elif isinstance(node, BracketNode):
-            expr = self.process_condition(node.expression)
-            return f"({expr})"
-        else:
-            raise CodeGenError("Unknown condition node")
+        return "".join(self.condition_fragments(node))
+
+    def condition_fragments(self, node):
+        # Explicit stack instead of recursion, so long AND/OR chains and deeply
+        # nested brackets cannot hit the recursion limit. Nodes expand into
+        # fragments in output order, which are yielded as they are reached.
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                yield node
+            elif isinstance(node, ComparisonNode):
+                left = self.process_operand(node.left)
+                right = self.process_operand(node.right, wrap_strings=True)
+                operator = self.get_operator(node.operator)
+                yield f"{left} {operator} {right}"
+            elif isinstance(node, LogicalNode):
+                separator = f" {node.operator.upper()} "
+                items = ["("]
+                for operand in node.operands:
+                    items.append(operand)
+                    items.append(separator)
+                items[-1] = ")"
+                stack.extend(reversed(items))
+            elif isinstance(node, BracketNode):
+                stack.extend((")", node.expression, "("))
+            elif isinstance(node, InNode):
+                column = self.process_operand(node.column)
+                values = ", ".join(self.process_operand(value, wrap_strings=True) for value in node.values)
+                yield f"{column} IN ({values})"
+            else:
+                raise CodeGenError("Unknown condition node")
 
     def process_operand(self, operand, wrap_strings=False):
         if isinstance(operand, TableColumnRef):
@@ -112,6 +143,8 @@ class CodeGenerator:
             return f"'{cleaned}'" if wrap_strings else cleaned
         elif isinstance(operand, int):
             return str(operand)
+        elif isinstance(operand, ParamNode):
+            raise CodeGenError(f"Unbound parameter '{operand.name}'. Compile the query as a template to use parameters.", operand)
         else:
             raise CodeGenError("Unknown operand type")
 
@@ -137,12 +170,67 @@ class CodeGenerator:
     def process_order_by(self, node):
         return f"ORDER BY {node.column} {node.direction.upper()}"
 
+    def fragments(self):
+        # The SQL of generate() as a stream of small strings, clause by clause
+        node = self.ast
+        yield "SELECT "
+        for index, column in enumerate(node.select.columns):
+            if index:
+                yield ", "
+            yield self.process_column(column)
+        yield " FROM "
+        for index, table in enumerate(node.from_.tables):
+            if index:
+                yield ", "
+            yield table
+        if node.where:
+            yield " WHERE "
+            yield from self.condition_fragments(node.where.condition)
+        if node.group_by:
+            yield " GROUP BY "
+            for index, column in enumerate(node.group_by.columns):
+                if index:
+                    yield ", "
+                yield column
+        if node.having:
+            yield " HAVING "
+            yield from self.condition_fragments(node.having.condition)
+        if node.order_by:
+            yield " " + self.process_order_by(node.order_by)
+
+    def emit(self, file, batch: int = 4096) -> int:
+        """Write the SQL of generate() to file while walking the AST.
+
+        Fragments are passed to file.write in groups of batch, so only that
+        much of the output is held in memory and the first part is written
+        before the rest is generated. On a CodeGenError, what was written so
+        far stays in file. Returns the number of characters written.
+        """
+        written = 0
+        pending = []
+        for fragment in self.fragments():
+            pending.append(fragment)
+            if len(pending) >= batch:
+                chunk = "".join(pending)
+                file.write(chunk)
+                written += len(chunk)
+                pending.clear()
+        chunk = "".join(pending)
+        if chunk:
+            file.write(chunk)
+            written += len(chunk)
+        return written
+
 
 def generate_sql_from_ast(ast):
     generator = CodeGenerator(ast)
     sql_query = generator.generate()
     return sql_query
 
+def write_sql_from_ast(ast, file) -> int:
+    # Streaming counterpart of generate_sql_from_ast, see CodeGenerator.emit
+    return CodeGenerator(ast).emit(file)
+
 
 class CodeGenError(Exception):
     """Exception raised during code generation"""
@@ -153,8 +241,69 @@ class CodeGenError(Exception):
             self.message += f" (Node type: {type(node).__name__})"
         super().__init__(self.message)
 
-@dataclass
-class QueryNode:
+class ASTNode:
+    """Base of the AST node types.
+
+    Equality, hashing and repr compare and print the whole tree like the
+    dataclass methods would, but walk it with an explicit stack, so they
+    also work on conditions nested deeper than the recursion limit.
+    """
+    __slots__ = ()
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(a == b for a, b in itertools.zip_longest(walk_ast(self), walk_ast(other), fillvalue=object()))
+
+    def __hash__(self):
+        return hash(tuple(walk_ast(self)))
+
+    def __repr__(self):
+        # (True, text) is output as is, (False, value) is a value to print
+        pieces = []
+        stack = [(False, self)]
+        while stack:
+            is_text, value = stack.pop()
+            if is_text:
+                pieces.append(value)
+            elif type(value) in AST_FIELDS:
+                items = [(True, type(value).__qualname__ + "(")]
+                for i, name in enumerate(AST_FIELDS[type(value)]):
+                    items += [(True, (", " if i else "") + name + "="), (False, getattr(value, name))]
+                items.append((True, ")"))
+                stack.extend(reversed(items))
+            elif type(value) is tuple:
+                items = [(True, "(")]
+                for i, item in enumerate(value):
+                    if i:
+                        items.append((True, ", "))
+                    items.append((False, item))
+                items.append((True, ",)" if len(value) == 1 else ")"))
+                stack.extend(reversed(items))
+            else:
+                pieces.append(repr(value))
+        return "".join(pieces)
+
+def walk_ast(node):
+    # Pre-order: each node as its type followed by its field values, each
+    # tuple as tuple and its length followed by its items
+    stack = [node]
+    while stack:
+        value = stack.pop()
+        if type(value) in AST_FIELDS:
+            yield type(value)
+            stack.extend(getattr(value, name) for name in reversed(AST_FIELDS[type(value)]))
+        elif type(value) is tuple:
+            yield tuple
+            yield len(value)
+            stack.extend(reversed(value))
+        else:
+            yield value
+
+@dataclass(frozen=True, slots=True, eq=False, repr=False)
+class QueryNode(ASTNode):
     select: 'SelectNode'
     from_: 'FromNode'
     where: Optional['WhereNode'] = None
@@ -162,138 +311,438 @@ class QueryNode:
     having: Optional['HavingNode'] = None
     order_by: Optional['OrderByNode'] = None
 
-@dataclass
-class SelectNode:
-    columns: List['ColumnNode']
+@dataclass(frozen=True, slots=True, eq=False, repr=False)
+class SelectNode(ASTNode):
+    columns: Tuple['ColumnNode', ...]
 
-@dataclass
-class ColumnNode:
+@dataclass(frozen=True, slots=True, eq=False, repr=False)
+class ColumnNode(ASTNode):
     value: Union[str, 'FunctionNode', 'AliasNode']
 
-@dataclass
-class FunctionNode:
+@dataclass(frozen=True, slots=True, eq=False, repr=False)
+class FunctionNode(ASTNode):
     name: str
-    arguments: List[str]
+    arguments: Tuple[str, ...]
 
-@dataclass
-class AliasNode:
+@dataclass(frozen=True, slots=True, eq=False, repr=False)
+class AliasNode(ASTNode):
     expression: Union[str, 'FunctionNode']
     alias: str
 
-@dataclass
-class FromNode:
-    tables: List[str]
+@dataclass(frozen=True, slots=True, eq=False, repr=False)
+class FromNode(ASTNode):
+    tables: Tuple[str, ...]
 
-@dataclass
-class WhereNode:
+@dataclass(frozen=True, slots=True, eq=False, repr=False)
+class WhereNode(ASTNode):
     condition: Union['ComparisonNode', 'LogicalNode', 'BracketNode']
 
-@dataclass
-class ComparisonNode:
+@dataclass(frozen=True, slots=True, eq=False, repr=False)
+class ComparisonNode(ASTNode):
     operator: str
     left: Union[str, 'TableColumnRef', 'FunctionNode']
-    right: Union[str, int]
+    right: Union[str, int, 'ParamNode']
 
-@dataclass
-class TableColumnRef:
+@dataclass(frozen=True, slots=True, eq=False, repr=False)
+class ParamNode(ASTNode):
+    # Placeholder for a constant, bound when a template is rendered
+    name: str
+
+@dataclass(frozen=True, slots=True, eq=False, repr=False)
+class TableColumnRef(ASTNode):
     table: str
     column: str
 
-@dataclass
-class LogicalNode:
+@dataclass(frozen=True, slots=True, eq=False, repr=False)
+class LogicalNode(ASTNode):
+    # A run of the same operator is one node: a AND b AND c has three operands.
+    # The last operand may be a LogicalNode with the other operator.
     operator: str
-    left: Union['ComparisonNode', 'BracketNode']
-    right: Union['ComparisonNode', 'BracketNode', 'LogicalNode']
+    operands: Tuple[Union['ComparisonNode', 'BracketNode', 'LogicalNode'], ...]
 
-@dataclass
-class BracketNode:
+@dataclass(frozen=True, slots=True, eq=False, repr=False)
+class BracketNode(ASTNode):
     expression: Union['ComparisonNode', 'LogicalNode']
 
-@dataclass
-class GroupByNode:
-    columns: List[str]
+@dataclass(frozen=True, slots=True, eq=False, repr=False)
+class InNode(ASTNode):
+    # column IN (values), written by the Optimizer for an OR of equalities
+    column: 'TableColumnRef'
+    values: Tuple[Union[str, int, 'ParamNode'], ...]
 
-@dataclass
-class HavingNode:
+@dataclass(frozen=True, slots=True, eq=False, repr=False)
+class GroupByNode(ASTNode):
+    columns: Tuple[str, ...]
+
+@dataclass(frozen=True, slots=True, eq=False, repr=False)
+class HavingNode(ASTNode):
     condition: 'ComparisonNode'
 
-@dataclass
-class OrderByNode:
+@dataclass(frozen=True, slots=True, eq=False, repr=False)
+class OrderByNode(ASTNode):
     column: str
     direction: str
 
-class TokenType(Enum):
-    QUERY_OPEN = 1
-    QUERY_CLOSE = 2
-    SELECT_OPEN = 3
-    SELECT_CLOSE = 4
-    COLUMN_OPEN = 5
-    COLUMN_CLOSE = 6
-    COUNT_FUNC_OPEN = 7
-    COUNT_FUNC_CLOSE = 8
-    MAX_FUNC_OPEN = 9
-    MAX_FUNC_CLOSE = 10
-    ALIAS_OPEN = 11
-    ALIAS_CLOSE = 12
-    LHS_OPEN = 13
-    LHS_CLOSE = 14
-    RHS_OPEN = 15
-    RHS_CLOSE = 16
-    FROM_OPEN = 17
-    FROM_CLOSE = 18
-    TABLE_OPEN = 19
-    TABLE_CLOSE = 20
-    WHERE_OPEN = 21
-    WHERE_CLOSE = 22
-    EQ_OP_OPEN = 23
-    EQ_OP_CLOSE = 24
-    REF_TABLE_OPEN = 25
-    REF_TABLE_CLOSE = 26
-    REF_COL_OPEN = 27
-    REF_COL_CLOSE = 28
-    CONSTANT_OPEN = 29
-    CONSTANT_CLOSE = 30
-    STRING_CONSTANT_OPEN = 31
-    STRING_CONSTANT_CLOSE = 32
-    GROUP_BY_OPEN = 33
-    GROUP_BY_CLOSE = 34
-    HAVING_OPEN = 35
-    HAVING_CLOSE = 36
-    GT_OP_OPEN = 37
-    GT_OP_CLOSE = 38
-    INT_CONSTANT_OPEN = 39
-    INT_CONSTANT_CLOSE = 40
-    ORDER_BY_OPEN = 41
-    ORDER_BY_CLOSE = 42
-    DESC_OPEN = 43
-    DESC_CLOSE = 44
-    ASC_OPEN = 45
-    ASC_CLOSE = 46
-    BRACKET_OPEN = 47
-    BRACKET_CLOSE = 48
-    AND = 49
-    OR = 50
-    STRING_LITERAL = 51
-    INT_LITERAL = 52
-    COMMENT = 53
+AST_NODE_TYPES = (QueryNode, SelectNode, ColumnNode, FunctionNode, AliasNode, FromNode, WhereNode,
+                  ComparisonNode, ParamNode, TableColumnRef, LogicalNode, BracketNode, InNode, GroupByNode, HavingNode, OrderByNode)
+AST_FIELDS = {node_type: tuple(field.name for field in fields(node_type)) for node_type in AST_NODE_TYPES}
 
-@dataclass
-class Token:
-    type: TokenType
-    value: str
+class ASTInterner:
+    """Shares structurally identical AST subtrees.
+
+    intern() returns a tree in which every distinct subtree exists once, so
+    repeated references such as games.origin or count(*) are one object
+    across all interned queries, and two interned subtrees are equal exactly
+    when they are the same object. Strings are interned with sys.intern.
+    """
+    def __init__(self):
+        # (type, field values with child nodes replaced by their id) -> node.
+        # The table keeps every node alive, so the ids stay unique.
+        self.nodes = {}
+        self.hits = 0
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def intern(self, node):
+        # Post-order over an explicit stack, so children are interned before
+        # their parent and deep conditions do not recurse
+        interned = {}
+        stack = [(node, None)]
+        while stack:
+            item, values = stack.pop()
+            if values is None:
+                if id(item) in interned:
+                    continue
+                values = [getattr(item, name) for name in AST_FIELDS[type(item)]]
+                stack.append((item, values))
+                for value in values:
+                    if type(value) is tuple:
+                        stack.extend((child, None) for child in value if type(child) in AST_FIELDS)
+                    elif type(value) in AST_FIELDS:
+                        stack.append((value, None))
+                continue
+
+            shared_values = [share(value, interned) for value in values]
+            key = (type(item), tuple(key_part(value) for value in shared_values))
+            shared = self.nodes.get(key)
+            if shared is not None:
+                self.hits += 1
+            else:
+                # An unchanged node is reused rather than copied
+                if all(new is old for new, old in zip(shared_values, values)):
+                    shared = item
+                else:
+                    shared = type(item)(*shared_values)
+                self.nodes[key] = shared
+            interned[id(item)] = shared
+        return interned[id(node)]
+
+def share(value, interned):
+    # The interned form of one field value
+    if type(value) in AST_FIELDS:
+        return interned[id(value)]
+    if type(value) is str:
+        return sys.intern(value)
+    if type(value) is tuple:
+        shared = tuple(share(item, interned) for item in value)
+        return value if all(new is old for new, old in zip(shared, value)) else shared
+    return value
+
+def key_part(value):
+    # Interned nodes stand for themselves by identity
+    if type(value) in AST_FIELDS:
+        return id(value)
+    if type(value) is tuple:
+        return tuple(id(item) if type(item) in AST_FIELDS else item for item in value)
+    return value
+
+def count_ast_nodes(node) -> int:
+    # Number of nodes in the tree, counting shared subtrees every time they appear
+    count = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        count += 1
+        for name in AST_FIELDS[type(node)]:
+            value = getattr(node, name)
+            if type(value) is tuple:
+                stack.extend(item for item in value if type(item) in AST_FIELDS)
+            elif type(value) in AST_FIELDS:
+                stack.append(value)
+    return count
+
+class Optimizer:
+    """Rewrites a parsed query into an equivalent one with shorter SQL.
+
+    Conditions are rewritten bottom-up: brackets are dropped (the code
+    generator parenthesizes every LogicalNode anyway), a LogicalNode inside
+    one with the same operator is merged into it, repeated predicates are
+    dropped, and the equalities of an OR on one TableColumnRef become a
+    single InNode. Equalities of an AND that cannot all hold, such as
+    t.a = 1 AND t.a = 2, are reported in contradictions; the condition
+    itself is kept. Every node is visited once and predicates are compared
+    through small integer keys, so a pass is linear in the size of the query.
+    """
+    def __init__(self):
+        self.contradictions = []
+        # structural key -> integer key, and the operands of each LogicalNode built
+        self.keys = {}
+        self.parts = {}
+
+    def optimize(self, ast: QueryNode) -> QueryNode:
+        where = ast.where and WhereNode(self.optimize_condition(ast.where.condition))
+        having = ast.having and HavingNode(self.optimize_condition(ast.having.condition))
+        return QueryNode(ast.select, ast.from_, where, ast.group_by, having, ast.order_by)
+
+    def optimize_condition(self, node):
+        # Explicit stack like CodeGenerator.condition_fragments. A LogicalNode
+        # is flattened on the way down, through brackets and nested nodes of
+        # its operator; the remaining operands are optimized and their
+        # (node, key) results are combined on the way up.
+        results = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if type(node) is tuple:
+                operator, count = node
+                operands = results[len(results) - count:]
+                del results[len(results) - count:]
+                results.append(self.combine(operator, operands))
+            elif isinstance(node, BracketNode):
+                stack.append(node.expression)
+            elif isinstance(node, LogicalNode):
+                operands = []
+                pending = list(reversed(node.operands))
+                while pending:
+                    operand = pending.pop()
+                    while isinstance(operand, BracketNode):
+                        operand = operand.expression
+                    if isinstance(operand, LogicalNode) and operand.operator == node.operator:
+                        pending.extend(reversed(operand.operands))
+                    else:
+                        operands.append(operand)
+                stack.append((node.operator, len(operands)))
+                stack.extend(reversed(operands))
+            elif isinstance(node, ComparisonNode):
+                results.append((node, self.key(("cmp", node.operator, operand_key(node.left), operand_key(node.right)))))
+            elif isinstance(node, InNode):
+                values = frozenset(map(operand_key, node.values))
+                results.append((node, self.key(("in", operand_key(node.column), values))))
+            else:
+                raise CodeGenError("Unknown condition node")
+        return results[0][0]
+
+    def key(self, structure) -> int:
+        return self.keys.setdefault(structure, len(self.keys))
+
+    def combine(self, operator: str, results):
+        operands = []
+        seen = set()
+        for node, key in results:
+            # An operand that lost its duplicates may now be a run of our operator
+            if isinstance(node, LogicalNode) and node.operator == operator:
+                items = self.parts[key]
+            else:
+                items = ((node, key),)
+            for item in items:
+                if item[1] not in seen:
+                    seen.add(item[1])
+                    operands.append(item)
+        if operator == "or":
+            operands = self.merge_equalities(operands)
+        elif operator == "and":
+            self.check_equalities(operands)
+        if len(operands) == 1:
+            return operands[0]
+        node = LogicalNode(operator, tuple(node for node, _ in operands))
+        key = self.key((operator, frozenset(key for _, key in operands)))
+        self.parts[key] = operands
+        return node, key
+
+    def merge_equalities(self, operands):
+        # The equalities and IN lists on each column are merged into one
+        # InNode, at the place of the first of them
+        groups = {}
+        for index, (node, _) in enumerate(operands):
+            column, values = equality_values(node)
+            if column is not None:
+                groups.setdefault(column, []).append((index, values))
+        merged = {}
+        for column, members in groups.items():
+            if len(members) > 1:
+                values = {}
+                for _, member_values in members:
+                    for value in member_values:
+                        values.setdefault(operand_key(value), value)
+                node = InNode(column, tuple(values.values()))
+                merged[members[0][0]] = (node, self.key(("in", operand_key(column), frozenset(values))))
+                merged.update((index, None) for index, _ in members[1:])
+        if not merged:
+            return operands
+        result = []
+        for index, operand in enumerate(operands):
+            operand = merged.get(index, operand)
+            if operand is not None:
+                result.append(operand)
+        return result
+
+    def check_equalities(self, operands):
+        # All the constraints on one column hold together only if some value
+        # is allowed by each of them; parameters may take any value
+        allowed = {}
+        constraints = {}
+        for node, _ in operands:
+            column, values = equality_values(node)
+            if column is None or any(isinstance(value, ParamNode) for value in values):
+                continue
+            keys = set(map(operand_key, values))
+            allowed[column] = allowed[column] & keys if column in allowed else keys
+            constraints.setdefault(column, []).append(node)
+        for column, keys in allowed.items():
+            nodes = constraints[column]
+            # Only constants of one kind, since SQLite may compare 1 and '1' as equal
+            kinds = {kind for node in nodes for kind, _ in map(operand_key, equality_values(node)[1])}
+            if not keys and len(kinds) == 1:
+                generator = CodeGenerator(None)
+                conditions = " AND ".join(generator.process_condition(node) for node in nodes)
+                self.contradictions.append(f"Contradictory conditions: {conditions}")
+
+def operand_key(operand):
+    # Operands that generate the same SQL have the same key
+    if isinstance(operand, str):
+        return ("str", operand.strip('"').strip("'"))
+    if isinstance(operand, int):
+        return ("int", operand)
+    if isinstance(operand, TableColumnRef):
+        return ("ref", operand.table, operand.column)
+    if isinstance(operand, FunctionNode):
+        return ("func", operand.name.upper(), operand.arguments)
+    if isinstance(operand, ParamNode):
+        return ("param", operand.name)
+    raise CodeGenError("Unknown operand type")
+
+def equality_values(node):
+    # (column, values) of column = constant or column IN (...), else (None, None)
+    if isinstance(node, InNode):
+        return node.column, node.values
+    if (isinstance(node, ComparisonNode) and node.operator == "eq" and isinstance(node.left, TableColumnRef)
+            and isinstance(node.right, (str, int, ParamNode))):
+        return node.left, (node.right,)
+    return None, None
+
+def optimize_ast(ast: QueryNode) -> QueryNode:
+    return Optimizer().optimize(ast)
+
+class ConditionChain:
+    """Builds an AND/OR chain one term at a time.
+
+    Chains are right-associative: a run of the same operator is collected
+    into one n-ary LogicalNode and an operator change nests the rest of the
+    chain inside it, so a AND b OR c is and(a, or(b, c)). Nodes are
+    immutable, so the runs are kept as lists until the last term arrives.
+    """
+    def __init__(self):
+        self.runs = []
+
+    def add(self, term, operator: str):
+        # term is followed by operator
+        if self.runs and self.runs[-1][0] == operator:
+            self.runs[-1][1].append(term)
+        else:
+            self.runs.append((operator, [term]))
+
+    def finish(self, term):
+        # term is the last one of the chain; runs are nested innermost first
+        node = term
+        for operator, operands in reversed(self.runs):
+            operands.append(node)
+            node = LogicalNode(operator, tuple(operands))
+        return node
 
 class Parser:
     def __init__(self, tokens):
-        self.tokens = tokens
+        # Any iterable of tokens works; only the current token is buffered, in
+        # lookahead, which is None until it is read
+        self.tokens = iter(tokens)
+        self.lookahead = None
         self.current = 0
         
     def parse(self) -> QueryNode:
         if self.match(TokenType.QUERY_OPEN):
             query = self.parse_query()
-            if self.match(TokenType.QUERY_CLOSE):
+            # Nothing is read past </query>, so a query is returned before
+            # the input of the next one has arrived
+            if self.match_tag(TokenType.QUERY_CLOSE):
                 return query
         raise SyntaxError("Invalid query structure")
 
+    def parse_queries(self):
+        # Yields (index, QueryNode) for every <query> of a document, optionally
+        # wrapped in <queries>. A failed query yields (index, error) instead and
+        # parsing resumes after its </query>; an error between queries resumes
+        # at the next <query>. Content after </queries> is one final error.
+        index = 0
+        try:
+            if self.at_end():
+                return
+            wrapped = self.match_tag(TokenType.QUERIES_OPEN)
+        except ValueError as e:
+            # The first tag did not scan; the document may still be wrapped
+            yield index, e
+            index += 1
+            self.skip_to_query(TokenType.QUERIES_OPEN)
+            wrapped = not self.at_end() and self.match_tag(TokenType.QUERIES_OPEN)
+        while True:
+            inside = False
+            try:
+                if self.at_end():
+                    if wrapped:
+                        yield index, SyntaxError("Unclosed <queries> document")
+                    return
+                if wrapped and self.match_tag(TokenType.QUERIES_CLOSE):
+                    break
+                inside = self.peek().type == TokenType.QUERY_OPEN
+                yield index, self.parse()
+            except (SyntaxError, ValueError) as e:
+                yield index, e
+                if inside:
+                    self.skip_query()
+                elif wrapped:
+                    self.skip_to_query(TokenType.QUERIES_CLOSE)
+                else:
+                    self.skip_to_query()
+            index += 1
+        # Nothing may follow </queries>
+        try:
+            if self.at_end():
+                return
+            error = SyntaxError(f"Unexpected {self.peek().type} after </queries>")
+        except ValueError as e:
+            error = e
+        yield index, error
+
+    def skip_query(self):
+        # Drop tokens up to and including the next </query>
+        while True:
+            try:
+                if self.at_end() or self.match_tag(TokenType.QUERY_CLOSE):
+                    return
+                self.consume()
+            except ValueError:
+                continue
+
+    def skip_to_query(self, *stops):
+        # Drop tokens up to the next <query> or one of stops, which is kept
+        stops = (TokenType.QUERY_OPEN,) + stops
+        while True:
+            try:
+                if self.at_end() or self.peek().type in stops:
+                    return
+                self.consume()
+            except ValueError:
+                continue
+
     def parse_query(self) -> QueryNode:
         select_node = self.parse_select()
         from_node = self.parse_from()
@@ -322,7 +771,7 @@ class Parser:
         if not self.match(TokenType.SELECT_CLOSE):
             raise SyntaxError("Unclosed SELECT clause")
             
-        return SelectNode(columns)
+        return SelectNode(tuple(columns))
 
     def parse_column(self) -> ColumnNode:
         if not self.match(TokenType.COLUMN_OPEN):
@@ -375,7 +824,7 @@ class Parser:
         if not self.match(TokenType.COUNT_FUNC_CLOSE if name == "count" else TokenType.MAX_FUNC_CLOSE):
             raise SyntaxError("Unclosed function")
             
-        return FunctionNode(name, args)
+        return FunctionNode(name, tuple(args))
     def parse_alias(self) -> AliasNode:
         if not self.match(TokenType.ALIAS_OPEN):
             raise SyntaxError("Expected alias")
@@ -430,7 +879,7 @@ class Parser:
         if not self.match(TokenType.FROM_CLOSE):
             raise SyntaxError("Unclosed FROM clause")
             
-        return FromNode(tables)
+        return FromNode(tuple(tables))
 
     def parse_where(self) -> WhereNode:
         if not self.match(TokenType.WHERE_OPEN):
@@ -444,18 +893,34 @@ class Parser:
         return WhereNode(condition)
 
     def parse_condition(self) -> Union[ComparisonNode, LogicalNode, BracketNode]:
-        if self.peek().type == TokenType.BRACKET_OPEN:
-            return self.parse_bracket()
-        elif self.peek().type in [TokenType.EQ_OP_OPEN, TokenType.GT_OP_OPEN]:
-            condition = self.parse_comparison()
+        # condition := comparison [(<and/>|<or/>) condition] | <bracket> condition </bracket>
+        # Parsed in a loop, with a stack of the chains enclosing each open
+        # bracket, so neither long chains nor deep brackets recurse
+        enclosing = []
+        chain = ConditionChain()
+        while True:
+            if self.peek().type == TokenType.BRACKET_OPEN:
+                self.consume()
+                enclosing.append(chain)
+                chain = ConditionChain()
+                continue
+            elif self.peek().type not in [TokenType.EQ_OP_OPEN, TokenType.GT_OP_OPEN]:
+                raise SyntaxError(f"Expected condition, got {self.peek().type}")
+
+            term = self.parse_comparison()
             if self.peek().type in [TokenType.AND, TokenType.OR]:
-                op = "and" if self.peek().type == TokenType.AND else "or"
+                chain.add(term, "and" if self.peek().type == TokenType.AND else "or")
                 self.consume()
-                right = self.parse_condition()
-                return LogicalNode(op, condition, right)
+                continue
+
+            # The chain ends here; a closed bracket also ends the chain around it
+            condition = chain.finish(term)
+            while enclosing:
+                if not self.match(TokenType.BRACKET_CLOSE):
+                    raise SyntaxError("Unclosed bracket expression")
+                chain = enclosing.pop()
+                condition = chain.finish(BracketNode(condition))
             return condition
-        else:
-            raise SyntaxError(f"Expected condition, got {self.peek().type}")
 
     def parse_comparison(self) -> ComparisonNode:
         op_type = self.peek().type
@@ -517,7 +982,7 @@ class Parser:
                             "3. Function call (count_func or max_func)\n" +
                             f"Got {self.peek().type} instead")
     
-    def parse_constant(self) -> Union[str, int]:
+    def parse_constant(self) -> Union[str, int, ParamNode]:
         if self.peek().type == TokenType.STRING_CONSTANT_OPEN:
             self.consume()
             if self.peek().type != TokenType.STRING_LITERAL:
@@ -534,20 +999,17 @@ class Parser:
             if not self.match(TokenType.INT_CONSTANT_CLOSE):
                 raise SyntaxError("Unclosed integer constant")
             return value
+        elif self.peek().type == TokenType.PARAM_OPEN:
+            self.consume()
+            if self.peek().type != TokenType.STRING_LITERAL:
+                raise SyntaxError("Expected parameter name")
+            name = self.consume().value
+            if not self.match(TokenType.PARAM_CLOSE):
+                raise SyntaxError("Unclosed parameter")
+            return ParamNode(name)
         else:
             raise SyntaxError("Expected constant")
 
-    def parse_bracket(self) -> BracketNode:
-        if not self.match(TokenType.BRACKET_OPEN):
-            raise SyntaxError("Expected bracket expression")
-            
-        expr = self.parse_condition()
-            
-        if not self.match(TokenType.BRACKET_CLOSE):
-            raise SyntaxError("Unclosed bracket expression")
-            
-        return BracketNode(expr)
-
     def parse_group_by(self) -> GroupByNode:
         if not self.match(TokenType.GROUP_BY_OPEN):
             raise SyntaxError("Expected GROUP BY clause")
@@ -564,7 +1026,7 @@ class Parser:
         if not self.match(TokenType.GROUP_BY_CLOSE):
             raise SyntaxError("Unclosed GROUP BY clause")
             
-        return GroupByNode(columns)
+        return GroupByNode(tuple(columns))
 
     def parse_having(self) -> HavingNode:
         if not self.match(TokenType.HAVING_OPEN):
@@ -613,54 +1075,748 @@ class Parser:
         return OrderByNode(column, direction)
 
     def match(self, type: TokenType) -> bool:
-        if self.peek().type == type:
-            self.consume()
-            return True
-        return False
+        # consume inlined: match runs for most tokens
+        if (self.lookahead or self.fill()).type != type:
+            return False
+        self.current += 1
+        try:
+            self.lookahead = next(self.tokens, None)
+        except ValueError:
+            self.lookahead = None
+            raise
+        return True
         
-    def peek(self) -> Token:
-        if self.current >= len(self.tokens):
+    def match_tag(self, type: TokenType) -> bool:
+        # match without reading the token after it, so a scan error there is
+        # raised by the next call rather than with this tag
+        if (self.lookahead or self.fill()).type != type:
+            return False
+        self.lookahead = None
+        self.current += 1
+        return True
+
+    def at_end(self) -> bool:
+        if self.lookahead is None:
+            self.lookahead = next(self.tokens, None)
+        return self.lookahead is None
+
+    def fill(self) -> Token:
+        # Read the current token when it has not been read yet
+        token = self.lookahead = next(self.tokens, None)
+        if token is None:
             raise SyntaxError("Unexpected end of input")
-        return self.tokens[self.current]
+        return token
+
+    def peek(self) -> Token:
+        return self.lookahead or self.fill()
         
     def consume(self) -> Token:
-        token = self.peek()
+        # The next token is read right away, so peek is one attribute load
+        token = self.lookahead or self.fill()
         self.current += 1
+        try:
+            self.lookahead = next(self.tokens, None)
+        except ValueError:
+            # A scan error; lookahead must not hold the consumed token
+            self.lookahead = None
+            raise
         return token
 
-def parse_tokens_file(file_path: str) -> QueryNode:
-    tokens = []
-    with open(file_path, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
+# LL(1) grammar of a single <query>, the same language as Parser's methods.
+# Upper-case names are TokenType terminals, other names are nonterminals and
+# "#name" entries are actions run on the value stack once reached. A terminal
+# given as (name, message) raises SyntaxError(message) when it does not match.
+# A nullable alternative, or the only alternative of a rule, is taken for
+# every lookahead outside the FIRST sets of the others, so the error comes
+# from the next terminal that does not match.
+GRAMMAR = {
+    "Query": [[("QUERY_OPEN", "Invalid query structure"), "Select", "From", "Where_opt", "GroupBy_opt",
+               "Having_opt", "OrderBy_opt", ("QUERY_CLOSE", "Invalid query structure"), "#query"]],
+    "Select": [[("SELECT_OPEN", "Expected SELECT clause"), "#new_list", "Column_List",
+                ("SELECT_CLOSE", "Unclosed SELECT clause"), "#select"]],
+    "Column_List": [["Column", "#append", "Column_List"], []],
+    "Column": [["COLUMN_OPEN", "Column_Value", ("COLUMN_CLOSE", "Unclosed column"), "#column"]],
+    "Column_Value": [["STRING_LITERAL"], ["Function"], ["Alias"]],
+    "Function": [["COUNT_FUNC_OPEN", "Function_Args", ("COUNT_FUNC_CLOSE", "Unclosed function"), "#function"],
+                 ["MAX_FUNC_OPEN", "Function_Args", ("MAX_FUNC_CLOSE", "Unclosed function"), "#function"]],
+    "Function_Args": [["STRING_LITERAL", "#single_argument"], ["#new_list", "Column_Args", "#require_arguments"]],
+    "Column_Args": [["COLUMN_OPEN", ("STRING_LITERAL", "Expected column content"), "#append",
+                     ("COLUMN_CLOSE", "Unclosed column in function argument"), "Column_Args"], []],
+    "Alias": [["ALIAS_OPEN", ("LHS_OPEN", "Expected alias LHS"), "Alias_Inner", ("LHS_CLOSE", "Unclosed alias LHS"),
+               ("RHS_OPEN", "Expected alias RHS"), ("STRING_LITERAL", "Expected alias name"),
+               ("RHS_CLOSE", "Unclosed alias RHS"), ("ALIAS_CLOSE", "Unclosed alias"), "#alias"]],
+    "Alias_Inner": [["STRING_LITERAL"], ["Function"]],
+    "From": [[("FROM_OPEN", "Expected FROM clause"), "#new_list", "Table_List",
+              ("FROM_CLOSE", "Unclosed FROM clause"), "#from"]],
+    "Table_List": [["Table", "#append", "More_Tables"], []],
+    "More_Tables": [["Table", "#append", "More_Tables"], []],
+    "Table": [["TABLE_OPEN", ("STRING_LITERAL", "Expected table name"), ("TABLE_CLOSE", "Unclosed table")]],
+    "Where_opt": [["WHERE_OPEN", "Condition", ("WHERE_CLOSE", "Unclosed WHERE clause"), "#where"], ["#none"]],
+    "Condition": [["#new_chain", "Chain"]],
+    "Chain": [["Comparison", "Chain_Rest"],
+              ["BRACKET_OPEN", "Condition", ("BRACKET_CLOSE", "Unclosed bracket expression"), "#bracket", "#end_chain"]],
+    "Chain_Rest": [["AND", "#chain_add", "Chain"], ["OR", "#chain_add", "Chain"], ["#end_chain"]],
+    "Comparison": [["EQ_OP_OPEN", "Comparison_Inner", ("EQ_OP_CLOSE", "Unclosed comparison"), "#comparison"],
+                   ["GT_OP_OPEN", "Comparison_Inner", ("GT_OP_CLOSE", "Unclosed comparison"), "#comparison"]],
+    "Comparison_Inner": [[("LHS_OPEN", "Expected comparison LHS"), "Ref_or_Value", ("LHS_CLOSE", "Unclosed comparison LHS"),
+                          ("RHS_OPEN", "Expected comparison RHS"), "Constant", ("RHS_CLOSE", "Unclosed comparison RHS")]],
+    "Ref_or_Value": [["REF_TABLE_OPEN", ("STRING_LITERAL", "Expected table name in <ref_table> tag"),
+                      ("REF_TABLE_CLOSE", "Unclosed table reference"), ("REF_COL_OPEN", "Expected <ref_col> after table reference"),
+                      ("STRING_LITERAL", "Expected column name in <ref_col> tag"), ("REF_COL_CLOSE", "Unclosed column reference"),
+                      "#table_column"],
+                     ["STRING_LITERAL"], ["Function"]],
+    "Constant": [["STRING_CONSTANT_OPEN", ("STRING_LITERAL", "Expected string constant"),
+                  ("STRING_CONSTANT_CLOSE", "Unclosed string constant")],
+                 ["INT_CONSTANT_OPEN", ("INT_LITERAL", "Expected integer constant"), "#int",
+                  ("INT_CONSTANT_CLOSE", "Unclosed integer constant")],
+                 ["PARAM_OPEN", ("STRING_LITERAL", "Expected parameter name"), "#param",
+                  ("PARAM_CLOSE", "Unclosed parameter")]],
+    "GroupBy_opt": [["GROUP_BY_OPEN", "#new_list", "GroupBy_Columns", ("GROUP_BY_CLOSE", "Unclosed GROUP BY clause"), "#group_by"],
+                    ["#none"]],
+    "GroupBy_Columns": [["COLUMN_OPEN", ("STRING_LITERAL", "Expected column name"), "#append",
+                         ("COLUMN_CLOSE", "Unclosed column"), "GroupBy_Columns"], []],
+    "Having_opt": [["HAVING_OPEN", "Condition", ("HAVING_CLOSE", "Unclosed HAVING clause"), "#having"], ["#none"]],
+    "OrderBy_opt": [["ORDER_BY_OPEN", "Order_By_Inner", ("ORDER_BY_CLOSE", "Unclosed ORDER BY clause"), "#order_by"], ["#none"]],
+    "Order_By_Inner": [["ASC_OPEN", "Ref_Column", ("ASC_CLOSE", "Unclosed sort direction")],
+                       ["DESC_OPEN", "Ref_Column", ("DESC_CLOSE", "Unclosed sort direction")]],
+    "Ref_Column": [[("REF_COL_OPEN", "Expected column reference"), ("STRING_LITERAL", "Expected column name"),
+                    ("REF_COL_CLOSE", "Unclosed column reference")]],
+}
+
+# Error raised by a nonterminal for a lookahead no alternative accepts;
+# {type} is replaced by the lookahead's TokenType
+NONTERMINAL_ERRORS = {
+    "Column_Value": "Invalid column content",
+    "Alias_Inner": "Invalid alias expression",
+    "Chain": "Expected condition, got {type}",
+    "Ref_or_Value": ("Expected either:\n" +
+                     "1. Table and column reference (<ref_table>...<ref_col>)\n" +
+                     "2. String literal\n" +
+                     "3. Function call (count_func or max_func)\n" +
+                     "Got {type} instead"),
+    "Constant": "Expected constant",
+    "Order_By_Inner": "Expected sort direction",
+}
+
+# Errors for one lookahead of a nonterminal that would otherwise take its
+# nullable alternative
+LOOKAHEAD_ERRORS = {
+    ("Table_List", "STRING_LITERAL"): "Table must be wrapped in <table> tags",
+}
+
+# What a matched terminal pushes on the value stack: the token's value, or a constant
+TOKEN_VALUE = object()
+TERMINAL_VALUES = {
+    "STRING_LITERAL": TOKEN_VALUE,
+    "INT_LITERAL": TOKEN_VALUE,
+    "COUNT_FUNC_OPEN": "count",
+    "MAX_FUNC_OPEN": "max",
+    "EQ_OP_OPEN": "eq",
+    "GT_OP_OPEN": "gt",
+    "AND": "and",
+    "OR": "or",
+    "ASC_OPEN": "asc",
+    "DESC_OPEN": "desc",
+}
+
+def pop_values(values, count):
+    popped = values[-count:]
+    del values[-count:]
+    return popped
+
+def action_append(values):
+    item = values.pop()
+    values[-1].append(item)
+
+def action_require_arguments(values):
+    if not values[-1]:
+        raise SyntaxError("Expected at least one function argument")
+
+def action_chain_add(values):
+    term, operator = pop_values(values, 2)
+    values[-1].add(term, operator)
+
+def action_end_chain(values):
+    chain, term = pop_values(values, 2)
+    values.append(chain.finish(term))
+
+def wrap_top(node_type):
+    def action(values):
+        values[-1] = node_type(values[-1])
+    return action
+
+def build_from(node_type, count):
+    def action(values):
+        values.append(node_type(*pop_values(values, count)))
+    return action
+
+GRAMMAR_ACTIONS = {
+    "none": lambda values: values.append(None),
+    "new_list": lambda values: values.append([]),
+    "append": action_append,
+    "single_argument": wrap_top(lambda value: [value]),
+    "require_arguments": action_require_arguments,
+    "int": wrap_top(int),
+    "param": wrap_top(ParamNode),
+    "new_chain": lambda values: values.append(ConditionChain()),
+    "chain_add": action_chain_add,
+    "end_chain": action_end_chain,
+    "bracket": wrap_top(BracketNode),
+    "column": wrap_top(ColumnNode),
+    "select": wrap_top(lambda columns: SelectNode(tuple(columns))),
+    "from": wrap_top(lambda tables: FromNode(tuple(tables))),
+    "where": wrap_top(WhereNode),
+    "group_by": wrap_top(lambda columns: GroupByNode(tuple(columns))),
+    "having": wrap_top(HavingNode),
+    "function": build_from(lambda name, arguments: FunctionNode(name, tuple(arguments)), 2),
+    "alias": build_from(AliasNode, 2),
+    "table_column": build_from(TableColumnRef, 2),
+    "comparison": build_from(ComparisonNode, 3),
+    "order_by": build_from(lambda direction, column: OrderByNode(column, direction), 2),
+    "query": build_from(QueryNode, 6),
+}
+
+# Symbol kinds of the compiled parse table
+TERMINAL, NONTERMINAL, ACTION = 0, 1, 2
+
+def build_parse_table(grammar=GRAMMAR, start="Query"):
+    """Compile the grammar into dispatch rows indexed by TokenType code.
+
+    Each nonterminal becomes a row with, per token code, either the error
+    message to raise or (consume, value, symbols): whether the lookahead is
+    the alternative's first terminal and is matched right away, the value it
+    pushes, and the remaining symbols reversed, ready to push on the parse
+    stack. Rules with a single alternative are inlined where they are used,
+    and consecutive terminals become one symbol matched in a single step.
+    Returns the start symbol.
+    """
+    def is_terminal(symbol):
+        name = symbol[0] if isinstance(symbol, tuple) else symbol
+        return name in TokenType.__members__
+
+    # FIRST sets and nullability, iterated to a fixed point
+    first = {name: set() for name in grammar}
+    nullable = set()
+    changed = True
+    while changed:
+        changed = False
+        for name, alternatives in grammar.items():
+            for alternative in alternatives:
+                alternative_first, alternative_nullable = first_of(alternative, first, nullable, is_terminal)
+                if not alternative_first <= first[name]:
+                    first[name] |= alternative_first
+                    changed = True
+                if alternative_nullable and name not in nullable:
+                    nullable.add(name)
+                    changed = True
+
+    # Compiled symbols are (kind, row / action / terminals), where terminals
+    # is a tuple of (TokenType, error message, pushed value)
+    rows = {name: [None] * len(TOKEN_TYPES_BY_CODE) for name in grammar}
+    symbols = {name: (NONTERMINAL, rows[name]) for name in grammar}
+
+    def compile_symbol(symbol):
+        if isinstance(symbol, tuple):
+            name, message = symbol
+        elif symbol.startswith("#"):
+            return (ACTION, GRAMMAR_ACTIONS[symbol[1:]])
+        elif symbol in grammar:
+            return symbols[symbol]
+        else:
+            name, message = symbol, f"Expected {symbol}"
+        return (TERMINAL, ((TokenType[name], message, TERMINAL_VALUES.get(name)),))
+
+    inlined_rules = {name for name, alternatives in grammar.items()
+                     if len(alternatives) == 1 and all(rule != name for rule, _ in LOOKAHEAD_ERRORS)}
+
+    def inline(alternative, seen=()):
+        result = []
+        for symbol in alternative:
+            if isinstance(symbol, str) and symbol in inlined_rules and symbol not in seen:
+                result.extend(inline(grammar[symbol][0], seen + (symbol,)))
+            else:
+                result.append(symbol)
+        return result
+
+    for name, alternatives in grammar.items():
+        row = rows[name]
+        default = NONTERMINAL_ERRORS.get(name, f"Unexpected token in {name}")
+        for alternative in alternatives:
+            compiled = [compile_symbol(symbol) for symbol in inline(alternative)]
+            expansion = (False, None, tuple(reversed(join_terminals(compiled))))
+            if compiled and compiled[0][0] == TERMINAL:
+                matched = (True, compiled[0][1][0][2], tuple(reversed(join_terminals(compiled[1:]))))
+            else:
+                matched = expansion
+            alternative_first, alternative_nullable = first_of(alternative, first, nullable, is_terminal)
+            if alternative_nullable or len(alternatives) == 1:
+                default = expansion
+            for terminal in alternative_first:
+                code = TokenType[terminal].value
+                if row[code] is not None:
+                    raise ValueError(f"Grammar is not LL(1): {name} has two alternatives for {terminal}")
+                row[code] = matched
+        for code, entry in enumerate(row):
+            if entry is None:
+                row[code] = default
+        for (nonterminal, terminal), message in LOOKAHEAD_ERRORS.items():
+            if nonterminal == name:
+                row[TokenType[terminal].value] = message
+    return symbols[start]
+
+def join_terminals(compiled):
+    # Merge each run of terminal symbols into one
+    result = []
+    for kind, target in compiled:
+        if kind == TERMINAL and result and result[-1][0] == TERMINAL:
+            result[-1] = (TERMINAL, result[-1][1] + target)
+        else:
+            result.append((kind, target))
+    return result
+
+def first_of(symbols, first, nullable, is_terminal):
+    # FIRST set of a symbol sequence, and whether it can derive nothing
+    result = set()
+    for symbol in symbols:
+        if isinstance(symbol, str) and symbol.startswith("#"):
+            continue
+        if is_terminal(symbol):
+            result.add(symbol[0] if isinstance(symbol, tuple) else symbol)
+            return result, False
+        result |= first[symbol]
+        if symbol not in nullable:
+            return result, False
+    return result, True
+
+QUERY_START = build_parse_table()
+
+class TableParser(Parser):
+    """Parser driven by the GRAMMAR parse table instead of one method per rule.
+
+    Builds the same AST and raises the same errors as Parser, from an
+    explicit stack, so it takes the same token iterables and parse_queries
+    works unchanged on top of it.
+    """
+    def parse(self) -> QueryNode:
+        stack = [QUERY_START]
+        pop = stack.pop
+        push = stack.extend
+        values = []
+        tokens = self.tokens
+        token = self.lookahead
+        token_value = TOKEN_VALUE
+        consumed = 0
+        try:
+            while stack:
+                kind, target = pop()
+                if kind == ACTION:
+                    target(values)
+                    continue
+                if kind == TERMINAL:
+                    # A run of terminals, each a TokenType compared by identity
+                    for expected, message, value in target:
+                        if token is None:
+                            token = next(tokens, None)
+                            if token is None:
+                                raise SyntaxError("Unexpected end of input")
+                        if token.type is not expected:
+                            raise SyntaxError(message)
+                        if value is not None:
+                            values.append(token.value if value is token_value else value)
+                        token = None
+                        consumed += 1
+                else:
+                    if token is None:
+                        token = next(tokens, None)
+                        if token is None:
+                            raise SyntaxError("Unexpected end of input")
+                    entry = target[token.type._value_]
+                    if entry.__class__ is str:
+                        raise SyntaxError(entry.format(type=token.type))
+                    consume, value, symbols = entry
+                    if consume:
+                        if value is not None:
+                            values.append(token.value if value is token_value else value)
+                        token = None
+                        consumed += 1
+                    push(symbols)
+        finally:
+            self.lookahead = token
+            self.current += consumed
+        return values.pop()
+
+def read_token_lines(lines):
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+            
+        # Extract type and value from format like <QUERY_OPEN, <query>>
+        if line.startswith('<') and line.endswith('>'):
+            # Remove outer < and >
+            content = line[1:-1]
+            # Split at first comma
+            parts = content.split(', ', 1)
+            if len(parts) == 2:
+                type_str = parts[0]  # This is like QUERY_OPEN
+                value = parts[1]     # This is like <query>
                 
-            # Extract type and value from format like <QUERY_OPEN, <query>>
-            if line.startswith('<') and line.endswith('>'):
-                # Remove outer < and >
-                content = line[1:-1]
-                # Split at first comma
-                parts = content.split(', ', 1)
-                if len(parts) == 2:
-                    type_str = parts[0]  # This is like QUERY_OPEN
-                    value = parts[1]     # This is like <query>
-                    
-                    # Remove any < or > from value
-                    value = value.strip('<>')
+                # Remove any < or > from value
+                value = value.strip('<>')
+                
+                # Skip comments - don't add them to tokens
+                if type_str == 'COMMENT':
+                    continue
                     
-                    # Skip comments - don't add them to tokens
-                    if type_str == 'COMMENT':
-                        continue
-                        
-                    if type_str in TokenType.__members__:
-                        tokens.append(Token(TokenType[type_str], value))
-    
-    if not tokens:
-        raise ValueError("No valid tokens found in file")
-        
-    parser = Parser(tokens)
+                if type_str in TokenType.__members__:
+                    yield Token(TokenType[type_str], value)
+
+def parse_token_stream(tokens, empty_message="No valid tokens found in file") -> QueryNode:
+    # Tokens are pulled lazily; only the first one is checked up front so an
+    # empty stream still reports the old error instead of "Unexpected end of input"
+    tokens = iter(tokens)
+    first = next(tokens, None)
+    if first is None:
+        raise ValueError(empty_message)
+
+    parser = TableParser(itertools.chain([first], tokens))
     return parser.parse()
+
+def read_tokens_binary(data):
+    # Load a lex_*.tok written by tokenizer.write_tokens_binary; comments are skipped
+    data = memoryview(data)
+    if len(data) < TOKEN_FILE_HEADER.size:
+        raise ValueError("Truncated token file")
+    magic, version, count, strings_offset = TOKEN_FILE_HEADER.unpack_from(data)
+    if magic != TOKEN_FILE_MAGIC:
+        raise ValueError("Not a binary token file")
+    if version != TOKEN_FILE_VERSION:
+        raise ValueError(f"Unsupported token file version {version}")
+
+    records_end = TOKEN_FILE_HEADER.size + count * TOKEN_RECORD.size
+    if records_end != strings_offset or strings_offset + 4 > len(data):
+        raise ValueError("Truncated token file")
+
+    (string_count,) = struct.unpack_from("<I", data, strings_offset)
+    strings = []
+    offset = strings_offset + 4
+    for _ in range(string_count):
+        if offset + 4 > len(data):
+            raise ValueError("Truncated token file")
+        (length,) = struct.unpack_from("<I", data, offset)
+        offset += 4
+        if offset + length > len(data):
+            raise ValueError("Truncated token file")
+        strings.append(str(data[offset:offset + length], 'utf-8'))
+        offset += length
+
+    types = TOKEN_TYPES_BY_CODE
+    comment = TokenType.COMMENT
+    for code, index in TOKEN_RECORD.iter_unpack(data[TOKEN_FILE_HEADER.size:records_end]):
+        token_type = types[code] if code < len(types) else None
+        if token_type is None or index >= string_count:
+            raise ValueError("Corrupt token file")
+        if token_type is not comment:
+            yield Token(token_type, strings[index])
+
+def parse_tokens_file(file_path: str) -> QueryNode:
+    # lex_*.tok is the binary format; anything else is read as the text dump
+    if file_path.endswith(".tok"):
+        with open(file_path, 'rb') as f:
+            return parse_token_stream(read_tokens_binary(f.read()))
+    with open(file_path, 'r') as f:
+        return parse_token_stream(read_token_lines(f))
+
+def read_tokens_data(data: bytes, file_path: str) -> list:
+    # The tokens of a token file already read into memory, as parse_tokens_file reads them
+    if file_path.endswith(".tok"):
+        return list(read_tokens_binary(data))
+    return list(read_token_lines(io.TextIOWrapper(io.BytesIO(data))))
+
+# Binary AST files (parsed_*.ast): a header, a string table and the values
+# of every query in post-order, one little-endian 32-bit word each. A word is
+# an opcode in its low 3 bits and an argument above them. Values are pushed on
+# a stack and each node or tuple takes its fields off the top of it.
+AST_FILE_MAGIC = b"XQLA"
+AST_FILE_VERSION = 1
+# magic, version, query count, string count, string bytes, word count
+AST_FILE_HEADER = struct.Struct("<4sB3xIIII")
+# Node type codes of the format: new types are appended, never reordered
+AST_FILE_TYPES = (QueryNode, SelectNode, ColumnNode, FunctionNode, AliasNode, FromNode, WhereNode, ComparisonNode,
+                  ParamNode, TableColumnRef, LogicalNode, BracketNode, GroupByNode, HavingNode, OrderByNode, InNode)
+AST_TYPE_CODES = {node_type: code for code, node_type in enumerate(AST_FILE_TYPES)}
+# Opcodes and their argument: string table index, string table index of the
+# decimal digits, none, item count, type code
+AST_OP_STRING, AST_OP_INT, AST_OP_NONE, AST_OP_TUPLE, AST_OP_NODE = range(5)
+AST_OP_BITS = 3
+
+def little_endian_words(words: array) -> bytes:
+    if sys.byteorder == "big":
+        words = array('I', words)
+        words.byteswap()
+    return words.tobytes()
+
+def encode_asts(asts) -> bytes:
+    # Any number of QueryNodes in one buffer; each distinct string is stored once
+    strings = {}
+    words = array('I')
+    append = words.append
+    queries = 0
+    for ast in asts:
+        if type(ast) is not QueryNode:
+            raise ValueError(f"Expected a QueryNode, got {type(ast).__name__}")
+        queries += 1
+        # Post-order over an explicit stack: children are pushed reversed and
+        # pop in field order, their parent is written once they are done
+        stack = [(ast, False)]
+        while stack:
+            value, expanded = stack.pop()
+            value_type = type(value)
+            if value_type is str:
+                append(strings.setdefault(value, len(strings)) << AST_OP_BITS | AST_OP_STRING)
+            elif value is None:
+                append(AST_OP_NONE)
+            elif value_type is int:
+                # Integers of any size go through the string table
+                append(strings.setdefault(str(value), len(strings)) << AST_OP_BITS | AST_OP_INT)
+            elif expanded:
+                if value_type is tuple:
+                    append(len(value) << AST_OP_BITS | AST_OP_TUPLE)
+                else:
+                    append(AST_TYPE_CODES[value_type] << AST_OP_BITS | AST_OP_NODE)
+            elif value_type is tuple:
+                stack.append((value, True))
+                stack.extend((item, False) for item in reversed(value))
+            elif value_type in AST_TYPE_CODES:
+                stack.append((value, True))
+                stack.extend((getattr(value, name), False) for name in reversed(AST_FIELDS[value_type]))
+            else:
+                raise ValueError(f"Cannot encode {value_type.__name__} in an AST file")
+
+    # Lengths are in characters, so the loader decodes the table in one call
+    lengths = array('I', map(len, strings))
+    blob = "".join(strings).encode('utf-8')
+    header = AST_FILE_HEADER.pack(AST_FILE_MAGIC, AST_FILE_VERSION, queries, len(strings), len(blob), len(words))
+    return b"".join((header, little_endian_words(lengths), blob, little_endian_words(words)))
+
+def read_words(data, offset: int, count: int) -> array:
+    words = array('I')
+    words.frombytes(data[offset:offset + 4 * count])
+    if sys.byteorder == "big":
+        words.byteswap()
+    return words
+
+def decode_asts(data) -> List[QueryNode]:
+    # Load every QueryNode of a buffer written by encode_asts
+    data = memoryview(data)
+    if len(data) < AST_FILE_HEADER.size:
+        raise ValueError("Truncated AST file")
+    magic, version, queries, string_count, blob_size, word_count = AST_FILE_HEADER.unpack_from(data)
+    if magic != AST_FILE_MAGIC:
+        raise ValueError("Not a binary AST file")
+    if version != AST_FILE_VERSION:
+        raise ValueError(f"Unsupported AST file version {version}")
+    blob_offset = AST_FILE_HEADER.size + 4 * string_count
+    words_offset = blob_offset + blob_size
+    if words_offset + 4 * word_count != len(data):
+        raise ValueError("Truncated AST file")
+
+    text = str(data[blob_offset:words_offset], 'utf-8')
+    strings = []
+    position = 0
+    for length in read_words(data, AST_FILE_HEADER.size, string_count):
+        strings.append(text[position:position + length])
+        position += length
+    if position != len(text):
+        raise ValueError("Corrupt AST file")
+
+    types = AST_FILE_TYPES
+    arities = [len(AST_FIELDS[node_type]) for node_type in types]
+    asts = []
+    stack = []
+    push = stack.append
+    try:
+        for word in read_words(data, words_offset, word_count):
+            op = word & 7
+            if op == AST_OP_STRING:
+                push(strings[word >> AST_OP_BITS])
+            elif op == AST_OP_NODE:
+                code = word >> AST_OP_BITS
+                start = len(stack) - arities[code]
+                if start < 0:
+                    raise ValueError("Corrupt AST file")
+                node = types[code](*stack[start:])
+                del stack[start:]
+                if code == 0:
+                    # QueryNode, a whole query
+                    if stack:
+                        raise ValueError("Corrupt AST file")
+                    asts.append(node)
+                else:
+                    push(node)
+            elif op == AST_OP_TUPLE:
+                start = len(stack) - (word >> AST_OP_BITS)
+                if start < 0:
+                    raise ValueError("Corrupt AST file")
+                value = tuple(stack[start:])
+                del stack[start:]
+                push(value)
+            elif op == AST_OP_NONE:
+                push(None)
+            elif op == AST_OP_INT:
+                push(int(strings[word >> AST_OP_BITS]))
+            else:
+                raise ValueError("Corrupt AST file")
+    except IndexError:
+        raise ValueError("Corrupt AST file") from None
+    if stack or len(asts) != queries:
+        raise ValueError("Corrupt AST file")
+    return asts
+
+def read_ast_file(file_path: str) -> List[QueryNode]:
+    with open(file_path, 'rb') as f:
+        return decode_asts(f.read())
+
+def load_ast_files(file_paths) -> List[QueryNode]:
+    # Every query of many parsed_*.ast files, in order
+    asts = []
+    for file_path in file_paths:
+        asts.extend(read_ast_file(file_path))
+    return asts
+
+def parse_xml_string(source: Union[str, bytes]) -> QueryNode:
+    # Scan and parse in memory, without going through the lexer_output text files.
+    # bytes are scanned as UTF-8 directly, without decoding the whole input first
+    scanner = Scanner(source)
+    tokens = (token for token in scanner.iter_tokens() if token.type != TokenType.COMMENT)
+    return parse_token_stream(tokens, "No valid tokens found in input")
+
+def parse_token_buffer(buffer: TokenBuffer) -> QueryNode:
+    # Parse straight from a TokenBuffer; token values are only sliced out
+    # of the source for the literals the parser reads
+    comment = TokenType.COMMENT.value
+    types = buffer.types
+    tokens = (TokenView(buffer, i) for i in range(len(types)) if types[i] != comment)
+    return parse_token_stream(tokens, "No valid tokens found in input")
+
+def generate_sql_from_xml(source: Union[str, bytes], cache: Optional[CompilationCache] = None, optimize: bool = False) -> str:
+    # With a cache, the same document is only compiled once; a cached
+    # failure is raised again as an error of the same type and message
+    if cache is None:
+        return compile_xml(source, optimize)
+
+    key = cache_key(source, "sql-optimized" if optimize else "sql")
+    outcome = cache.get(key)
+    if outcome is None:
+        try:
+            outcome = {"sql": compile_xml(source, optimize)}
+        except (ValueError, SyntaxError, CodeGenError) as e:
+            outcome = error_outcome(e)
+        cache.put(key, outcome)
+    if "sql" in outcome:
+        return outcome["sql"]
+    raise outcome_error(outcome)
+
+def compile_xml(source: Union[str, bytes], optimize: bool = False) -> str:
+    ast = parse_xml_string(source)
+    return generate_sql_from_ast(optimize_ast(ast) if optimize else ast)
+
+def error_outcome(error: Exception) -> dict:
+    if isinstance(error, ScanError):
+        return {"error": "ScanError", "message": error.message, "location": [error.position, error.line, error.column]}
+    if isinstance(error, CodeGenError):
+        return {"error": "CodeGenError", "message": error.message}
+    if isinstance(error, SyntaxError):
+        return {"error": "SyntaxError", "message": str(error)}
+    return {"error": "ValueError", "message": str(error)}
+
+def outcome_error(outcome: dict) -> Exception:
+    kind, message = outcome["error"], outcome["message"]
+    if kind == "ScanError":
+        return ScanError(message, *outcome["location"])
+    if kind == "CodeGenError":
+        return CodeGenError(message)
+    if kind == "SyntaxError":
+        return SyntaxError(message)
+    return ValueError(message)
+
+class RecoveringTokenStream:
+    """Token iterator for multi-query documents that survives scan errors.
+
+    A scan error is raised to the parser once. Inside a query, scanning then
+    resumes after the next </query> in the input, which is reported as a
+    QUERY_CLOSE token so Parser.skip_query lands on the right boundary.
+    Between queries it resumes at the next <queries>, <query> or </queries>
+    tag, so the query that follows is still parsed.
+    """
+    def __init__(self, scanner: Scanner):
+        self.scanner = scanner
+        self.tokens = None
+        self.pending = None
+        self.in_query = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Token:
+        token = self.next_token()
+        if token.type == TokenType.QUERY_OPEN:
+            self.in_query = True
+        elif token.type == TokenType.QUERY_CLOSE:
+            self.in_query = False
+        return token
+
+    def next_token(self) -> Token:
+        if self.pending is not None:
+            token, self.pending = self.pending, None
+            return token
+        if self.tokens is None:
+            self.tokens = self.scanner.iter_tokens()
+        try:
+            token = next(self.tokens)
+            while token.type == TokenType.COMMENT:
+                token = next(self.tokens)
+            return token
+        except ValueError:
+            self.tokens = None
+            if self.in_query:
+                end = self.find("</query>")
+                self.scanner.position = len(self.scanner.input) if end < 0 else end + len("</query>")
+                self.pending = Token(TokenType.QUERY_CLOSE, "</query>", self.scanner.position, self.scanner.position)
+            else:
+                starts = [start for start in map(self.find, ("<queries>", "<query>", "</queries>")) if start >= 0]
+                self.scanner.position = min(starts, default=len(self.scanner.input))
+            raise
+
+    def find(self, tag: str) -> int:
+        text = self.scanner.input
+        return text.find(tag.encode() if self.scanner.binary else tag, self.scanner.position)
+
+@dataclass
+class QueryResult:
+    index: int
+    ast: Optional[QueryNode] = None
+    sql: Optional[str] = None
+    error: Optional[Exception] = None
+
+def iter_queries(source: Union[str, bytes], generate: bool = True, interner: ASTInterner = None):
+    # One QueryResult per <query>, yielded as soon as its closing tag is parsed.
+    # With an interner, the ASTs share their repeated subtrees.
+    parser = TableParser(RecoveringTokenStream(Scanner(source)))
+    for index, outcome in parser.parse_queries():
+        if isinstance(outcome, Exception):
+            yield QueryResult(index, error=outcome)
+            continue
+
+        if interner is not None:
+            outcome = interner.intern(outcome)
+        result = QueryResult(index, ast=outcome)
+        if generate:
+            try:
+                result.sql = generate_sql_from_ast(outcome)
+            except CodeGenError as e:
+                result.error = e
+        yield result
 """
 def print_ast(node, indent=0):
     prefix = "  " * indent
@@ -766,7 +1922,143 @@ def process_lexer_output():
             except Exception as e:
                 print(f"Error parsing {filename}: {str(e)}")
 """
-def process_files(input_dir: str = "./lexer_output", output_dir: str = "./parser_output", codegen_dir: str = "./codegen_output"):
+def parse_outcome(input_path: str, stats: Optional[FileProfile] = None, ast_format: str = "text", optimize: bool = False) -> dict:
+    # Parse one token file and generate its SQL. Only strings are kept, so
+    # the outcome can be stored in a CompilationCache: "ast" is the text dump,
+    # or the binary encoding in base64, and None when parsing failed. With
+    # optimize, both are made from the optimized AST and "warnings" lists
+    # the contradictions found. With stats, "counts" holds the token and
+    # AST node counts, so a cached outcome can report them too.
+    counts = {}
+    try:
+        if stats is None:
+            ast = parse_tokens_file(input_path)
+        else:
+            # Read and decode up front so each stage is timed on its own
+            with stats.stage("read"):
+                with open(input_path, 'rb') as f:
+                    data = f.read()
+            with stats.stage("load"):
+                tokens = read_tokens_data(data, input_path)
+            counts["tokens"] = len(tokens)
+            with stats.stage("parse"):
+                ast = parse_token_stream(tokens)
+            counts["ast_nodes"] = count_ast_nodes(ast)
+            for name, amount in counts.items():
+                stats.count(name, amount)
+        warnings = []
+        if optimize:
+            with timed(stats, "optimize"):
+                optimizer = Optimizer()
+                ast = optimizer.optimize(ast)
+            warnings = optimizer.contradictions
+        with timed(stats, "dump"):
+            if ast_format == "binary":
+                dump = base64.b64encode(encode_asts([ast])).decode('ascii')
+            else:
+                output = io.StringIO()
+                write_ast_to_file(ast, output)
+                dump = output.getvalue()
+        try:
+            with timed(stats, "codegen"):
+                sql = generate_sql_from_ast(ast)
+            return {"ast": dump, "sql": sql, "error": None, "warnings": warnings, "counts": counts}
+        except CodeGenError as e:
+            return {"ast": dump, "sql": None, "error": e.message, "warnings": warnings, "counts": counts}
+    except Exception as e:
+        return {"ast": None, "sql": None, "error": str(e)}
+
+def source_name(filename: str) -> str:
+    # lex_test1.txt / lex_test1.tok -> test1.txt
+    filename = filename.split('_')[1]
+    if filename.endswith(".tok"):
+        filename = filename[:-len(".tok")] + ".txt"
+    return filename
+
+def parse_output_paths(filename: str, output_dir: str, codegen_dir: str, ast_format: str = "text"):
+    filename = source_name(filename)
+    ast_name = filename[:-len(".txt")] + ".ast" if ast_format == "binary" else filename
+    return [os.path.join(output_dir, f"parsed_{ast_name}"), os.path.join(codegen_dir, f"code_gen_{filename}")]
+
+def parse_file(filename: str, input_dir: str, output_dir: str, codegen_dir: str, cache_path: Optional[str] = None, profile: bool = False, ast_format: str = "text", optimize: bool = False):
+    # Parse one lex_*.txt or lex_*.tok and generate its SQL; returns (console
+    # lines, error or None, FileProfile.as_dict() or None)
+    input_path = os.path.join(input_dir, filename)
+    output_path, codegen_path = parse_output_paths(filename, output_dir, codegen_dir, ast_format)
+
+    stats = FileProfile(filename) if profile else None
+    # extract original filename
+    filename = source_name(filename)
+    
+    log = [f"\nProcessing {filename}:"]
+    try:
+        if stats is not None:
+            stats.count("bytes_read", os.path.getsize(input_path))
+        if cache_path is None:
+            outcome = parse_outcome(input_path, stats, ast_format, optimize)
+        else:
+            # Token files with the same content share one cached outcome
+            with timed(stats, "cache"):
+                cache = shared_cache(cache_path)
+                with open(input_path, 'rb') as f:
+                    namespace = "parse" + ("-binary" if ast_format == "binary" else "") + ("-optimized" if optimize else "")
+                    key = cache_key(f.read(), namespace)
+                outcome = cache.get(key)
+            if outcome is None:
+                # Always counted, so later hits have the counts to report
+                outcome = parse_outcome(input_path, stats or FileProfile(filename), ast_format, optimize)
+                with timed(stats, "cache"):
+                    cache.put(key, outcome)
+            elif stats is not None:
+                stats.count("cache_hits", 1)
+                for name, amount in outcome.get("counts", {}).items():
+                    stats.count(name, amount)
+
+        if outcome["ast"] is None:
+            raise ValueError(outcome["error"])
+        log.append("Successfully parsed. Check output file for AST structure.")
+        log.extend(f"Warning: {warning}" for warning in outcome.get("warnings", ()))
+        # Write AST to output file
+        if ast_format == "binary":
+            with timed(stats, "write"), open(output_path, 'wb') as f:
+                f.write(base64.b64decode(outcome["ast"]))
+        else:
+            with timed(stats, "write"), open(output_path, 'w') as f:
+                f.write("Successfully parsed. AST structure:\n")
+                f.write(outcome["ast"])
+        
+        log.append("Starting SQL code generation...")
+        if outcome["error"] is not None:
+            log.append(f"Code generation failed: {outcome['error']}")
+            with timed(stats, "write"), open(codegen_path, 'w') as f:
+                f.write(f"Code Generation Error: {outcome['error']}\n")
+            return log, outcome["error"], finish_profile(stats, outcome["error"], output_path, codegen_path)
+
+        val = outcome["sql"]
+        log.append(f"Generated SQL: {val}")
+        with timed(stats, "write"), open(codegen_path, 'w') as f:
+            f.write(val)
+        log.append("Code generation successful")
+            
+    except Exception as e:
+        log.append(f"Error parsing {filename}: {str(e)}")
+        # Write error to output file; a binary AST file is only written for
+        # a parsed query, so every one of them loads
+        if ast_format != "binary":
+            with timed(stats, "write"), open(output_path, 'w') as f:
+                f.write(f"Error parsing file: {str(e)}\n")
+        return log, str(e), finish_profile(stats, str(e), output_path)
+
+    return log, None, finish_profile(stats, None, output_path, codegen_path)
+
+def finish_profile(stats: Optional[FileProfile], error: Optional[str], *outputs):
+    if stats is None:
+        return None
+    stats.error = error
+    stats.count("bytes_written", sum(os.path.getsize(path) for path in outputs if os.path.exists(path)))
+    return stats.as_dict()
+
+def process_files(input_dir: str = "./lexer_output", output_dir: str = "./parser_output", codegen_dir: str = "./codegen_output", jobs: int = 1, cache_path: Optional[str] = None, incremental: bool = False, observers=None, ast_format: str = "text", optimize: bool = False):
     if not os.path.exists(input_dir):
         print(f"Error: Input directory {input_dir} does not exist")
         return
@@ -775,134 +2067,186 @@ def process_files(input_dir: str = "./lexer_output", output_dir: str = "./parser
     os.makedirs(output_dir, exist_ok=True)
     os.makedirs(codegen_dir, exist_ok=True)
     
-    for filename in os.listdir(input_dir):
-        if filename.endswith(".txt"):
-            input_path = os.path.join(input_dir, filename)
+    filenames = sorted(filename for filename in os.listdir(input_dir) if filename.endswith((".txt", ".tok")))
+    # Workers only measure their stages when someone is observing the run
+    observers = observers or []
+    work = functools.partial(parse_file, input_dir=input_dir, output_dir=output_dir, codegen_dir=codegen_dir, cache_path=cache_path, profile=bool(observers), ast_format=ast_format, optimize=optimize)
+    outputs_for = functools.partial(parse_output_paths, output_dir=output_dir, codegen_dir=codegen_dir, ast_format=ast_format)
 
-            # extract original filename
-            filename = filename.split('_')[1]
+    start = time.perf_counter()
+    notify(observers, "start_run", "parse", filenames)
+    # An unchanged lex_* file is skipped even when the tokenizer rewrote it
+    todo, fresh = filenames, []
+    if incremental:
+        manifest = Manifest(os.path.join(output_dir, MANIFEST_NAME), "parse", {"ast_format": ast_format, "optimize": optimize})
+        todo, fresh = incremental_build(manifest, filenames, input_dir, outputs_for)
 
-            output_path = os.path.join(output_dir, f"parsed_{filename}")
+    errors = []
+    for filename, (log, error, profile) in zip(todo, map_files(work, todo, jobs)):
+        print("\n".join(log))
+        if error is not None:
+            errors.append((filename, error))
+        if incremental:
+            manifest.record(filename, os.path.join(input_dir, filename), outputs_for(filename), error)
+        if observers:
+            notify(observers, "file_done", "parse", profile)
 
-            codegen_path = os.path.join(codegen_dir, f"code_gen_{filename}")
-            
-            print(f"\nProcessing {filename}:")
-            try:
-                ast = parse_tokens_file(input_path)
-                print("Successfully parsed. Check output file for AST structure.")
-                # Write AST to output file
-                with open(output_path, 'w') as f:
-                    f.write("Successfully parsed. AST structure:\n")
-                    write_ast_to_file(ast, f)
-                
-               
-                try:
-                    print("Starting SQL code generation...")
-                    val = generate_sql_from_ast(ast)
-                    print("Generated SQL:", val)
-                    with open(codegen_path, 'w') as f:
-                        f.write(val)
-                    print("Code generation successful")
-                except CodeGenError as e:
-                    print(f"Code generation failed: {e.message}")
-                    with open(codegen_path, 'w') as f:
-                        f.write(f"Code Generation Error: {e.message}\n")
-                    continue
-                    
-            except Exception as e:
-                print(f"Error parsing {filename}: {str(e)}")
-                # Write error to output file
-                with open(output_path, 'w') as f:
-                    f.write(f"Error parsing file: {str(e)}\n")
+    if incremental:
+        manifest.save()
+        # Files skipped as up to date still report the error they failed with
+        errors = sorted(errors + [(filename, manifest.error(filename)) for filename in fresh if manifest.error(filename) is not None])
+        print_summary("Parsed", len(filenames), errors, up_to_date=len(fresh))
+    else:
+        print_summary("Parsed", len(filenames), errors)
+    notify(observers, "end_run", "parse", time.perf_counter() - start)
+    return errors
 
 def write_ast_to_file(node, file, indent=0):
-    prefix = "  " * indent
-    
-    if isinstance(node, QueryNode):
-        file.write(f"{prefix}Query:\n")
-        write_ast_to_file(node.select, file, indent + 1)
-        write_ast_to_file(node.from_, file, indent + 1)
-        if node.where:
-            write_ast_to_file(node.where, file, indent + 1)
-        if node.group_by:
-            write_ast_to_file(node.group_by, file, indent + 1)
-        if node.having:
-            write_ast_to_file(node.having, file, indent + 1)
-        if node.order_by:
-            write_ast_to_file(node.order_by, file, indent + 1)
-    
-    elif isinstance(node, SelectNode):
-        file.write(f"{prefix}Select:\n")
-        for col in node.columns:
-            write_ast_to_file(col, file, indent + 1)
-    
-    elif isinstance(node, ColumnNode):
-        if isinstance(node.value, str):
-            file.write(f"{prefix}Column: {node.value}\n")
-        else:
-            file.write(f"{prefix}Column:\n")
-            write_ast_to_file(node.value, file, indent + 1)
-    
-    elif isinstance(node, FunctionNode):
-        file.write(f"{prefix}Function: {node.name}\n")
-        file.write(f"{prefix}  Parameters:\n")
-        for arg in node.arguments:
-            file.write(f"{prefix}    Column: {arg}\n")
-    
-    elif isinstance(node, AliasNode):
-        file.write(f"{prefix}Alias:\n")
-        file.write(f"{prefix}  Expression:\n")
-        if isinstance(node.expression, str):
-            file.write(f"{prefix}    {node.expression}\n")
-        else:
-            write_ast_to_file(node.expression, file, indent + 2)
-        file.write(f"{prefix}  As: {node.alias}\n")
-    
-    elif isinstance(node, FromNode):
-        file.write(f"{prefix}From:\n")
-        for table in node.tables:
-            file.write(f"{prefix}  Table: {table}\n")
-    
-    elif isinstance(node, WhereNode):
-        file.write(f"{prefix}Where:\n")
-        write_ast_to_file(node.condition, file, indent + 1)
-    
-    elif isinstance(node, ComparisonNode):
-        file.write(f"{prefix}Comparison ({node.operator}):\n")
-        file.write(f"{prefix}  Left:\n")
-        if isinstance(node.left, str):
-            file.write(f"{prefix}    {node.left}\n")
-        else:
-            write_ast_to_file(node.left, file, indent + 2)
-        file.write(f"{prefix}  Right: {node.right}\n")
-    
-    elif isinstance(node, TableColumnRef):
-        file.write(f"{prefix}Reference: {node.table}.{node.column}\n")
-    
-    elif isinstance(node, LogicalNode):
-        file.write(f"{prefix}Logical {node.operator}:\n")
-        file.write(f"{prefix}  Left:\n")
-        write_ast_to_file(node.left, file, indent + 2)
-        file.write(f"{prefix}  Right:\n")
-        write_ast_to_file(node.right, file, indent + 2)
-    
-    elif isinstance(node, BracketNode):
-        file.write(f"{prefix}Bracketed Expression:\n")
-        write_ast_to_file(node.expression, file, indent + 1)
-    
-    elif isinstance(node, GroupByNode):
-        file.write(f"{prefix}Group By:\n")
-        for col in node.columns:
-            file.write(f"{prefix}  Column: {col}\n")
-    
-    elif isinstance(node, HavingNode):
-        file.write(f"{prefix}Having:\n")
-        write_ast_to_file(node.condition, file, indent + 1)
-    
-    elif isinstance(node, OrderByNode):
-        file.write(f"{prefix}Order By:\n")
-        file.write(f"{prefix}  Column: {node.column}\n")
-        file.write(f"{prefix}  Direction: {node.direction}\n")
+    # Works from an explicit stack of pending nodes and text, so deep
+    # conditions do not recurse. Each node expands to its lines and children
+    # in output order; they are pushed reversed so they pop in that order.
+    stack = [(node, indent)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            file.write(item)
+            continue
+        node, indent = item
+        prefix = "  " * indent
+        items = []
+
+        if isinstance(node, QueryNode):
+            items.append(f"{prefix}Query:\n")
+            items.append((node.select, indent + 1))
+            items.append((node.from_, indent + 1))
+            if node.where:
+                items.append((node.where, indent + 1))
+            if node.group_by:
+                items.append((node.group_by, indent + 1))
+            if node.having:
+                items.append((node.having, indent + 1))
+            if node.order_by:
+                items.append((node.order_by, indent + 1))
+        
+        elif isinstance(node, SelectNode):
+            items.append(f"{prefix}Select:\n")
+            for col in node.columns:
+                items.append((col, indent + 1))
+        
+        elif isinstance(node, ColumnNode):
+            if isinstance(node.value, str):
+                items.append(f"{prefix}Column: {node.value}\n")
+            else:
+                items.append(f"{prefix}Column:\n")
+                items.append((node.value, indent + 1))
+        
+        elif isinstance(node, FunctionNode):
+            items.append(f"{prefix}Function: {node.name}\n")
+            items.append(f"{prefix}  Parameters:\n")
+            for arg in node.arguments:
+                items.append(f"{prefix}    Column: {arg}\n")
+        
+        elif isinstance(node, AliasNode):
+            items.append(f"{prefix}Alias:\n")
+            items.append(f"{prefix}  Expression:\n")
+            if isinstance(node.expression, str):
+                items.append(f"{prefix}    {node.expression}\n")
+            else:
+                items.append((node.expression, indent + 2))
+            items.append(f"{prefix}  As: {node.alias}\n")
+        
+        elif isinstance(node, FromNode):
+            items.append(f"{prefix}From:\n")
+            for table in node.tables:
+                items.append(f"{prefix}  Table: {table}\n")
+        
+        elif isinstance(node, WhereNode):
+            items.append(f"{prefix}Where:\n")
+            items.append((node.condition, indent + 1))
+        
+        elif isinstance(node, ComparisonNode):
+            items.append(f"{prefix}Comparison ({node.operator}):\n")
+            items.append(f"{prefix}  Left:\n")
+            if isinstance(node.left, str):
+                items.append(f"{prefix}    {node.left}\n")
+            else:
+                items.append((node.left, indent + 2))
+            if isinstance(node.right, ParamNode):
+                items.append(f"{prefix}  Right: Param {node.right.name}\n")
+            else:
+                items.append(f"{prefix}  Right: {node.right}\n")
+        
+        elif isinstance(node, TableColumnRef):
+            items.append(f"{prefix}Reference: {node.table}.{node.column}\n")
+        
+        elif isinstance(node, LogicalNode):
+            items.append(f"{prefix}Logical {node.operator}:\n")
+            if len(node.operands) == 2:
+                items.append(f"{prefix}  Left:\n")
+                items.append((node.operands[0], indent + 2))
+                items.append(f"{prefix}  Right:\n")
+                items.append((node.operands[1], indent + 2))
+            else:
+                items.append(f"{prefix}  Operands:\n")
+                for operand in node.operands:
+                    items.append((operand, indent + 2))
+        
+        elif isinstance(node, BracketNode):
+            items.append(f"{prefix}Bracketed Expression:\n")
+            items.append((node.expression, indent + 1))
+        
+        elif isinstance(node, InNode):
+            items.append(f"{prefix}In:\n")
+            items.append((node.column, indent + 1))
+            for value in node.values:
+                if isinstance(value, ParamNode):
+                    items.append(f"{prefix}  Value: Param {value.name}\n")
+                else:
+                    items.append(f"{prefix}  Value: {value}\n")
+        
+        elif isinstance(node, GroupByNode):
+            items.append(f"{prefix}Group By:\n")
+            for col in node.columns:
+                items.append(f"{prefix}  Column: {col}\n")
+        
+        elif isinstance(node, HavingNode):
+            items.append(f"{prefix}Having:\n")
+            items.append((node.condition, indent + 1))
+        
+        elif isinstance(node, OrderByNode):
+            items.append(f"{prefix}Order By:\n")
+            items.append(f"{prefix}  Column: {node.column}\n")
+            items.append(f"{prefix}  Direction: {node.direction}\n")
+
+        stack.extend(reversed(items))
+
+def translate_record(line: str, cache_path: Optional[str] = None, optimize: bool = False) -> str:
+    # One JSONL record {"id", "xql"} in, {"id", "sql"} or {"id", "error", ...} out
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        return json.dumps({"id": None, "error": "BadRecord", "message": f"Invalid JSON: {e}"})
+    record_id = record.get("id") if isinstance(record, dict) else None
+    if not isinstance(record, dict) or not isinstance(record.get("xql"), str):
+        return json.dumps({"id": record_id, "error": "BadRecord", "message": 'Expected an object with an "xql" string'})
+
+    cache = shared_cache(cache_path) if cache_path else None
+    try:
+        outcome = {"sql": generate_sql_from_xml(record["xql"], cache, optimize)}
+    except (ValueError, SyntaxError, CodeGenError) as e:
+        outcome = error_outcome(e)
+    return json.dumps({"id": record_id, **outcome})
+
+def stream_jsonl(input_file, output_file, jobs: int = 1, cache_path: Optional[str] = None, optimize: bool = False) -> int:
+    # Translate records as they are read and write each result as soon as
+    # it is ready, in input order; returns the number of records
+    lines = (line for line in input_file if line.strip())
+    count = 0
+    for result in stream_map(functools.partial(translate_record, cache_path=cache_path, optimize=optimize), lines, jobs):
+        output_file.write(result + "\n")
+        output_file.flush()
+        count += 1
+    return count
 
 if __name__ == "__main__":
     import argparse
@@ -912,8 +2256,31 @@ if __name__ == "__main__":
                       help='Input directory containing lexer output files (default: ./lexer_output)')
     parser.add_argument('--output', default='./parser_output',
                       help='Output directory for parser results (default: ./parser_output)')
+    parser.add_argument('--jobs', type=int, default=1,
+                      help='Number of worker processes (default: 1)')
+    parser.add_argument('--cache', default=None,
+                      help='SQLite file caching outcomes across runs, shared with tokenizer.py --cache')
     
-    args = parser.parse_args()
-    process_files(args.input, args.output)
+    parser.add_argument('--incremental', action='store_true',
+                      help='Only parse token files changed since the last incremental run')
+    
+    parser.add_argument('--profile', default=None,
+                      help='Write per-stage timings and counts of each file to this JSON file')
+    parser.add_argument('--cprofile', action='store_true',
+                      help='Also run under cProfile and add the slowest functions to the --profile file')
+    parser.add_argument('--ast-format', choices=['text', 'binary'], default='text',
+                      help='AST file format: readable parsed_*.txt or compact parsed_*.ast (default: text)')
+    parser.add_argument('--optimize', action='store_true',
+                      help='Simplify conditions before generating SQL: drop redundant brackets and repeated predicates, turn OR-ed equalities into IN')
+    parser.add_argument('--jsonl', action='store_true',
+                      help='Translate {"id", "xql"} records from stdin to JSON lines on stdout instead of files')
     
-    print("\nParsing complete. Check the output directory for results.")
\ No newline at end of file
+    args = parser.parse_args()
+    if args.cprofile and args.profile is None:
+        parser.error("--cprofile needs --profile, the file its results are written to")
+    if args.jsonl:
+        stream_jsonl(sys.stdin, sys.stdout, jobs=args.jobs, cache_path=args.cache, optimize=args.optimize)
+    else:
+        run_profiled(process_files, args.profile, args.cprofile, input_dir=args.input, output_dir=args.output, jobs=args.jobs, cache_path=args.cache, incremental=args.incremental, ast_format=args.ast_format, optimize=args.optimize)
+        
+        print("\nParsing complete. Check the output directory for results.")
\ No newline at end of file
@@ -3,8 +3,8 @@
 echo "Shell Script Executing All Tests...."
 
 # Execute the Python script lexer.py
-python ./tokenizer.py
+python ./tokenizer.py --incremental
 
-python ./parser.py
+python ./parser.py --incremental
 
 echo "Exited"
@@ -0,0 +1,218 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from cache import shared_cache
+from parser import CodeGenError, error_outcome, generate_sql_from_xml
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+                500: "Internal Server Error"}
+
+def translate_batch(sources, cache_path: str = None) -> list:
+    # Runs in a pool worker: one outcome per document, {"sql": ...} or the
+    # structured error of error_outcome
+    cache = shared_cache(cache_path) if cache_path else None
+    outcomes = []
+    for source in sources:
+        try:
+            outcomes.append({"sql": generate_sql_from_xml(source, cache)})
+        except (ValueError, SyntaxError, CodeGenError) as e:
+            outcomes.append(error_outcome(e))
+    return outcomes
+
+class TranslationServer:
+    """Translates XQL documents posted over HTTP, in micro-batches.
+
+    Each request waits in a bounded queue. A batcher takes up to batch_size
+    documents, or whatever arrived within batch_delay seconds of the first,
+    and hands them to a process pool as one task. When the queue is full,
+    handlers wait before reading more requests, which pushes back on the
+    clients; at most two batches per worker are in flight.
+    """
+    def __init__(self, workers: int = None, batch_size: int = 64, batch_delay: float = 0.002,
+                 queue_depth: int = 1024, max_body: int = 16 << 20, cache_path: str = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.queue_depth = queue_depth
+        self.max_body = max_body
+        self.cache_path = cache_path
+        self.queue = None
+        self.pool = None
+        self.in_flight = None
+        self.requests = 0
+        self.batches = 0
+        self.max_queued = 0
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765, unix_path: str = None):
+        self.queue = asyncio.Queue(maxsize=self.queue_depth)
+        self.in_flight = asyncio.Semaphore(self.workers * 2)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        batcher = asyncio.create_task(self.run_batches())
+        try:
+            if unix_path is not None:
+                server = await asyncio.start_unix_server(self.handle_connection, path=unix_path)
+                print(f"Serving on unix socket {unix_path}")
+            else:
+                server = await asyncio.start_server(self.handle_connection, host, port)
+                print(f"Serving on http://{host}:{port}")
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self.pool.shutdown(cancel_futures=True)
+
+    async def translate(self, source: bytes) -> dict:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((source, future))
+        self.max_queued = max(self.max_queued, self.queue.qsize())
+        return await future
+
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self.in_flight.acquire()
+            self.batches += 1
+            pool = self.pool
+            try:
+                task = loop.run_in_executor(pool, translate_batch, [source for source, _ in batch], self.cache_path)
+            except BrokenProcessPool as e:
+                task = loop.create_future()
+                task.set_exception(e)
+            task.add_done_callback(lambda task, batch=batch, pool=pool: self.finish_batch(task, batch, pool))
+
+    def finish_batch(self, task, batch, pool):
+        self.in_flight.release()
+        if task.cancelled():
+            return
+        error = task.exception()
+        if isinstance(error, BrokenProcessPool) and pool is self.pool:
+            # A worker died and the pool refuses new work; later batches get a new one
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(task.result()[index])
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": round(self.requests / self.batches, 2) if self.batches else 0,
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_queued,
+            "queue_limit": self.queue_depth,
+            "workers": self.workers,
+        }
+
+    async def handle_connection(self, reader, writer):
+        # HTTP/1.1 with keep-alive: POST /translate takes the document as the
+        # body, GET /stats reports the queue and batch counters
+        try:
+            while True:
+                request = await read_request(reader, self.max_body)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, payload = await self.route(method, path, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as e:
+            write_response(writer, 413 if "too large" in str(e) else 400, {"error": "BadRequest", "message": str(e)}, False)
+        finally:
+            writer.close()
+
+    async def route(self, method: str, path: str, body: bytes):
+        if path == "/translate":
+            if method != "POST":
+                return 405, {"error": "BadRequest", "message": "Use POST"}
+            self.requests += 1
+            try:
+                outcome = await self.translate(body)
+            except Exception as e:
+                # The batch failed as a whole, such as a BrokenProcessPool
+                return 500, {"error": "InternalError", "message": f"{type(e).__name__}: {e}"}
+            return (200 if "sql" in outcome else 400), outcome
+        if path == "/stats":
+            return 200, self.stats()
+        return 404, {"error": "BadRequest", "message": f"Unknown path: {path}"}
+
+async def read_request(reader, max_body: int):
+    # Returns (method, path, headers, body), or None once the client is done
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise ValueError("Malformed request line")
+    method, path, _ = parts
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode('latin-1').partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > max_body:
+        raise ValueError(f"Request body too large: {length} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+def write_response(writer, status: int, payload: dict, keep_alive: bool = True):
+    body = json.dumps(payload).encode()
+    head = (f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode('latin-1') + body)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve XQL to SQL translation over HTTP')
+    parser.add_argument('--host', default='127.0.0.1',
+                      help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765,
+                      help='Port to listen on (default: 8765)')
+    parser.add_argument('--unix', default=None,
+                      help='Listen on this Unix socket instead of a TCP port')
+    parser.add_argument('--workers', type=int, default=None,
+                      help='Number of worker processes (default: one per CPU)')
+    parser.add_argument('--batch-size', type=int, default=64,
+                      help='Most documents handed to a worker at once (default: 64)')
+    parser.add_argument('--batch-delay', type=float, default=2.0,
+                      help='Milliseconds to wait for a batch to fill (default: 2)')
+    parser.add_argument('--queue-depth', type=int, default=1024,
+                      help='Requests queued before clients are held back (default: 1024)')
+    parser.add_argument('--cache', default=None,
+                      help='SQLite file caching outcomes, shared with the batch scripts')
+
+    args = parser.parse_args()
+    server = TranslationServer(workers=args.workers, batch_size=args.batch_size, batch_delay=args.batch_delay / 1000,
+                               queue_depth=args.queue_depth, cache_path=args.cache)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        print("\nServer stopped.")
@@ -0,0 +1,191 @@
+import itertools
+import string
+from typing import Optional, Union
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from cache import CompilationCache, cache_key
+from parser import CodeGenError, CodeGenerator, ParamNode, error_outcome, outcome_error, parse_xml_string
+
+# Stands in for a parameter in the generated SQL until the plan is split
+PARAM_SENTINEL = "\0"
+
+# Compiled templates by name, see compile_template
+TEMPLATES = {}
+
+class TemplateCodeGenerator(CodeGenerator):
+    """Generates SQL with a sentinel in place of every <param>."""
+    def __init__(self, ast):
+        super().__init__(ast)
+        self.params = []
+
+    def process_operand(self, operand, wrap_strings=False):
+        if isinstance(operand, ParamNode):
+            self.params.append(operand.name)
+            return PARAM_SENTINEL
+        return super().process_operand(operand, wrap_strings)
+
+def quote_value(name: str, value) -> str:
+    # SQL literal for a bound value; quotes inside strings are doubled
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(value)
+    raise TypeError(f"Parameter '{name}' must be a string or an integer, got {type(value).__name__}")
+
+class Template:
+    """A query compiled once, rendered by filling in its parameters.
+
+    The render plan is a str.format pattern over the generated SQL with one
+    positional field per distinct parameter name, so rendering only quotes
+    the values and assembles the string.
+    """
+    def __init__(self, pattern: str, names, key: str = None, name: str = None):
+        self.pattern = pattern
+        self.names = tuple(names)
+        self.key = key
+        self.name = name
+        # The pattern as (literal text, parameter name or None) segments, for batches
+        self.segments = [(text, None if field is None else self.names[int(field)])
+                         for text, field, _, _ in string.Formatter().parse(pattern)]
+
+    def __repr__(self):
+        return f"Template({self.name!r}, params={list(self.names)})"
+
+    def render(self, values: Optional[dict] = None, **params) -> str:
+        if values is not None:
+            params = {**values, **params}
+        missing = [name for name in self.names if name not in params]
+        if missing:
+            raise ValueError(f"Missing template parameter(s): {', '.join(missing)}")
+        return self.pattern.format(*[quote_value(name, params[name]) for name in self.names])
+
+    def parameterized(self):
+        # The SQL with a ? placeholder for each parameter occurrence, and the
+        # parameter name of each placeholder, for drivers that bind values
+        sql = "".join(text + ("?" if name is not None else "") for text, name in self.segments)
+        return sql, tuple(name for _, name in self.segments if name is not None)
+
+    def iter_batch(self, columns: dict, chunk_size: int = 65536):
+        """Render one statement per row of columns, a chunk of rows at a time.
+
+        columns maps each parameter to a NumPy array or sequence with one
+        value per row, or to a single value used for every row. Each column
+        is quoted as a whole, then every row is one join of the literal
+        SQL pieces and that row's quoted values.
+        """
+        scalars, sequences, rows = batch_columns(self.names, columns)
+        for start in range(0, rows, chunk_size):
+            count = min(chunk_size, rows - start)
+            quoted = {name: quote_column(name, values[start:start + count]) for name, values in sequences.items()}
+            parts = []
+            for text, name in self.segments:
+                if text:
+                    parts.append(itertools.repeat(text, count))
+                if name in quoted:
+                    parts.append(quoted[name])
+                elif name is not None:
+                    parts.append(itertools.repeat(scalars[name], count))
+            yield from map("".join, zip(*parts))
+
+    def render_batch(self, columns: dict) -> list:
+        return list(self.iter_batch(columns))
+
+    def write_batch(self, columns: dict, file, terminator: str = ";\n", chunk_size: int = 65536) -> int:
+        # Writes every statement followed by terminator, returns the statement count
+        rows = 0
+        batch = self.iter_batch(columns, chunk_size)
+        while True:
+            chunk = list(itertools.islice(batch, chunk_size))
+            if not chunk:
+                return rows
+            file.write(terminator.join(chunk) + terminator)
+            rows += len(chunk)
+
+def quote_column(name: str, values) -> list:
+    # Quote a whole column of values at once. NumPy integer and string arrays
+    # are converted with array operations, plain sequences one type at a time.
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        kind = values.dtype.kind
+        if kind in "iu":
+            return values.astype(str).tolist()
+        if kind == "U":
+            escaped = numpy.char.replace(values, "'", "''")
+            return numpy.char.add(numpy.char.add("'", escaped), "'").tolist()
+        values = values.tolist()
+    values = list(values)
+    if all(type(value) is str for value in values):
+        return ["'" + value.replace("'", "''") + "'" for value in values]
+    if all(type(value) is int for value in values):
+        return list(map(str, values))
+    return [quote_value(name, value) for value in values]
+
+def batch_columns(names, columns: dict):
+    # Split parameters into quoted scalars, used by every row, and sequences
+    # of one value per row. Returns (scalars, sequences, row count).
+    missing = [name for name in names if name not in columns]
+    if missing:
+        raise ValueError(f"Missing template parameter(s): {', '.join(missing)}")
+
+    scalars, sequences, rows = {}, {}, None
+    for name in names:
+        values = columns[name]
+        if numpy is not None and isinstance(values, numpy.generic):
+            values = values.item()
+        if isinstance(values, (str, int)):
+            scalars[name] = quote_value(name, values)
+            continue
+        if numpy is not None and isinstance(values, numpy.ndarray) and values.ndim != 1:
+            raise ValueError(f"Parameter '{name}' must be a one-dimensional array")
+        if rows is None:
+            rows = len(values)
+        elif len(values) != rows:
+            raise ValueError(f"Parameter '{name}' has {len(values)} values, expected {rows}")
+        sequences[name] = values
+    return scalars, sequences, 1 if rows is None else rows
+
+def build_plan(source: Union[str, bytes]) -> dict:
+    generator = TemplateCodeGenerator(parse_xml_string(source))
+    pieces = generator.generate().split(PARAM_SENTINEL)
+    if len(pieces) != len(generator.params) + 1:
+        raise CodeGenError("Template text cannot contain NUL characters")
+
+    names = list(dict.fromkeys(generator.params))
+    pattern = pieces[0].replace("{", "{{").replace("}", "}}")
+    for name, piece in zip(generator.params, pieces[1:]):
+        pattern += "{" + str(names.index(name)) + "}" + piece.replace("{", "{{").replace("}", "}}")
+    return {"pattern": pattern, "names": names}
+
+def compile_template(source: Union[str, bytes], name: str = None, cache: Optional[CompilationCache] = None) -> Template:
+    # Scan, parse and generate once. A named template is kept in TEMPLATES and
+    # only compiled again when its source changes; with a cache, the plan is
+    # also shared with other processes and runs.
+    key = cache_key(source, "template")
+    if name is not None:
+        template = TEMPLATES.get(name)
+        if template is not None and template.key == key:
+            return template
+
+    outcome = cache.get(key) if cache is not None else None
+    if outcome is None:
+        try:
+            outcome = build_plan(source)
+        except (ValueError, SyntaxError, CodeGenError) as e:
+            outcome = error_outcome(e)
+        if cache is not None:
+            cache.put(key, outcome)
+    if "error" in outcome:
+        raise outcome_error(outcome)
+
+    template = Template(outcome["pattern"], outcome["names"], key, name)
+    if name is not None:
+        TEMPLATES[name] = template
+    return template
+
+def get_template(name: str) -> Template:
+    if name not in TEMPLATES:
+        raise KeyError(f"No template named '{name}'")
+    return TEMPLATES[name]
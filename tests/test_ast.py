@@ -0,0 +1,43 @@
+import sys
+
+from parser import ASTInterner, BracketNode, ComparisonNode, LogicalNode, QueryNode, TableColumnRef, count_ast_nodes
+
+# Deeper than the recursion limit, so a recursive __eq__, __hash__ or __repr__ fails
+DEPTH = sys.getrecursionlimit() * 3
+
+def comparison(i: int) -> ComparisonNode:
+    return ComparisonNode("eq", TableColumnRef("t", f"c{i}"), i)
+
+def deep_chain(depth: int = DEPTH, last: int = 0):
+    # a AND (b OR (c AND ...)), with brackets around every other link
+    node = comparison(last)
+    for i in range(depth):
+        node = LogicalNode("and" if i % 2 else "or", (comparison(i), node))
+        if i % 2:
+            node = BracketNode(node)
+    return node
+
+def test_deep_chains_compare_by_structure():
+    assert deep_chain() == deep_chain()
+    assert deep_chain() != deep_chain(last=1)
+    assert deep_chain() != deep_chain(DEPTH - 1)
+    assert hash(deep_chain()) == hash(deep_chain())
+    assert len({deep_chain(), deep_chain(), deep_chain(last=1)}) == 2
+
+def test_deep_chain_repr():
+    text = repr(deep_chain())
+    assert text.startswith("BracketNode(expression=LogicalNode(operator='and', operands=(ComparisonNode(")
+    assert text.count("LogicalNode(") == DEPTH
+    assert repr(LogicalNode("or", (comparison(1),))) == (
+        "LogicalNode(operator='or', operands=(ComparisonNode(operator='eq', "
+        "left=TableColumnRef(table='t', column='c1'), right=1),))")
+
+def test_interned_deep_chains_are_one_object():
+    interner = ASTInterner()
+    first, second = interner.intern(deep_chain()), interner.intern(deep_chain())
+    assert first is second and first == deep_chain()
+    assert count_ast_nodes(first) == count_ast_nodes(deep_chain())
+
+def test_equality_is_by_type():
+    assert comparison(1) != TableColumnRef("t", "c1")
+    assert QueryNode.__eq__(QueryNode(None, None), comparison(1)) is NotImplemented
@@ -0,0 +1,65 @@
+import json
+import os
+import select
+import subprocess
+import sys
+
+import pytest
+
+from batch import map_files, stream_map
+from conftest import ROOT
+from parser import process_files
+from tokenizer import process_folder
+
+def read_line(stream, timeout: float) -> str:
+    # One output line, or None when none arrives within timeout seconds
+    ready, _, _ = select.select([stream], [], [], timeout)
+    return stream.readline() if ready else None
+
+def test_jsonl_result_is_written_before_the_next_record_arrives():
+    with open(os.path.join(ROOT, "tests", "test1.xml")) as f:
+        xql = f.read()
+    process = subprocess.Popen([sys.executable, "parser.py", "--jsonl", "--jobs", "2"], cwd=ROOT,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        process.stdin.write(json.dumps({"id": 1, "xql": xql}) + "\n")
+        process.stdin.flush()
+        # stdin stays open: the first result must not wait for a second record
+        first = read_line(process.stdout, 30)
+        assert first is not None, "first result held back until more input arrived"
+        assert json.loads(first)["id"] == 1
+
+        process.stdin.write(json.dumps({"id": 2, "xql": xql}) + "\n")
+        process.stdin.close()
+        assert json.loads(read_line(process.stdout, 30))["id"] == 2
+        assert process.wait(30) == 0
+    finally:
+        process.kill()
+
+def run_drivers(tmp_path, jobs: int, capsys):
+    # Outputs of tokenizing and parsing every sample file: {path: content}, console text
+    out = tmp_path / f"jobs{jobs}"
+    process_folder(os.path.join(ROOT, "tests"), str(out / "lexer"), jobs=jobs)
+    process_files(str(out / "lexer"), str(out / "parser"), str(out / "codegen"), jobs=jobs)
+    files = {}
+    for directory, _, names in os.walk(out):
+        for name in names:
+            path = os.path.join(directory, name)
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, out)] = f.read()
+    return files, capsys.readouterr().out
+
+def test_jobs_give_the_same_ordered_output(tmp_path, capsys):
+    serial = run_drivers(tmp_path, 1, capsys)
+    parallel = run_drivers(tmp_path, 3, capsys)
+    assert parallel[0] == serial[0]
+    assert parallel[1] == serial[1]
+    assert len(serial[0]) > 20 and "Error" in serial[1]
+
+def square(value: int) -> int:
+    return value * value
+
+@pytest.mark.parametrize("jobs", [1, 2, 4])
+def test_map_keeps_input_order(jobs):
+    assert list(map_files(square, list(range(50)), jobs)) == [value * value for value in range(50)]
+    assert list(stream_map(square, iter(range(50)), jobs)) == [value * value for value in range(50)]
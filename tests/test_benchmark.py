@@ -0,0 +1,14 @@
+import pytest
+
+from benchmark import measure
+
+def test_measure_returns_the_result_and_its_timing():
+    calls = []
+    result, seconds, peak = measure(lambda: calls.append(None) or [0] * 1000, repeat=2)
+    assert result == [0] * 1000 and len(calls) == 3
+    assert seconds >= 0 and peak > 0
+
+@pytest.mark.parametrize("repeat", [0, -1])
+def test_measure_needs_one_run(repeat):
+    with pytest.raises(ValueError, match="repeat must be at least 1"):
+        measure(lambda: None, repeat)
@@ -0,0 +1,91 @@
+import os
+import shutil
+
+import build
+from build import MANIFEST_NAME, Manifest, incremental_build
+from conftest import ROOT
+from instrument import ProfileReport
+from tokenizer import process_folder
+
+def output_path(tmp_path, filename):
+    return str(tmp_path / "out" / (filename + ".out"))
+
+def run_build(tmp_path, options=None):
+    # A stage that copies each input upper-cased; returns the rebuilt names
+    manifest = Manifest(str(tmp_path / "out" / MANIFEST_NAME), "upper", options)
+    input_dir = str(tmp_path / "in")
+    filenames = sorted(os.listdir(input_dir))
+    dirty, fresh = incremental_build(manifest, filenames, input_dir, lambda name: [output_path(tmp_path, name)])
+    for filename in dirty:
+        with open(os.path.join(input_dir, filename)) as f, open(output_path(tmp_path, filename), 'w') as out:
+            out.write(f.read().upper())
+        manifest.record(filename, os.path.join(input_dir, filename), [output_path(tmp_path, filename)])
+    manifest.save()
+    assert sorted(dirty + fresh) == filenames
+    return dirty
+
+def setup(tmp_path):
+    (tmp_path / "in").mkdir()
+    (tmp_path / "out").mkdir()
+    for name in ("a", "b", "c"):
+        (tmp_path / "in" / name).write_text(f"input {name}")
+    assert run_build(tmp_path) == ["a", "b", "c"]
+
+def test_unchanged_inputs_are_skipped(tmp_path):
+    setup(tmp_path)
+    assert run_build(tmp_path) == []
+    # Touched with the same content: the hash decides
+    os.utime(tmp_path / "in" / "a", ns=(0, 0))
+    assert run_build(tmp_path) == []
+
+def test_changed_input_is_rebuilt(tmp_path):
+    setup(tmp_path)
+    (tmp_path / "in" / "b").write_text("input b, changed")
+    assert run_build(tmp_path) == ["b"]
+    assert open(output_path(tmp_path, "b")).read() == "INPUT B, CHANGED"
+
+def test_deleted_or_modified_output_is_rebuilt(tmp_path):
+    setup(tmp_path)
+    os.remove(output_path(tmp_path, "a"))
+    with open(output_path(tmp_path, "c"), 'w') as f:
+        f.write("edited by hand")
+    assert run_build(tmp_path) == ["a", "c"]
+    assert open(output_path(tmp_path, "c")).read() == "INPUT C"
+
+def test_outputs_of_a_deleted_input_are_removed(tmp_path):
+    setup(tmp_path)
+    os.remove(tmp_path / "in" / "b")
+    assert run_build(tmp_path) == []
+    assert not os.path.exists(output_path(tmp_path, "b"))
+    assert os.path.exists(output_path(tmp_path, "a"))
+
+def test_compiler_version_or_options_change_rebuilds_everything(tmp_path, monkeypatch):
+    setup(tmp_path)
+    monkeypatch.setattr(build, "COMPILER_VERSION", build.COMPILER_VERSION + "-next")
+    assert run_build(tmp_path) == ["a", "b", "c"]
+    assert run_build(tmp_path) == []
+    assert run_build(tmp_path, {"format": "binary"}) == ["a", "b", "c"]
+
+def test_corrupt_manifest_rebuilds_everything(tmp_path):
+    setup(tmp_path)
+    (tmp_path / "out" / MANIFEST_NAME).write_text("{not json")
+    assert run_build(tmp_path) == ["a", "b", "c"]
+
+def tokenized(inputs, outputs):
+    # The files process_folder tokenized in an incremental run
+    report = ProfileReport()
+    process_folder(str(inputs), str(outputs), incremental=True, observers=[report])
+    return [profile["file"] for profile in report.runs["tokenize"]["files"]]
+
+def test_incremental_tokenize(tmp_path, capsys):
+    inputs, outputs = tmp_path / "tests", tmp_path / "lexer"
+    inputs.mkdir()
+    for name in ("test1.xml", "test6.xml", "test7.xml"):
+        shutil.copy(os.path.join(ROOT, "tests", name), inputs)
+    assert tokenized(inputs, outputs) == ["test1.xml", "test6.xml", "test7.xml"]
+
+    (inputs / "test6.xml").write_text((inputs / "test6.xml").read_text() + "\n")
+    os.remove(inputs / "test1.xml")
+    assert tokenized(inputs, outputs) == ["test6.xml"]
+    assert sorted(os.listdir(outputs)) == sorted([MANIFEST_NAME, "lex_test6.txt", "lex_test7.txt"])
+    assert tokenized(inputs, outputs) == []
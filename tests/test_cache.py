@@ -0,0 +1,68 @@
+import pytest
+
+import cache
+from cache import CompilationCache, cache_key
+from parser import generate_sql_from_xml
+from tokenizer import cached_file_tokens
+
+def scan_error(func, *args) -> str:
+    with pytest.raises(ValueError) as error:
+        func(*args)
+    return str(error.value)
+
+def test_trailing_whitespace_is_part_of_the_key():
+    assert cache_key("<query ") != cache_key("<query")
+    assert cache_key("<query>") == cache_key(b"<query>")
+
+def test_cached_error_is_not_reused_for_a_whitespace_variant():
+    cache = CompilationCache()
+    assert "Invalid tag" in scan_error(generate_sql_from_xml, "<query ", cache)
+    assert "Unclosed tag" in scan_error(generate_sql_from_xml, "<query", cache)
+
+def test_cached_file_tokens_keys_the_exact_bytes(tmp_path):
+    cache_path = str(tmp_path / "cache.sqlite")
+    spaced, bare = tmp_path / "spaced.xml", tmp_path / "bare.xml"
+    spaced.write_text("<query ")
+    bare.write_text("<query")
+    assert "Invalid tag" in scan_error(cached_file_tokens, str(spaced), cache_path)
+    assert "Unclosed tag" in scan_error(cached_file_tokens, str(bare), cache_path)
+
+def test_least_recently_used_entry_is_evicted():
+    cache = CompilationCache(max_entries=2)
+    cache.put("a", {"sql": "A"})
+    cache.put("b", {"sql": "B"})
+    assert cache.get("a") == {"sql": "A"}
+    cache.put("c", {"sql": "C"})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"sql": "A"} and cache.get("c") == {"sql": "C"}
+    assert cache.stats() == {"hits": 3, "disk_hits": 0, "misses": 1, "evictions": 1, "entries": 2}
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / "cache" / "outcomes.sqlite")
+    cache = CompilationCache(max_entries=1, path=path)
+    cache.put("a", {"sql": "A"})
+    cache.put("b", {"error": "SyntaxError", "message": "x"})
+    # Evicted from memory, still on disk
+    assert cache.get("a") == {"sql": "A"} and cache.stats()["disk_hits"] == 1
+    cache.close()
+
+    reopened = CompilationCache(path=path)
+    assert reopened.get("b") == {"error": "SyntaxError", "message": "x"}
+    assert reopened.get("a") == {"sql": "A"}
+    assert reopened.stats()["disk_hits"] == 2
+    reopened.clear()
+    reopened.close()
+    assert CompilationCache(path=path).get("a") is None
+
+def test_outcomes_are_shared_through_the_disk_tier(tmp_path):
+    path = str(tmp_path / "outcomes.sqlite")
+    source = "<query><select><column>\"a\"</column></select><from><table>\"t\"</table></from></query>"
+    first, second = CompilationCache(path=path), CompilationCache(path=path)
+    assert generate_sql_from_xml(source, first) == "SELECT a FROM t"
+    assert generate_sql_from_xml(source, second) == "SELECT a FROM t"
+    assert second.stats()["disk_hits"] == 1 and second.stats()["misses"] == 0
+
+def test_compiler_version_is_part_of_the_key(monkeypatch):
+    key = cache_key("<query>")
+    monkeypatch.setattr(cache, "COMPILER_VERSION", cache.COMPILER_VERSION + "-next")
+    assert cache_key("<query>") != key
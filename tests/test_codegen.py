@@ -0,0 +1,120 @@
+import filecmp
+import io
+import os
+import sys
+
+import pytest
+
+import parser as xql
+import tokenizer
+from conftest import ROOT
+from parser import (CodeGenError, CodeGenerator, Optimizer, Parser, TableParser, compile_xml, generate_sql_from_ast,
+                    write_ast_to_file, write_sql_from_ast)
+from tokenizer import Scanner, TokenType
+from workload import QueryGenerator, WorkloadOptions
+
+TESTS = os.path.join(ROOT, "tests")
+
+# Deeper than the recursion limit, so a recursive parser or generator fails
+DEPTH = sys.getrecursionlimit() * 3
+
+def comparison(i: int) -> str:
+    return (f'<eq_op><lhs><ref_table>"t"</ref_table><ref_col>"c{i}"</ref_col></lhs>'
+            f'<rhs><int_constant> {i} </int_constant></rhs></eq_op>')
+
+def query(condition: str) -> str:
+    return f'<query><select><column>"c0"</column></select><from><table>"t"</table></from><where>{condition}</where></query>'
+
+def parse(source: str, parser_class):
+    tokens = [token for token in Scanner(source).iter_tokens() if token.type != TokenType.COMMENT]
+    return parser_class(tokens).parse()
+
+def expected_sql(condition: str) -> str:
+    return f"SELECT c0 FROM t WHERE {condition}"
+
+@pytest.mark.parametrize("name", sorted(f for f in os.listdir(os.path.join(ROOT, "codegen_output")) if f.endswith(".txt")))
+def test_sql_matches_committed_output(name):
+    source = os.path.join(TESTS, name[len("code_gen_"):-len(".txt")] + ".xml")
+    with open(source) as f, open(os.path.join(ROOT, "codegen_output", name)) as expected:
+        source, expected = f.read(), expected.read()
+    try:
+        output = compile_xml(source)
+    except CodeGenError as e:
+        output = f"Code Generation Error: {e}\n"
+    assert output == expected
+
+def test_pipeline_matches_committed_outputs(tmp_path, capsys):
+    # The tokenizer and parser drivers reproduce every committed output file
+    lexer, parsed, codegen = (str(tmp_path / name) for name in ("lexer_output", "parser_output", "codegen_output"))
+    tokenizer.process_folder(TESTS, lexer)
+    xql.process_files(lexer, parsed, codegen)
+    for produced, committed in ((lexer, "lexer_output"), (parsed, "parser_output"), (codegen, "codegen_output")):
+        committed = os.path.join(ROOT, committed)
+        names = sorted(os.listdir(committed))
+        assert sorted(os.listdir(produced)) == names
+        _, mismatch, errors = filecmp.cmpfiles(committed, produced, names, shallow=False)
+        assert mismatch == [] and errors == []
+
+@pytest.mark.parametrize("parser_class", [Parser, TableParser])
+def test_alternating_chain_deeper_than_the_recursion_limit(parser_class):
+    # Operators alternate, so every link nests: a AND (b OR (c AND ...))
+    operators = ["and" if i % 2 == 0 else "or" for i in range(DEPTH - 1)]
+    source = query("".join(comparison(i) + f"<{operator}/>" for i, operator in enumerate(operators)) + comparison(DEPTH - 1))
+    ast = parse(source, parser_class)
+    condition = "".join(f"(t.c{i} = {i} {operator.upper()} " for i, operator in enumerate(operators))
+    condition += f"t.c{DEPTH - 1} = {DEPTH - 1}" + ")" * (DEPTH - 1)
+    assert generate_sql_from_ast(ast) == expected_sql(condition)
+
+    output = io.StringIO()
+    write_ast_to_file(ast, output)
+    assert output.getvalue().count("Comparison (eq):") == DEPTH
+
+@pytest.mark.parametrize("parser_class", [Parser, TableParser])
+def test_long_chain_of_one_operator_is_one_group(parser_class):
+    source = query("<or/>".join(comparison(i) for i in range(DEPTH)))
+    ast = parse(source, parser_class)
+    assert len(ast.where.condition.operands) == DEPTH
+    assert generate_sql_from_ast(ast) == expected_sql("(" + " OR ".join(f"t.c{i} = {i}" for i in range(DEPTH)) + ")")
+
+@pytest.mark.parametrize("parser_class", [Parser, TableParser])
+def test_brackets_nested_deeper_than_the_recursion_limit(parser_class):
+    # a AND <bracket> b AND <bracket> ... </bracket> </bracket>
+    source = query("".join(comparison(i) + "<and/><bracket>" for i in range(DEPTH)) + comparison(DEPTH) + "</bracket>" * DEPTH)
+    ast = parse(source, parser_class)
+    condition = "".join(f"(t.c{i} = {i} AND (" for i in range(DEPTH)) + f"t.c{DEPTH} = {DEPTH}" + "))" * DEPTH
+    assert generate_sql_from_ast(ast) == expected_sql(condition)
+
+    output = io.StringIO()
+    write_ast_to_file(ast, output)
+    assert output.getvalue().count("Bracketed Expression:") == DEPTH
+
+def emitted(ast, batch: int) -> str:
+    output = io.StringIO()
+    count = CodeGenerator(ast).emit(output, batch)
+    assert count == len(output.getvalue())
+    return output.getvalue()
+
+@pytest.mark.parametrize("batch", [1, 3, 4096])
+def test_emit_equals_generate(batch):
+    asts = [parse(source, TableParser) for source in QueryGenerator(WorkloadOptions(), 2).queries(100)]
+    asts += [Optimizer().optimize(ast) for ast in asts]
+    for ast in asts:
+        assert emitted(ast, batch) == generate_sql_from_ast(ast)
+
+def test_emit_of_a_deep_chain():
+    source = query("".join(comparison(i) + f"<{'and' if i % 2 else 'or'}/>" for i in range(DEPTH)) + comparison(DEPTH))
+    ast = parse(source, TableParser)
+    output = io.StringIO()
+    assert write_sql_from_ast(ast, output) == len(generate_sql_from_ast(ast))
+    assert output.getvalue() == generate_sql_from_ast(ast)
+
+def test_emit_keeps_the_part_written_before_an_error():
+    source = query(comparison(0)).replace('<column>"c0"</column>', '<column>"c0"</column><column>"bad name"</column>')
+    ast = parse(source, TableParser)
+    with pytest.raises(CodeGenError) as expected:
+        generate_sql_from_ast(ast)
+    output = io.StringIO()
+    with pytest.raises(CodeGenError) as error:
+        CodeGenerator(ast).emit(output, batch=1)
+    assert str(error.value) == str(expected.value)
+    assert output.getvalue() == "SELECT c0, "
@@ -0,0 +1,36 @@
+import pytest
+
+from database import Database
+
+@pytest.fixture(params=["memory", "file"])
+def database(request, tmp_path):
+    path = ":memory:" if request.param == "memory" else str(tmp_path / "test.db")
+    with Database(path, pool_size=2) as database:
+        database.executescript("CREATE TABLE t (a INTEGER); INSERT INTO t VALUES (1), (2);")
+        yield database
+
+def count(database) -> int:
+    return database.fetchall("SELECT count(*) FROM t")[0][0]
+
+def test_dml_through_execute_is_committed(database):
+    assert database.fetchall("INSERT INTO t VALUES (3)") == []
+    assert count(database) == 3
+    with database.execute("UPDATE t SET a = a + 1") as rows:
+        list(rows)
+    assert database.fetchall("SELECT max(a) FROM t") == [(4,)]
+
+def test_dml_is_committed_by_an_unread_stream(database):
+    database.execute("DELETE FROM t WHERE a = 1").close()
+    assert count(database) == 1
+
+def test_dml_is_rolled_back_when_an_error_ends_the_stream(database):
+    with pytest.raises(RuntimeError):
+        with database.execute("INSERT INTO t VALUES (3)"):
+            raise RuntimeError("abort")
+    assert count(database) == 2
+
+def test_connections_are_returned_to_the_pool(database):
+    for _ in range(10):
+        database.fetchall("INSERT INTO t VALUES (5)")
+    assert count(database) == 12
+    assert database.stats()["connections"] <= 2
@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from conftest import ROOT
+from database import Database
+from executor import ExecutionError, Executor, create_sqlite_tables, execute_xml
+from parser import generate_sql_from_ast, parse_xml_string
+
+TESTS = os.path.join(ROOT, "tests")
+
+# A small catalog with ties, repeated keys and int/float/str columns
+CATALOG = {
+    "games": {
+        "game": numpy.array(["genshin", "zelda", "mario", "halo", "tetris", "doom", "genshin"]),
+        "origin": numpy.array(["USA", "Japan", "Japan", "USA", "Russia", "USA", "Japan"]),
+        "year": numpy.array([2020, 1986, 1985, 2001, 1984, 1993, 2021]),
+    },
+    "characters": {
+        "class": numpy.array(["mage", "rogue", "warrior", "mage", "rogue", "mage"]),
+        "stats": numpy.array([5, 3, 9, 7, 3, 1]),
+        "speed": numpy.array([1.5, 2.0, 0.5, 1.5, 3.0, 2.5]),
+    },
+}
+
+@pytest.fixture(scope="module")
+def database():
+    with Database() as database:
+        with database.connection() as connection:
+            create_sqlite_tables(connection, CATALOG)
+        yield database
+
+def column(name: str) -> str:
+    return f'<column>"{name}"</column>'
+
+def compare(table: str, name: str, operator: str, value: str) -> str:
+    return (f'<{operator}><lhs><ref_table>"{table}"</ref_table><ref_col>"{name}"</ref_col></lhs>'
+            f'<rhs>{value}</rhs></{operator}>')
+
+def query(columns, tables, where="", rest="") -> str:
+    select = "".join(columns)
+    source = "".join(f'<table>"{table}"</table>' for table in tables)
+    where = f"<where>{where}</where>" if where else ""
+    return f"<query><select>{select}</select><from>{source}</from>{where}{rest}</query>"
+
+def order_by(name: str, direction: str = "asc") -> str:
+    return f'<order_by><{direction}><ref_col>"{name}"</ref_col></{direction}></order_by>'
+
+COUNT = '<column><count_func>"*"</count_func></column>'
+MAX_STATS = '<column><alias><lhs><max_func>"stats"</max_func></lhs><rhs>"best"</rhs></alias></column>'
+INT = "<int_constant> {} </int_constant>"
+STRING = "<string_constant>\"'{}'\"</string_constant>"
+
+QUERIES = {
+    "all rows": query([column("game"), column("year")], ["games"]),
+    "string equality": query([column("game")], ["games"], compare("games", "origin", "eq_op", STRING.format("USA"))),
+    "int comparison": query([column("game")], ["games"], compare("games", "year", "gt_op", INT.format(1990))),
+    "text against int": query([column("game")], ["games"], compare("games", "origin", "gt_op", INT.format(5))),
+    "int against text": query([column("game")], ["games"], compare("games", "year", "eq_op", STRING.format("2001"))),
+    "float column": query([column("class")], ["characters"], compare("characters", "speed", "gt_op", INT.format(1))),
+    "and/or": query([column("game")], ["games"],
+                    compare("games", "origin", "eq_op", STRING.format("Japan")) + "<and/><bracket>"
+                    + compare("games", "year", "gt_op", INT.format(2000)) + "<or/>"
+                    + compare("games", "game", "eq_op", STRING.format("mario")) + "</bracket>"),
+    "cross join": query([column("game"), column("class")], ["games", "characters"],
+                        compare("characters", "stats", "gt_op", INT.format(4))),
+    "group by": query([column("class"), COUNT, MAX_STATS], ["characters"],
+                      rest='<group_by><column>"class"</column></group_by>'),
+    "order by desc": query([column("game"), column("year")], ["games"], rest=order_by("year", "desc")),
+    "order by ties": query([column("origin"), column("game")], ["games"], rest=order_by("origin")),
+    "count without group": query([COUNT], ["games"], compare("games", "origin", "eq_op", STRING.format("USA"))),
+    "no rows": query([column("game")], ["games"], compare("games", "origin", "eq_op", STRING.format("France"))),
+}
+
+def check_matches_sqlite(database, source: str):
+    ast = parse_xml_string(source)
+    expected = database.fetchall(generate_sql_from_ast(ast))
+    result = Executor(CATALOG).execute(ast)
+    rows = result.rows()
+    assert sorted(rows) == sorted(expected)
+    if ast.order_by is not None:
+        # The same order of the ORDER BY column; ties may come in either order
+        index = result.names.index(ast.order_by.column)
+        assert [row[index] for row in rows] == [row[index] for row in expected]
+
+@pytest.mark.parametrize("name", QUERIES)
+def test_matches_sqlite(database, name):
+    check_matches_sqlite(database, QUERIES[name])
+
+def test_sample_query_matches_sqlite(database):
+    # test1.xml joins, groups, filters the groups and orders them
+    with open(os.path.join(TESTS, "test1.xml")) as f:
+        check_matches_sqlite(database, f.read())
+
+def test_optimized_execution():
+    source = QUERIES["and/or"]
+    assert sorted(execute_xml(source, CATALOG, optimize=True).rows()) == sorted(execute_xml(source, CATALOG).rows())
+
+def test_ungrouped_column_is_an_error():
+    with pytest.raises(ExecutionError):
+        execute_xml(query([column("class"), COUNT], ["characters"]), CATALOG)
@@ -0,0 +1,134 @@
+import io
+import os
+import struct
+
+import pytest
+
+from conftest import ROOT
+from parser import (AST_FILE_TYPES, AST_OP_BITS, AST_OP_NODE, AliasNode, BracketNode, ColumnNode,
+                    ComparisonNode, FromNode, FunctionNode, GroupByNode, HavingNode, InNode, LogicalNode, OrderByNode,
+                    ParamNode, QueryNode, SelectNode, TableColumnRef, WhereNode, decode_asts, encode_asts,
+                    load_ast_files, read_ast_file, read_token_lines, read_tokens_binary)
+from tokenizer import TOKEN_FILE_HEADER, Scanner, Token, TokenType, write_tokens_binary, write_tokens_to_file
+
+TESTS = os.path.join(ROOT, "tests")
+
+def sample_tokens():
+    # The tokens of every sample file that scans, comments included
+    tokens = []
+    for name in sorted(os.listdir(TESTS)):
+        if name.endswith(".xml"):
+            with open(os.path.join(TESTS, name)) as f:
+                try:
+                    tokens.extend(Scanner(f.read()).scan())
+                except ValueError:
+                    pass
+    return tokens
+
+def pairs(tokens):
+    return [(token.type, token.value) for token in tokens if token.type != TokenType.COMMENT]
+
+def binary_tokens(tokens) -> bytes:
+    output = io.BytesIO()
+    write_tokens_binary(tokens, output)
+    return output.getvalue()
+
+def test_text_token_file_round_trip():
+    tokens = sample_tokens()
+    output = io.StringIO()
+    write_tokens_to_file(tokens, output)
+    # The text format keeps tag names without their angle brackets
+    expected = [(token_type, value.strip('<>')) for token_type, value in pairs(tokens)]
+    assert pairs(read_token_lines(io.StringIO(output.getvalue()))) == expected
+
+def test_binary_token_file_round_trip():
+    tokens = sample_tokens() + [Token(TokenType.STRING_LITERAL, '"héllo, wörld"'), Token(TokenType.STRING_LITERAL, "")]
+    assert pairs(read_tokens_binary(binary_tokens(tokens))) == pairs(tokens)
+    assert list(read_tokens_binary(binary_tokens([]))) == []
+
+def test_truncated_token_file():
+    data = binary_tokens(sample_tokens()[:20])
+    for size in range(len(data)):
+        with pytest.raises(ValueError):
+            list(read_tokens_binary(data[:size]))
+
+@pytest.mark.parametrize("offset, value, message", [
+    (0, b"XQLX", "Not a binary token file"),
+    (4, b"\x02", "Unsupported token file version 2"),
+    # The first record: a type code no TokenType has, then a string index past the table
+    (TOKEN_FILE_HEADER.size, b"\xff", "Corrupt token file"),
+    (TOKEN_FILE_HEADER.size + 1, b"\xff\xff\xff\xff", "Corrupt token file"),
+])
+def test_corrupt_token_file(offset, value, message):
+    data = bytearray(binary_tokens(sample_tokens()[:20]))
+    data[offset:offset + len(value)] = value
+    with pytest.raises(ValueError, match=message):
+        list(read_tokens_binary(bytes(data)))
+
+def every_node_type() -> QueryNode:
+    ref = TableColumnRef("t", "a")
+    condition = LogicalNode("and", (
+        ComparisonNode("eq", ref, 12345678901234567890),
+        BracketNode(LogicalNode("or", (ComparisonNode("gt", FunctionNode("lower", ("b",)), "'x'"),
+                                       InNode(ref, (1, "'é'", ParamNode("p")))))),
+    ))
+    return QueryNode(
+        SelectNode((ColumnNode("a"), ColumnNode(FunctionNode("count", ("*",))), ColumnNode(AliasNode("b", "c")))),
+        FromNode(("t", "u")),
+        WhereNode(condition),
+        GroupByNode(("a",)),
+        HavingNode(ComparisonNode("lt", FunctionNode("count", ("*",)), 0)),
+        OrderByNode("a", "desc"),
+    )
+
+def test_every_node_type_round_trips():
+    ast = every_node_type()
+    assert {type(node) for node in walk_nodes(ast)} == set(AST_FILE_TYPES)
+    minimal = QueryNode(SelectNode((ColumnNode("a"),)), FromNode(("t",)))
+    assert decode_asts(encode_asts([ast, minimal, ast])) == [ast, minimal, ast]
+    assert decode_asts(encode_asts([])) == []
+
+def walk_nodes(node):
+    stack = [node]
+    while stack:
+        value = stack.pop()
+        if type(value) is tuple:
+            stack.extend(value)
+        elif type(value) in AST_FILE_TYPES:
+            yield value
+            stack.extend(getattr(value, name) for name in value.__dataclass_fields__)
+
+def test_ast_files(tmp_path):
+    paths = []
+    for i, asts in enumerate([[every_node_type()], [], [every_node_type()] * 2]):
+        path = tmp_path / f"parsed_{i}.ast"
+        path.write_bytes(encode_asts(asts))
+        paths.append(str(path))
+    assert read_ast_file(paths[2]) == [every_node_type()] * 2
+    assert load_ast_files(paths) == [every_node_type()] * 3
+
+def test_truncated_ast_file():
+    data = encode_asts([every_node_type()])
+    for size in range(len(data)):
+        with pytest.raises(ValueError):
+            decode_asts(data[:size])
+    with pytest.raises(ValueError, match="Truncated AST file"):
+        decode_asts(data + b"\0\0\0\0")
+
+def corrupt_last_word(word: int) -> bytes:
+    # The last word of a one-query file is the QueryNode itself
+    data = bytearray(encode_asts([every_node_type()]))
+    data[-4:] = struct.pack("<I", word)
+    return bytes(data)
+
+@pytest.mark.parametrize("data, message", [
+    (b"XQLX" + encode_asts([])[4:], "Not a binary AST file"),
+    (encode_asts([])[:4] + b"\x02" + encode_asts([])[5:], "Unsupported AST file version 2"),
+    # Unknown opcode, unknown node type, and a node with too few values on the stack
+    (corrupt_last_word(7), "Corrupt AST file"),
+    (corrupt_last_word(len(AST_FILE_TYPES) << AST_OP_BITS | AST_OP_NODE), "Corrupt AST file"),
+    (corrupt_last_word(AST_FILE_TYPES.index(SelectNode) << AST_OP_BITS | AST_OP_NODE), "Corrupt AST file"),
+])
+def test_corrupt_ast_file(data, message):
+    with pytest.raises(ValueError, match=message):
+        decode_asts(data)
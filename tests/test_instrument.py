@@ -0,0 +1,36 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+from instrument import ProfileReport
+from parser import process_files
+from tokenizer import process_folder
+
+def test_cached_outcomes_keep_their_counts(tmp_path, capsys):
+    inputs = tmp_path / "tests"
+    inputs.mkdir()
+    for name in ("test1.xml", "test6.xml", "test7.xml"):
+        shutil.copy(os.path.join(ROOT, "tests", name), inputs)
+    process_folder(str(inputs), str(tmp_path / "lexer"))
+    cache_path = str(tmp_path / "cache.sqlite")
+
+    runs = []
+    for _ in range(2):
+        report = ProfileReport()
+        process_files(str(tmp_path / "lexer"), str(tmp_path / "parser"), str(tmp_path / "codegen"),
+                      cache_path=cache_path, observers=[report])
+        runs.append(report.runs["parse"]["counts"])
+    first, second = runs
+    assert first["tokens"] > 0 and first["ast_nodes"] > 0 and "cache_hits" not in first
+    assert second["tokens"] == first["tokens"] and second["ast_nodes"] == first["ast_nodes"]
+    assert second["cache_hits"] == 3
+
+@pytest.mark.parametrize("script", ["parser.py", "tokenizer.py"])
+def test_cprofile_needs_profile(script, tmp_path):
+    result = subprocess.run([sys.executable, os.path.join(ROOT, script), "--cprofile"],
+                            cwd=tmp_path, capture_output=True, text=True)
+    assert result.returncode == 2 and "--cprofile needs --profile" in result.stderr
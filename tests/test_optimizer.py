@@ -0,0 +1,115 @@
+import random
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from database import Database
+from executor import Executor, create_sqlite_tables
+from parser import Optimizer, generate_sql_from_ast, parse_xml_string
+
+CATALOG = {
+    "games": {
+        "game": numpy.array(["genshin", "zelda", "mario", "halo", "tetris", "doom"] * 5),
+        "origin": numpy.array(["USA", "Japan", "Japan", "USA", "Russia"] * 6),
+        "year": numpy.arange(30) % 7 + 2015,
+    },
+    "characters": {
+        "class": numpy.array(["mage", "rogue", "warrior"] * 4),
+        "stats": numpy.arange(12) % 5,
+    },
+}
+
+def constant(value) -> str:
+    if isinstance(value, int):
+        return f"<int_constant> {value} </int_constant>"
+    return f"<string_constant>\"'{value}'\"</string_constant>"
+
+def compare(column: str, value, operator: str = "eq_op", table: str = "games") -> str:
+    return (f'<{operator}><lhs><ref_table>"{table}"</ref_table><ref_col>"{column}"</ref_col></lhs>'
+            f"<rhs>{constant(value)}</rhs></{operator}>")
+
+def query(condition: str, columns=("game", "year"), tables=("games",)) -> str:
+    select = "".join(f'<column>"{column}"</column>' for column in columns)
+    source = "".join(f'<table>"{table}"</table>' for table in tables)
+    return f"<query><select>{select}</select><from>{source}</from><where>{condition}</where></query>"
+
+@pytest.fixture(scope="module")
+def database():
+    with Database() as database:
+        with database.connection() as connection:
+            create_sqlite_tables(connection, CATALOG)
+        yield database
+
+def check_same_rows(database, source: str):
+    # Optimized and original SQL return the same rows in SQLite, and so do
+    # both ASTs in the executor; returns (original SQL, optimized SQL, optimizer)
+    ast = parse_xml_string(source)
+    optimizer = Optimizer()
+    optimized = optimizer.optimize(ast)
+    sql, optimized_sql = generate_sql_from_ast(ast), generate_sql_from_ast(optimized)
+    rows = sorted(database.fetchall(sql))
+    assert sorted(database.fetchall(optimized_sql)) == rows
+
+    executor = Executor(CATALOG)
+    assert sorted(executor.execute(optimized).rows()) == sorted(executor.execute(ast).rows()) == rows
+    return sql, optimized_sql, optimizer
+
+def test_or_of_equalities_becomes_in(database):
+    condition = "<or/>".join(compare("origin", value) for value in ("USA", "Japan", "USA"))
+    _, sql, _ = check_same_rows(database, query(condition))
+    assert sql.endswith("WHERE games.origin IN ('USA', 'Japan')")
+
+def test_in_list_next_to_other_predicates(database):
+    condition = (compare("year", 2016, "gt_op") + "<and/><bracket>"
+                 + "<or/>".join(compare("game", value) for value in ("zelda", "doom", "tetris")) + "</bracket>")
+    original, sql, _ = check_same_rows(database, query(condition))
+    assert " IN ('zelda', 'doom', 'tetris')" in sql and " IN " not in original
+
+def test_integer_and_string_constants_are_not_merged(database):
+    condition = compare("year", 2016) + "<or/>" + compare("year", "2016") + "<or/>" + compare("year", 2017)
+    check_same_rows(database, query(condition))
+
+def test_repeated_predicates_are_removed(database):
+    predicate = compare("origin", "Japan")
+    condition = f"{predicate}<and/>{predicate}<and/><bracket>{compare('year', 2016, 'gt_op')}<and/>{predicate}</bracket>"
+    original, sql, _ = check_same_rows(database, query(condition))
+    assert original.count("games.origin = 'Japan'") == 3 and sql.count("games.origin = 'Japan'") == 1
+
+def test_contradiction_is_reported_and_returns_no_rows(database):
+    condition = compare("origin", "USA") + "<and/>" + compare("origin", "Japan")
+    _, _, optimizer = check_same_rows(database, query(condition))
+    assert optimizer.contradictions
+    assert database.fetchall(f"SELECT count(*) FROM games WHERE {optimizer.contradictions[0].split(': ', 1)[1]}") == [(0,)]
+
+def test_contradiction_inside_an_or_keeps_the_other_branch(database):
+    condition = (compare("game", "halo") + "<or/><bracket>" + compare("year", 2016) + "<and/>"
+                 + compare("year", 2018) + "</bracket>")
+    _, _, optimizer = check_same_rows(database, query(condition))
+    assert optimizer.contradictions
+
+def test_join_with_grouping(database):
+    condition = (compare("origin", "Japan") + "<or/>" + compare("origin", "USA") + "<or/>"
+                 + compare("stats", 3, table="characters"))
+    source = query(condition, columns=("class",), tables=("games", "characters"))
+    source = source.replace("</where>", '</where><group_by><column>"class"</column></group_by>')
+    check_same_rows(database, source)
+
+def random_condition(rng: random.Random, depth: int) -> str:
+    parts = []
+    count = rng.randint(1, 4)
+    for i in range(count):
+        if parts:
+            parts.append(rng.choice(["<and/>", "<or/>"]))
+        if depth and i == count - 1 and rng.random() < 0.5:
+            parts.append(f"<bracket>{random_condition(rng, depth - 1)}</bracket>")
+        else:
+            column, values = rng.choice([("origin", ["USA", "Japan", "Russia"]), ("year", [2015, 2016, 2020, "2016"]),
+                                         ("game", ["zelda", "doom"])])
+            parts.append(compare(column, rng.choice(values), rng.choice(["eq_op", "eq_op", "eq_op", "gt_op"])))
+    return "".join(parts)
+
+def test_random_conditions_return_the_same_rows(database):
+    rng = random.Random(0)
+    for _ in range(300):
+        check_same_rows(database, query(random_condition(rng, 3)))
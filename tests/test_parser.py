@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from conftest import ROOT
+from parser import Parser, TableParser, compile_xml, iter_queries
+from tokenizer import Scanner, TokenType
+
+with open(os.path.join(ROOT, "tests", "test1.xml")) as f:
+    QUERY = f.read()
+SQL = compile_xml(QUERY)
+
+def outcomes(document):
+    return [("error", type(result.error).__name__) if result.error else ("sql", result.sql)
+            for result in iter_queries(document)]
+
+@pytest.mark.parametrize("encode", [False, True])
+def test_stray_tag_before_a_query_keeps_the_query(encode):
+    document = "<tab>" + QUERY
+    assert outcomes(document.encode() if encode else document) == [("error", "ScanError"), ("sql", SQL)]
+
+@pytest.mark.parametrize("junk", ["<tab>", "junk<", "<table>"])
+def test_junk_between_queries_keeps_the_next_query(junk):
+    result = outcomes(QUERY + junk + QUERY)
+    assert result[0] == ("sql", SQL) and result[-1] == ("sql", SQL)
+    assert len(result) == 3 and result[1][0] == "error"
+
+def test_junk_in_a_queries_document():
+    assert outcomes("<tab><queries>" + QUERY + QUERY + "</queries>") == [("error", "ScanError"), ("sql", SQL), ("sql", SQL)]
+    assert outcomes("<queries>" + QUERY + "<tab></queries>") == [("sql", SQL), ("error", "ScanError")]
+
+def test_scan_error_inside_a_query_skips_to_its_end():
+    broken = QUERY.replace("<select>", "<select><tab>", 1)
+    assert outcomes(broken + QUERY) == [("error", "ScanError"), ("sql", SQL)]
+
+@pytest.mark.parametrize("parser_class", [Parser, TableParser])
+def test_query_is_returned_before_the_next_token_is_read(parser_class):
+    tokens = [token for token in Scanner(QUERY + QUERY).scan() if token.type != TokenType.COMMENT]
+    read = []
+
+    def source():
+        for token in tokens:
+            read.append(token)
+            yield token
+
+    queries = parser_class(source()).parse_queries()
+    next(queries)
+    assert read[-1].type == TokenType.QUERY_CLOSE and len(read) == len(tokens) // 2
+    assert len(list(queries)) == 1
+
+@pytest.mark.parametrize("trailing", [QUERY, "<select>", "<tab>"])
+def test_content_after_queries_is_an_error(trailing):
+    results = list(iter_queries("<queries>" + QUERY + "</queries>" + trailing))
+    assert [result.index for result in results] == [0, 1]
+    assert results[0].sql == SQL and results[1].error is not None
+    assert outcomes("<queries>" + QUERY + "</queries>\n<!--done-->\n") == [("sql", SQL)]
@@ -0,0 +1,35 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from server import TranslationServer
+
+QUERY = b'<query><select><column>"a"</column></select><from><table>"t"</table></from></query>'
+
+async def translate_all(server, count):
+    return await asyncio.gather(*(server.route("POST", "/translate", QUERY) for _ in range(count)))
+
+async def run_with_broken_pool():
+    server = TranslationServer(workers=1, batch_delay=0.05)
+    server.queue = asyncio.Queue(maxsize=server.queue_depth)
+    server.in_flight = asyncio.Semaphore(server.workers * 2)
+    server.pool = ProcessPoolExecutor(max_workers=1)
+    batcher = asyncio.create_task(server.run_batches())
+    try:
+        # A worker exits, so the pool is broken when the batch is handed to it
+        try:
+            await asyncio.get_running_loop().run_in_executor(server.pool, os._exit, 1)
+        except Exception:
+            pass
+        failed = await translate_all(server, 3)
+        recovered = await translate_all(server, 2)
+    finally:
+        batcher.cancel()
+        server.pool.shutdown(cancel_futures=True)
+    return failed, recovered
+
+def test_broken_pool_answers_500_and_is_replaced():
+    failed, recovered = asyncio.run(run_with_broken_pool())
+    assert [status for status, _ in failed] == [500] * 3
+    assert all(payload["error"] == "InternalError" and "BrokenProcessPool" in payload["message"] for _, payload in failed)
+    assert recovered == [(200, {"sql": "SELECT a FROM t"})] * 2
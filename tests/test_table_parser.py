@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from conftest import ROOT
+from parser import Parser, TableParser
+from tokenizer import Scanner, TokenType
+from workload import QueryGenerator, WorkloadOptions
+
+TESTS = os.path.join(ROOT, "tests")
+
+def tokens_of(source):
+    return [token for token in Scanner(source).iter_tokens() if token.type != TokenType.COMMENT]
+
+def outcome(parser_class, tokens):
+    # The AST, or the type and message of the error raised
+    try:
+        return parser_class(tokens).parse()
+    except (ValueError, SyntaxError) as e:
+        return f"{type(e).__name__}: {e}"
+
+@pytest.mark.parametrize("name", sorted(f for f in os.listdir(TESTS) if f.endswith(".xml")))
+def test_same_result_on_sample_files(name):
+    # Scanned lazily, so a scan error surfaces while parsing
+    with open(os.path.join(TESTS, name)) as f:
+        source = f.read()
+    scan = lambda: (token for token in Scanner(source).iter_tokens() if token.type != TokenType.COMMENT)
+    assert outcome(TableParser, scan()) == outcome(Parser, scan())
+
+def test_same_asts_on_generated_queries():
+    for source in QueryGenerator(WorkloadOptions(), 0).queries(200):
+        tokens = tokens_of(source)
+        assert outcome(TableParser, tokens) == outcome(Parser, tokens)
+
+def test_same_errors_with_a_token_missing():
+    # Dropping each token in turn exercises the error of every table row
+    for source in QueryGenerator(WorkloadOptions(), 1).queries(10):
+        tokens = tokens_of(source)
+        for i in range(len(tokens)):
+            broken = tokens[:i] + tokens[i + 1:]
+            assert outcome(TableParser, broken) == outcome(Parser, broken)
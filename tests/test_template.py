@@ -0,0 +1,116 @@
+import io
+
+import pytest
+
+import template
+from cache import CompilationCache
+from parser import CodeGenError, generate_sql_from_xml
+from template import compile_template, get_template, quote_value
+
+def comparison(column: str, operator: str, value: str) -> str:
+    return (f'<{operator}><lhs><ref_table>"g"</ref_table><ref_col>"{column}"</ref_col></lhs>'
+            f'<rhs>{value}</rhs></{operator}>')
+
+# origin is used twice, and the string constant holds str.format braces
+SOURCE = ('<query><select><column>"name"</column></select><from><table>"g"</table></from><where>'
+          + comparison("origin", "eq_op", '<param>"origin"</param>') + "<or/>"
+          + comparison("alt", "eq_op", '<param>"origin"</param>') + "<and/>"
+          + comparison("tag", "eq_op", '<string_constant>"{0}"</string_constant>') + "<and/>"
+          + comparison("n", "gt_op", '<param>"n"</param>')
+          + "</where></query>")
+
+def expected(origin: str, n: str) -> str:
+    return f"SELECT name FROM g WHERE (g.origin = {origin} OR (g.alt = {origin} AND g.tag = '{{0}}' AND g.n > {n}))"
+
+def test_render_quotes_values():
+    compiled = compile_template(SOURCE)
+    assert compiled.names == ("origin", "n")
+    assert compiled.render(origin="it's", n=3) == expected("'it''s'", "3")
+    assert compiled.render({"origin": "", "n": -2}, n=5) == expected("''", "5")
+
+@pytest.mark.parametrize("value", [1.5, None, True, b"x", ["a"]])
+def test_other_value_types_are_rejected(value):
+    with pytest.raises(TypeError, match="Parameter 'n' must be a string or an integer"):
+        compile_template(SOURCE).render(origin="a", n=value)
+    with pytest.raises(TypeError):
+        quote_value("n", value)
+
+def test_missing_parameter():
+    with pytest.raises(ValueError, match="Missing template parameter"):
+        compile_template(SOURCE).render(origin="a")
+
+def test_unbound_parameter_is_a_codegen_error():
+    with pytest.raises(CodeGenError, match="Unbound parameter 'origin'"):
+        generate_sql_from_xml(SOURCE)
+
+def test_parameterized():
+    sql, names = compile_template(SOURCE).parameterized()
+    assert sql == "SELECT name FROM g WHERE (g.origin = ? OR (g.alt = ? AND g.tag = '{0}' AND g.n > ?))"
+    assert names == ("origin", "origin", "n")
+
+def test_named_templates_and_cache():
+    cache = CompilationCache()
+    first = compile_template(SOURCE, name="by_origin", cache=cache)
+    assert compile_template(SOURCE, name="by_origin", cache=cache) is first
+    assert get_template("by_origin") is first
+    # Another process sharing the cache gets the same plan without compiling
+    template.TEMPLATES.clear()
+    assert compile_template(SOURCE, cache=cache).pattern == first.pattern
+    with pytest.raises(KeyError):
+        get_template("by_origin")
+
+def test_template_errors_are_raised_again():
+    cache = CompilationCache()
+    for _ in range(2):
+        with pytest.raises(SyntaxError):
+            compile_template("<query></query>", cache=cache)
+
+@pytest.fixture(params=["numpy", "no numpy"])
+def numpy(request, monkeypatch):
+    # Batches are rendered with and without NumPy's array operations
+    if request.param == "no numpy":
+        monkeypatch.setattr(template, "numpy", None)
+        return None
+    return pytest.importorskip("numpy")
+
+def batch_columns(numpy):
+    origins = ["USA", "it's", "", "Japan"] * 5
+    counts = list(range(-3, 17))
+    if numpy is not None:
+        return {"origin": numpy.array(origins), "n": numpy.array(counts)}
+    return {"origin": origins, "n": counts}
+
+def test_batch_matches_render(numpy):
+    compiled = compile_template(SOURCE)
+    columns = batch_columns(numpy)
+    rows = [compiled.render(origin=origin, n=int(n)) for origin, n in zip(columns["origin"], columns["n"])]
+    assert compiled.render_batch(columns) == rows
+    assert list(compiled.iter_batch(columns, chunk_size=3)) == rows
+
+    output = io.StringIO()
+    assert compiled.write_batch(columns, output, chunk_size=7) == len(rows)
+    assert output.getvalue() == "".join(row + ";\n" for row in rows)
+
+def test_batch_with_a_single_value(numpy):
+    compiled = compile_template(SOURCE)
+    n = 4 if numpy is None else numpy.int64(4)
+    assert compiled.render_batch({"origin": ["a", "b"], "n": n}) == [
+        compiled.render(origin="a", n=4), compiled.render(origin="b", n=4)]
+    assert compiled.render_batch({"origin": "a", "n": 4}) == [compiled.render(origin="a", n=4)]
+
+def test_batch_of_mixed_values(numpy):
+    compiled = compile_template(SOURCE)
+    assert compiled.render_batch({"origin": ["a", 1], "n": [2, 3]}) == [
+        compiled.render(origin="a", n=2), compiled.render(origin=1, n=3)]
+    with pytest.raises(TypeError, match="Parameter 'n'"):
+        compiled.render_batch({"origin": ["a", "b"], "n": [1, 2.5]})
+
+def test_batch_errors(numpy):
+    compiled = compile_template(SOURCE)
+    with pytest.raises(ValueError, match="Missing template parameter"):
+        compiled.render_batch({"origin": ["a"]})
+    with pytest.raises(ValueError, match="Parameter 'n' has 3 values, expected 2"):
+        compiled.render_batch({"origin": ["a", "b"], "n": [1, 2, 3]})
+    if numpy is not None:
+        with pytest.raises(ValueError, match="one-dimensional"):
+            compiled.render_batch({"origin": "a", "n": numpy.zeros((2, 2), dtype=int)})
@@ -0,0 +1,123 @@
+import os
+
+import pytest
+
+from conftest import ROOT
+from parser import Parser, TableParser
+from tokenizer import ScanError, Scanner, TokenType, iter_file_tokens
+
+TESTS = os.path.join(ROOT, "tests")
+SAMPLES = sorted(name for name in os.listdir(TESTS) if name.endswith(".xml"))
+
+def sample(name: str) -> str:
+    with open(os.path.join(TESTS, name), encoding='utf-8') as f:
+        return f.read()
+
+def scanned(source):
+    return [(token.type, token.value) for token in Scanner(source).scan()]
+
+@pytest.mark.parametrize("digits", ["11٣", "1٣", "123٣٤"])
+def test_digit_run_followed_by_non_ascii_is_one_literal(digits):
+    source = f"<int_constant>{digits}</int_constant>"
+    expected = [(TokenType.INT_CONSTANT_OPEN, "<int_constant>"), (TokenType.INT_LITERAL, digits),
+                (TokenType.INT_CONSTANT_CLOSE, "</int_constant>")]
+    assert scanned(source) == expected
+    assert scanned(source.encode()) == expected
+
+@pytest.mark.parametrize("source", ["<int_constant>7é</int_constant>", b"<int_constant>7\xc3\xa9</int_constant>"])
+def test_digits_followed_by_a_non_digit_letter_still_fail(source):
+    with pytest.raises(ScanError, match="column 16: Unexpected character: é"):
+        Scanner(source).scan()
+
+def naive_location(text: str, position: int):
+    # (line, column) by counting characters up to position
+    before = text[:position]
+    return before.count("\n") + 1, len(before) - (before.rfind("\n") + 1) + 1
+
+def scan_result(scan):
+    # The tokens, or the error that stopped the scan
+    try:
+        return [(token.type, token.value) for token in scan()]
+    except ScanError as e:
+        return str(e)
+
+@pytest.mark.parametrize("name", SAMPLES)
+def test_offsets_and_lazy_locations(name):
+    text = sample(name)
+    scanner = Scanner(text)
+    try:
+        tokens = list(scanner.iter_tokens())
+    except ScanError as e:
+        assert (e.line, e.column) == naive_location(text, e.position)
+        return
+    for token in tokens:
+        source = text[token.start:token.end]
+        if token.type == TokenType.STRING_LITERAL:
+            assert source == f'"{token.value}"'
+        elif token.type == TokenType.INT_LITERAL:
+            assert source == token.value
+        for position in (token.start, token.end):
+            assert scanner.location(position) == naive_location(text, position)
+
+def test_bytes_locations_count_characters():
+    text = '<query>\n  <column>"héllo wörld"</column> <tab>'
+    with pytest.raises(ScanError) as error:
+        Scanner(text.encode()).scan()
+    # position is a byte offset, the column counts characters
+    position = len(text.encode()[:error.value.position].decode())
+    assert (error.value.line, error.value.column) == naive_location(text, position)
+    assert str(error.value) == scan_result(Scanner(text).scan)
+
+# Extra inputs with non-ASCII text, comments, odd spacing and scan errors
+DOCUMENTS = [
+    '<query><select><column>"naïve ☃"</column></select><from><table>"t"</table></from></query>',
+    '<!--note--><query>\r\n\t<select><column>"a b"</column></select>  </query>',
+    '<int_constant> 42 </int_constant><int_constant>7</int_constant>',
+    '<query><column>"unclosed</column></query>',
+    '<query>\n<colum>"x"</colum>',
+    '<query><select/>é',
+    '',
+]
+
+@pytest.mark.parametrize("text", [sample(name) for name in SAMPLES] + DOCUMENTS)
+def test_bytes_and_mmap_scans_equal_scan(text, tmp_path):
+    expected = scan_result(Scanner(text).scan)
+    assert scan_result(Scanner(text.encode()).scan) == expected
+    path = tmp_path / "input.xml"
+    path.write_bytes(text.encode())
+    assert scan_result(lambda: iter_file_tokens(str(path))) == expected
+
+@pytest.mark.parametrize("text", [sample(name) for name in SAMPLES] + DOCUMENTS)
+@pytest.mark.parametrize("encode", [False, True])
+def test_token_buffer_equals_scan(text, encode):
+    source = text.encode() if encode else text
+    expected = scan_result(Scanner(source).scan)
+    assert scan_result(Scanner(source).scan_buffer) == expected
+    if isinstance(expected, str):
+        return
+    buffer = Scanner(source).scan_buffer()
+    tokens = Scanner(source).scan()
+    assert len(buffer) == len(tokens)
+    assert [(view.start, view.end) for view in buffer] == [(token.start, token.end) for token in tokens]
+    for index, token in enumerate(tokens):
+        assert buffer.type(index) == token.type and buffer[index].value == token.value
+        # Values of bytes input are zero-copy slices of the source
+        assert isinstance(buffer.raw_value(index), memoryview if encode else str)
+
+@pytest.mark.parametrize("parser_class", [Parser, TableParser])
+def test_parsers_run_over_a_token_buffer(parser_class):
+    for name in SAMPLES:
+        text = sample(name)
+        try:
+            tokens = [token for token in Scanner(text).scan() if token.type != TokenType.COMMENT]
+            views = [view for view in Scanner(text.encode()).scan_buffer() if view.type != TokenType.COMMENT]
+            expected = parser_class(tokens).parse()
+        except (ValueError, SyntaxError):
+            continue
+        assert parser_class(views).parse() == expected
+
+def test_token_buffer_index_out_of_range():
+    buffer = Scanner("<query>").scan_buffer()
+    assert buffer[-1].type == TokenType.QUERY_OPEN
+    with pytest.raises(IndexError):
+        buffer[1]
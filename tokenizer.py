@@ -1,5 +1,18 @@
+import bisect
+import codecs
 import enum
+import functools
+import mmap
 import os
+import re
+import struct
+import time
+from array import array
+
+from batch import map_files, print_summary
+from build import MANIFEST_NAME, Manifest, incremental_build
+from cache import cache_key, shared_cache
+from instrument import FileProfile, notify, run_profiled, timed
 
 class TokenType(enum.Enum):
     QUERY_OPEN, QUERY_CLOSE = 1, 2
@@ -33,49 +46,348 @@ class TokenType(enum.Enum):
 
     COMMENT = 53
 
+    QUERIES_OPEN, QUERIES_CLOSE = 54, 55
+
+    PARAM_OPEN, PARAM_CLOSE = 56, 57
+
 class Token:
-    def __init__(self, type, value):
+    def __init__(self, type, value, start=None, end=None):
         self.type = type
         self.value = value
+        # Offsets into the scanned input (byte offsets for bytes input), see Scanner.location
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f"<{self.type.name}, {self.value}>"
+
+# TokenType by its value, used wherever tokens are stored as one-byte codes
+TOKEN_TYPES_BY_CODE = [None] * (max(t.value for t in TokenType) + 1)
+for t in TokenType:
+    TOKEN_TYPES_BY_CODE[t.value] = t
+
+TAG_TYPE_MAP = {
+    "query": (TokenType.QUERY_OPEN, TokenType.QUERY_CLOSE),
+    "select": (TokenType.SELECT_OPEN, TokenType.SELECT_CLOSE),
+    "column": (TokenType.COLUMN_OPEN, TokenType.COLUMN_CLOSE),
+    "count_func": (TokenType.COUNT_FUNC_OPEN, TokenType.COUNT_FUNC_CLOSE),
+    "max_func": (TokenType.MAX_FUNC_OPEN, TokenType.MAX_FUNC_CLOSE),
+    "alias": (TokenType.ALIAS_OPEN, TokenType.ALIAS_CLOSE),
+    "lhs": (TokenType.LHS_OPEN, TokenType.LHS_CLOSE),
+    "rhs": (TokenType.RHS_OPEN, TokenType.RHS_CLOSE),
+    "from": (TokenType.FROM_OPEN, TokenType.FROM_CLOSE),
+    "table": (TokenType.TABLE_OPEN, TokenType.TABLE_CLOSE),
+    "where": (TokenType.WHERE_OPEN, TokenType.WHERE_CLOSE),
+    "eq_op": (TokenType.EQ_OP_OPEN, TokenType.EQ_OP_CLOSE),
+    "ref_table": (TokenType.REF_TABLE_OPEN, TokenType.REF_TABLE_CLOSE),
+    "ref_col": (TokenType.REF_COL_OPEN, TokenType.REF_COL_CLOSE),
+    "constant": (TokenType.CONSTANT_OPEN, TokenType.CONSTANT_CLOSE),
+    "string_constant": (TokenType.STRING_CONSTANT_OPEN, TokenType.STRING_CONSTANT_CLOSE),
+    "group_by": (TokenType.GROUP_BY_OPEN, TokenType.GROUP_BY_CLOSE),
+    "having": (TokenType.HAVING_OPEN, TokenType.HAVING_CLOSE),
+    "gt_op": (TokenType.GT_OP_OPEN, TokenType.GT_OP_CLOSE),
+    "int_constant": (TokenType.INT_CONSTANT_OPEN, TokenType.INT_CONSTANT_CLOSE),
+    "order_by": (TokenType.ORDER_BY_OPEN, TokenType.ORDER_BY_CLOSE),
+    "desc": (TokenType.DESC_OPEN, TokenType.DESC_CLOSE),
+    "asc": (TokenType.ASC_OPEN, TokenType.ASC_CLOSE),
+    "bracket": (TokenType.BRACKET_OPEN, TokenType.BRACKET_CLOSE),
+    "queries": (TokenType.QUERIES_OPEN, TokenType.QUERIES_CLOSE),
+    "param": (TokenType.PARAM_OPEN, TokenType.PARAM_CLOSE),
+}
+
+SELF_CLOSING_TAGS = {"and", "or"}
+
+def build_tag_tokens():
+    # Full tag text -> (token type, token value), for every tag tag_token accepts
+    tag_tokens = {}
+    for name, (open_type, close_type) in TAG_TYPE_MAP.items():
+        tag_tokens[f"<{name}>"] = (open_type, f"<{name}>")
+        tag_tokens[f"</{name}>"] = (close_type, f"</{name}>")
+        tag_tokens[f"<{name}/>"] = tag_tokens[f"</{name}/>"] = (open_type, f"<{name}/>")
+    for name in SELF_CLOSING_TAGS:
+        tag_tokens[f"<{name}/>"] = tag_tokens[f"</{name}/>"] = (TokenType[name.upper()], f"<{name}/>")
+    return tag_tokens
+
+TAG_TOKENS = build_tag_tokens()
+BYTES_TAG_TOKENS = {text.encode(): token for text, token in TAG_TOKENS.items()}
+
+# One alternative per token class. Only well-formed tokens match; anything else
+# (odd spacing inside tags, non-ASCII digits, every error) falls back to the
+# character-by-character scanner so tokens and error messages stay the same.
+TOKEN_REGEX = r"""
+    (?P<space>\s*)
+    (?:
+        (?P<tag></?\w+/?>)
+      | <!--(?P<comment>[^>/ ]*)-->
+      | "(?P<double>[^"]*)"
+      | '(?P<single>[^']*)'
+      | (?P<int>[0-9]+)(?![0-9]|[^\x00-\x7f])
+      | (?P<gap>)
+    )
+"""
+TOKEN_PATTERN = re.compile(TOKEN_REGEX, re.VERBOSE)
+# Same pattern over UTF-8 bytes: \s and \w only cover ASCII there, the rest
+# goes through the fallback like any other unusual input
+BYTES_TOKEN_PATTERN = re.compile(TOKEN_REGEX.encode(), re.VERBOSE)
+
+LITERAL_TYPES = {
+    "comment": TokenType.COMMENT,
+    "double": TokenType.STRING_LITERAL,
+    "single": TokenType.STRING_LITERAL,
+    "int": TokenType.INT_LITERAL,
+}
+
+# Where a literal's value sits inside its token text, as (skip, trim)
+LITERAL_VALUE_SPANS = {
+    TokenType.STRING_LITERAL.value: (1, 1),
+    TokenType.INT_LITERAL.value: (0, 0),
+    TokenType.COMMENT.value: (4, 3),
+}
+
+class TokenView:
+    """One token of a TokenBuffer; reads like a Token, its value is sliced on access."""
+    __slots__ = ("buffer", "index")
+
+    def __init__(self, buffer, index):
+        self.buffer = buffer
+        self.index = index
+
+    @property
+    def type(self):
+        return TOKEN_TYPES_BY_CODE[self.buffer.types[self.index]]
+
+    @property
+    def value(self):
+        return self.buffer.value(self.index)
+
+    @property
+    def start(self):
+        return self.buffer.starts[self.index]
+
+    @property
+    def end(self):
+        return self.buffer.ends[self.index]
 
     def __repr__(self):
         return f"<{self.type.name}, {self.value}>"
 
+class TokenBuffer:
+    """Struct-of-arrays token list: a type code and start/end offsets per token.
+
+    Values are not stored; they are sliced out of the source when read.
+    Iterating yields TokenViews, so a Parser can run over the buffer directly.
+    """
+    def __init__(self, source):
+        self.source = source
+        self.binary = not isinstance(source, str)
+        self.types = array('B')
+        self.starts = array('q')
+        self.ends = array('q')
+        # Values that slicing would not reproduce, e.g. tags the fallback scanner normalized
+        self.overrides = {}
+
+    def append(self, code, start, end):
+        self.types.append(code)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def append_token(self, token):
+        index = len(self.types)
+        self.append(token.type.value, token.start, token.end)
+        if self.value(index) != token.value:
+            self.overrides[index] = token.value
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        if not -len(self.types) <= index < len(self.types):
+            raise IndexError("token index out of range")
+        return TokenView(self, index % len(self.types))
+
+    def __iter__(self):
+        return (TokenView(self, index) for index in range(len(self.types)))
+
+    def type(self, index):
+        return TOKEN_TYPES_BY_CODE[self.types[index]]
+
+    def raw_value(self, index):
+        # The value's slice of the source: a str slice, or a zero-copy memoryview of bytes input
+        start, end = self.starts[index], self.ends[index]
+        span = LITERAL_VALUE_SPANS.get(self.types[index])
+        if span is not None:
+            start, end = start + span[0], end - span[1]
+        if self.binary:
+            return memoryview(self.source)[start:end]
+        return self.source[start:end]
+
+    def value(self, index):
+        if index in self.overrides:
+            return self.overrides[index]
+        raw = self.raw_value(index)
+        if self.binary:
+            raw = str(raw, 'utf-8')
+        if self.types[index] in LITERAL_VALUE_SPANS:
+            return raw
+        tag = TAG_TOKENS.get(raw)
+        return tag[1] if tag is not None else raw
+
+class ScanError(ValueError):
+    def __init__(self, message, position, line, column):
+        self.message = message
+        self.position = position
+        self.line = line
+        self.column = column
+        super().__init__(f"Error at line {line}, column {column}: {message}")
+
+class LineIndex:
+    """Maps offsets to (line, column), built on first use."""
+    def __init__(self, text):
+        self.text = text
+        self.binary = not isinstance(text, str)
+        self.line_starts = None
+
+    def location(self, position):
+        if self.line_starts is None:
+            newline = b'\n' if self.binary else '\n'
+            self.line_starts = array('q', [0])
+            self.line_starts.extend(m.end() for m in re.finditer(newline, self.text))
+        line = bisect.bisect_right(self.line_starts, position)
+        line_start = self.line_starts[line - 1]
+        if self.binary:
+            # Columns count characters, not bytes
+            column = len(codecs.decode(self.text[line_start:position], 'utf-8', 'replace')) + 1
+        else:
+            column = position - line_start + 1
+        return line, column
+
 class Scanner:
     def __init__(self, input_text):
+        # input_text may be a str, or UTF-8 bytes / an mmap scanned in place
         self.input = input_text
+        self.binary = not isinstance(input_text, str)
         self.position = 0
-        self.line = 1
-        self.column = 1
+        self.token_start = 0
+        self.line_index = LineIndex(input_text)
         self.tokens = []
-        self.self_closing_tags = {"and", "or"}
+        self.self_closing_tags = SELF_CLOSING_TAGS
         self.comment_start = "!--"
         self.comment_end = "--"
     
     def advance(self):
         if self.position < len(self.input):
-            if self.input[self.position] == '\n':
-                self.line += 1
-                self.column = 1
-            else:
-                self.column += 1
             self.position += 1
 
     def scan(self):
-        while self.position < len(self.input):
-            if self.input[self.position].isspace():
-                self.advance()
-            elif self.input[self.position] == '<':
-                self.scan_tag()
-            elif self.input[self.position] in ['"', "'"]:
-                self.scan_string_literal()
-            elif self.input[self.position].isdigit():
-                self.scan_int_literal()
-            else:
-                self.error(f"Unexpected character: {self.input[self.position]}")
-
+        self.tokens.extend(self.iter_tokens())
         return self.tokens
 
+    def iter_tokens(self):
+        text = self.input
+        binary = self.binary
+        match = (BYTES_TOKEN_PATTERN if binary else TOKEN_PATTERN).match
+        tag_tokens = BYTES_TAG_TOKENS if binary else TAG_TOKENS
+        while self.position < len(text):
+            m = match(text, self.position)
+            kind = m.lastgroup
+            if kind == "tag":
+                tag = tag_tokens.get(m.group(kind))
+                if tag is not None:
+                    self.position = m.end()
+                    yield Token(tag[0], tag[1], m.end(1), self.position)
+                    continue
+                self.position = m.end(1)
+            elif kind != "gap":
+                value = m.group(kind)
+                if binary:
+                    value = value.decode('utf-8')
+                self.position = m.end()
+                yield Token(LITERAL_TYPES[kind], value, m.end(1), self.position)
+                continue
+            elif m.end() > self.position:
+                self.position = m.end()
+                continue
+
+            token = self.scan_bytes_token() if binary else self.scan_token()
+            if token is not None:
+                yield token
+
+    def scan_buffer(self):
+        # Same tokens as iter_tokens, stored as a TokenBuffer without creating Token objects
+        buffer = TokenBuffer(self.input)
+        append = buffer.append
+        text = self.input
+        binary = self.binary
+        match = (BYTES_TOKEN_PATTERN if binary else TOKEN_PATTERN).match
+        tag_tokens = BYTES_TAG_TOKENS if binary else TAG_TOKENS
+        literal_codes = {kind: type.value for kind, type in LITERAL_TYPES.items()}
+        while self.position < len(text):
+            m = match(text, self.position)
+            kind = m.lastgroup
+            if kind == "tag":
+                tag = tag_tokens.get(m.group(kind))
+                if tag is not None:
+                    self.position = m.end()
+                    append(tag[0].value, m.end(1), self.position)
+                    continue
+                self.position = m.end(1)
+            elif kind != "gap":
+                self.position = m.end()
+                append(literal_codes[kind], m.end(1), self.position)
+                continue
+            elif m.end() > self.position:
+                self.position = m.end()
+                continue
+
+            token = self.scan_bytes_token() if binary else self.scan_token()
+            if token is not None:
+                buffer.append_token(token)
+        return buffer
+
+    def scan_token(self):
+        self.token_start = self.position
+        if self.input[self.position].isspace():
+            self.advance()
+            return None
+        elif self.input[self.position] == '<':
+            return self.scan_tag()
+        elif self.input[self.position] in ['"', "'"]:
+            return self.scan_string_literal()
+        elif self.input[self.position].isdigit():
+            return self.scan_int_literal()
+        else:
+            self.error(f"Unexpected character: {self.input[self.position]}")
+
+    def scan_bytes_token(self):
+        # Decode a small window at the current offset and run the character
+        # scanner on it, widening the window until the token ends inside it
+        start = self.position
+        size = 64
+        while True:
+            at_end = start + size >= len(self.input)
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            window = Scanner(decoder.decode(self.input[start:start + size], final=at_end))
+            try:
+                token, error = window.scan_token(), None
+            except ScanError as e:
+                token, error = None, e
+            if at_end or window.position < len(window.input):
+                break
+            size *= 4
+
+        if error is not None:
+            self.error(error.message, start + len(window.input[:error.position].encode('utf-8')))
+        self.position = start + len(window.input[:window.position].encode('utf-8'))
+        if token is not None:
+            token = Token(token.type, token.value, start, self.position)
+        return token
+
+    def location(self, position):
+        return self.line_index.location(position)
+
+    def make_token(self, type, value):
+        return Token(type, value, self.token_start, self.position)
+
 
     def scan_tag(self):
         """
@@ -84,83 +396,54 @@ class Scanner:
         """
 
         start = self.position
-        start_line, start_column = self.line, self.column
         self.advance()  
         is_closing = False
         if self.position < len(self.input) and self.input[self.position] == '/':
             is_closing = True
             self.advance()
 
-        tag_name = ""
+        name_start = self.position
         while self.position < len(self.input) and self.input[self.position] not in ('>', '/', ' '):
-            tag_name += self.input[self.position]
             self.advance()
 
-        tag_name = tag_name.strip()
+        tag_name = self.input[name_start:self.position].strip()
 
         if self.position < len(self.input):
             if self.input[self.position] == '/':
                 self.advance()
                 if self.position < len(self.input) and self.input[self.position] == '>':
                     self.advance()
-                    self.add_tag_token(tag_name, is_self_closing=True)
+                    return self.tag_token(tag_name, is_self_closing=True)
                 else:
-                    self.error(f"Invalid self-closing tag", start_line, start_column)
+                    self.error(f"Invalid self-closing tag", start)
             elif self.input[self.position] == '>':
                 self.advance()
                 """check comment"""
                 if (self.is_comment(tag_name)):
-                    self.add_tag_token(tag_name[3:len(tag_name)-2], is_comment=True)
+                    return self.tag_token(tag_name[3:len(tag_name)-2], is_comment=True)
                 else:
-                    self.add_tag_token(tag_name, is_closing=is_closing)
+                    return self.tag_token(tag_name, is_closing=is_closing)
             else:
-                self.error(f"Invalid tag", start_line, start_column)
+                self.error(f"Invalid tag", start)
         else:
-            self.error("Unclosed tag", start_line, start_column)
-
-    def add_tag_token(self, tag_name, is_closing=False, is_self_closing=False, is_comment=False):
-        tag_type_map = {
-            "query": (TokenType.QUERY_OPEN, TokenType.QUERY_CLOSE),
-            "select": (TokenType.SELECT_OPEN, TokenType.SELECT_CLOSE),
-            "column": (TokenType.COLUMN_OPEN, TokenType.COLUMN_CLOSE),
-            "count_func": (TokenType.COUNT_FUNC_OPEN, TokenType.COUNT_FUNC_CLOSE),
-            "max_func": (TokenType.MAX_FUNC_OPEN, TokenType.MAX_FUNC_CLOSE),
-            "alias": (TokenType.ALIAS_OPEN, TokenType.ALIAS_CLOSE),
-            "lhs": (TokenType.LHS_OPEN, TokenType.LHS_CLOSE),
-            "rhs": (TokenType.RHS_OPEN, TokenType.RHS_CLOSE),
-            "from": (TokenType.FROM_OPEN, TokenType.FROM_CLOSE),
-            "table": (TokenType.TABLE_OPEN, TokenType.TABLE_CLOSE),
-            "where": (TokenType.WHERE_OPEN, TokenType.WHERE_CLOSE),
-            "eq_op": (TokenType.EQ_OP_OPEN, TokenType.EQ_OP_CLOSE),
-            "ref_table": (TokenType.REF_TABLE_OPEN, TokenType.REF_TABLE_CLOSE),
-            "ref_col": (TokenType.REF_COL_OPEN, TokenType.REF_COL_CLOSE),
-            "constant": (TokenType.CONSTANT_OPEN, TokenType.CONSTANT_CLOSE),
-            "string_constant": (TokenType.STRING_CONSTANT_OPEN, TokenType.STRING_CONSTANT_CLOSE),
-            "group_by": (TokenType.GROUP_BY_OPEN, TokenType.GROUP_BY_CLOSE),
-            "having": (TokenType.HAVING_OPEN, TokenType.HAVING_CLOSE),
-            "gt_op": (TokenType.GT_OP_OPEN, TokenType.GT_OP_CLOSE),
-            "int_constant": (TokenType.INT_CONSTANT_OPEN, TokenType.INT_CONSTANT_CLOSE),
-            "order_by": (TokenType.ORDER_BY_OPEN, TokenType.ORDER_BY_CLOSE),
-            "desc": (TokenType.DESC_OPEN, TokenType.DESC_CLOSE),
-            "asc": (TokenType.ASC_OPEN, TokenType.ASC_CLOSE),
-            "bracket": (TokenType.BRACKET_OPEN, TokenType.BRACKET_CLOSE),
-        }
+            self.error("Unclosed tag", start)
 
+    def tag_token(self, tag_name, is_closing=False, is_self_closing=False, is_comment=False):
         if tag_name in self.self_closing_tags:
             if not is_self_closing:
                 self.error(f"Tag <{tag_name}> must be self-closing")
-            self.tokens.append(Token(TokenType[tag_name.upper()], f"<{tag_name}/>"))
+            return self.make_token(TokenType[tag_name.upper()], f"<{tag_name}/>")
         elif is_self_closing:
-            if tag_name in tag_type_map:
-                self.tokens.append(Token(tag_type_map[tag_name][0], f"<{tag_name}/>"))
+            if tag_name in TAG_TYPE_MAP:
+                return self.make_token(TAG_TYPE_MAP[tag_name][0], f"<{tag_name}/>")
             else:
                 self.error(f"Unknown self-closing tag: <{tag_name}/>")
         elif is_comment:
-            self.tokens.append(Token(TokenType.COMMENT, f"{tag_name}"))
+            return self.make_token(TokenType.COMMENT, f"{tag_name}")
         else:
-            if tag_name in tag_type_map:
-                token_type = tag_type_map[tag_name][1 if is_closing else 0]
-                self.tokens.append(Token(token_type, f"<{'/' if is_closing else ''}{tag_name}>"))
+            if tag_name in TAG_TYPE_MAP:
+                token_type = TAG_TYPE_MAP[tag_name][1 if is_closing else 0]
+                return self.make_token(token_type, f"<{'/' if is_closing else ''}{tag_name}>")
             else:
                 self.error(f"Unknown tag: <{'/' if is_closing else ''}{tag_name}>")
         
@@ -174,11 +457,10 @@ class Scanner:
         start = self.position
         while self.position < len(self.input) and self.input[self.position].isdigit():
             self.advance()
-        self.tokens.append(Token(TokenType.INT_LITERAL, self.input[start:self.position]))
+        return self.make_token(TokenType.INT_LITERAL, self.input[start:self.position])
 
     def scan_string_literal(self):
         start = self.position
-        start_line, start_column = self.line, self.column
         quote_char = self.input[self.position]
         self.advance()
         while self.position < len(self.input) and self.input[self.position] != quote_char:
@@ -186,9 +468,9 @@ class Scanner:
         if self.position < len(self.input):
             self.advance()  
             value = self.input[start+1:self.position-1]
-            self.tokens.append(Token(TokenType.STRING_LITERAL, value))
+            return self.make_token(TokenType.STRING_LITERAL, value)
         else:
-            self.error("Unclosed string literal", start_line, start_column)
+            self.error("Unclosed string literal", start)
     """
     def is_unclosed_string_literal(self):
         current_pos = self.position
@@ -209,12 +491,11 @@ class Scanner:
     
     # def comment(self, )
  
-    def error(self, message, line=None, column=None):
-        if line is None:
-            line = self.line
-        if column is None:
-            column = self.column
-        raise ValueError(f"Error at line {line}, column {column}: {message}")
+    def error(self, message, position=None):
+        if position is None:
+            position = self.position
+        line, column = self.location(position)
+        raise ScanError(message, position, line, column)
 
 def process_file(file_path: str):
     tokenLs=[]
@@ -229,13 +510,135 @@ def process_file(file_path: str):
 
     return tokenLs
 
+def cached_file_tokens(file_path: str, cache_path: str):
+    # process_file through the shared cache; a cached scan error is raised again
+    cache = shared_cache(cache_path)
+    with open(file_path, 'rb') as file:
+        key = cache_key(file.read(), "tokens")
+    outcome = cache.get(key)
+    if outcome is None:
+        try:
+            outcome = {"tokens": [[token.type.value, token.value] for token in process_file(file_path)]}
+        except ValueError as e:
+            outcome = {"error": str(e)}
+        cache.put(key, outcome)
+    if "error" in outcome:
+        raise ValueError(outcome["error"])
+    return [Token(TOKEN_TYPES_BY_CODE[code], value) for code, value in outcome["tokens"]]
+
+def iter_file_tokens(file_path: str):
+    # Memory-map the file and scan its UTF-8 bytes in place; only literal
+    # values are decoded, so memory use does not grow with the file size
+    if os.path.getsize(file_path) == 0:
+        return
+    with open(file_path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield from Scanner(data).iter_tokens()
 
 def write_tokens_to_file(list, file):
     for t in list:
         file.write(f"{t}\n")
 
+# Binary token file (lex_*.tok), all integers little-endian:
+#   header   magic "XQLT", u8 version, 3 pad bytes, u64 token count, u64 string table offset
+#   tokens   one record per token: u8 TokenType value, u32 index into the string table
+#   strings  u32 count, then for each string u32 byte length + UTF-8 bytes
+TOKEN_FILE_MAGIC = b"XQLT"
+TOKEN_FILE_VERSION = 1
+TOKEN_FILE_HEADER = struct.Struct("<4sB3xQQ")
+TOKEN_RECORD = struct.Struct("<BI")
+
+def write_tokens_binary(tokens, file):
+    # Token values are interned, so each distinct value is stored once
+    file.write(TOKEN_FILE_HEADER.pack(TOKEN_FILE_MAGIC, TOKEN_FILE_VERSION, 0, 0))
+    strings = {}
+    count = 0
+    records = bytearray()
+    for token in tokens:
+        index = strings.setdefault(token.value, len(strings))
+        records += TOKEN_RECORD.pack(token.type.value, index)
+        count += 1
+        if len(records) >= 1 << 20:
+            file.write(records)
+            records.clear()
+    file.write(records)
+
+    strings_offset = file.tell()
+    table = bytearray(struct.pack("<I", len(strings)))
+    for value in strings:
+        data = value.encode('utf-8')
+        table += struct.pack("<I", len(data))
+        table += data
+    file.write(table)
 
-def process_folder(input_dir: str = "./tests", output_dir: str = "./lexer_output"):
+    file.seek(0)
+    file.write(TOKEN_FILE_HEADER.pack(TOKEN_FILE_MAGIC, TOKEN_FILE_VERSION, count, strings_offset))
+    file.seek(0, os.SEEK_END)
+
+
+def token_output_path(filename: str, output_dir: str, token_format: str = "text"):
+    name = filename.split(".")[0]
+    extension = "tok" if token_format == "binary" else "txt"
+    return os.path.join(output_dir, f"lex_{name}.{extension}")
+
+def tokenize_file(filename: str, input_dir: str, output_dir: str, use_mmap: bool = False, token_format: str = "text", cache_path: str = None, profile: bool = False):
+    # Tokenize one file into its lex_* file; returns (console lines, error or
+    # None, FileProfile.as_dict() or None)
+    input_path = os.path.join(input_dir, filename)
+    if token_format == "binary":
+        write_tokens, mode = write_tokens_binary, 'wb'
+    else:
+        write_tokens, mode = write_tokens_to_file, 'w'
+    output_path = token_output_path(filename, output_dir, token_format)
+    stats = FileProfile(filename) if profile else None
+
+    log = [f"\nProcessing {filename}:"]
+    try:
+        if stats is not None:
+            stats.count("bytes_read", os.path.getsize(input_path))
+        if use_mmap:
+            # Tokens go straight to the output file; drop it if scanning fails
+            try:
+                with timed(stats, "scan_and_write"), open(output_path, mode) as f:
+                    write_tokens(iter_file_tokens(input_path), f)
+            except Exception:
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                raise
+            log.append(f"Successfully processed {input_path}")
+            if stats is not None:
+                stats.count("bytes_written", os.path.getsize(output_path))
+            return log, None, None if stats is None else stats.as_dict()
+
+        # Memory-mapped inputs are meant to be large and are never cached
+        if cache_path is None:
+            with timed(stats, "read"):
+                with open(input_path, 'r') as file:
+                    input_text = file.read()
+            with timed(stats, "scan"):
+                tokens = Scanner(input_text).scan()
+        else:
+            with timed(stats, "cache"):
+                tokens = cached_file_tokens(input_path, cache_path)
+        log.append(f"Successfully processed {input_path}")
+
+        # Write AST to output file
+        with timed(stats, "write"), open(output_path, mode) as f:
+            # f.write("Successfully tokenized.\n")
+            write_tokens(tokens, f)
+        if stats is not None:
+            stats.count("tokens", len(tokens))
+            stats.count("bytes_written", os.path.getsize(output_path))
+            
+    except Exception as e:
+        log.append(f"Error tokenizing {filename}: {str(e)}")
+        if stats is not None:
+            stats.error = str(e)
+        return log, str(e), None if stats is None else stats.as_dict()
+
+    return log, None, None if stats is None else stats.as_dict()
+
+def process_folder(input_dir: str = "./tests", output_dir: str = "./lexer_output", use_mmap: bool = False, jobs: int = 1, token_format: str = "text", cache_path: str = None, incremental: bool = False, observers=None):
     if not os.path.exists(input_dir):
         print(f"Error: Input directory {input_dir} does not exist")
         return
@@ -243,24 +646,40 @@ def process_folder(input_dir: str = "./tests", output_dir: str = "./lexer_output
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     
-    for filename in os.listdir(input_dir):
-        if filename.endswith(".xml"):
-            input_path = os.path.join(input_dir, filename)
-            name = filename.split(".")[0]
-            output_path = os.path.join(output_dir, f"lex_{name}.txt")
-            
-            print(f"\nProcessing {filename}:")
-            try:
-                tokens = process_file(input_path)
-                print(f"Successfully processed {input_path}")
+    filenames = sorted(filename for filename in os.listdir(input_dir) if filename.endswith(".xml"))
+    # Workers only measure their stages when someone is observing the run
+    observers = observers or []
+    work = functools.partial(tokenize_file, input_dir=input_dir, output_dir=output_dir, use_mmap=use_mmap, token_format=token_format, cache_path=cache_path, profile=bool(observers))
+
+    def outputs_for(filename):
+        return [token_output_path(filename, output_dir, token_format)]
+
+    start = time.perf_counter()
+    notify(observers, "start_run", "tokenize", filenames)
+    todo, fresh = filenames, []
+    if incremental:
+        manifest = Manifest(os.path.join(output_dir, MANIFEST_NAME), "tokenize", {"format": token_format})
+        todo, fresh = incremental_build(manifest, filenames, input_dir, outputs_for)
 
-                # Write AST to output file
-                with open(output_path, 'w') as f:
-                    # f.write("Successfully tokenized.\n")
-                    write_tokens_to_file(tokens, f)
-                    
-            except Exception as e:
-                print(f"Error tokenizing {filename}: {str(e)}")
+    errors = []
+    for filename, (log, error, profile) in zip(todo, map_files(work, todo, jobs)):
+        print("\n".join(log))
+        if error is not None:
+            errors.append((filename, error))
+        if incremental:
+            manifest.record(filename, os.path.join(input_dir, filename), outputs_for(filename), error)
+        if observers:
+            notify(observers, "file_done", "tokenize", profile)
+
+    if incremental:
+        manifest.save()
+        # Files skipped as up to date still report the error they failed with
+        errors = sorted(errors + [(filename, manifest.error(filename)) for filename in fresh if manifest.error(filename) is not None])
+        print_summary("Tokenized", len(filenames), errors, up_to_date=len(fresh))
+    else:
+        print_summary("Tokenized", len(filenames), errors)
+    notify(observers, "end_run", "tokenize", time.perf_counter() - start)
+    return errors
 
 if __name__ == "__main__":
     # folder_path = "./tests/"  
@@ -273,8 +692,27 @@ if __name__ == "__main__":
                       help='Input directory containing XML files (default: ./tests)')
     parser.add_argument('--output', default='./lexer_output',
                       help='Output directory for tokenizer results (default: ./lexer_output)')
+    parser.add_argument('--mmap', action='store_true',
+                      help='Memory-map input files and scan their bytes in place (for very large inputs)')
+    parser.add_argument('--jobs', type=int, default=1,
+                      help='Number of worker processes (default: 1)')
+    parser.add_argument('--format', choices=['text', 'binary'], default='text',
+                      help='Token file format: readable lex_*.txt or compact lex_*.tok (default: text)')
+    
+    parser.add_argument('--cache', default=None,
+                      help='SQLite file caching outcomes across runs, shared with parser.py --cache')
+    
+    parser.add_argument('--incremental', action='store_true',
+                      help='Only tokenize inputs changed since the last incremental run')
+    
+    parser.add_argument('--profile', default=None,
+                      help='Write per-stage timings and counts of each file to this JSON file')
+    parser.add_argument('--cprofile', action='store_true',
+                      help='Also run under cProfile and add the slowest functions to the --profile file')
     
     args = parser.parse_args()
-    process_folder(args.input, args.output)
+    if args.cprofile and args.profile is None:
+        parser.error("--cprofile needs --profile, the file its results are written to")
+    run_profiled(process_folder, args.profile, args.cprofile, input_dir=args.input, output_dir=args.output, use_mmap=args.mmap, jobs=args.jobs, token_format=args.format, cache_path=args.cache, incremental=args.incremental)
     
     print("\nTokenizing complete. Check the output directory for results.")
\ No newline at end of file
@@ -0,0 +1,141 @@
+import os
+import random
+import string
+from dataclasses import asdict, dataclass
+
+@dataclass
+class WorkloadOptions:
+    """Knobs of the synthetic query generator."""
+    columns: int = 5           # columns in SELECT
+    tables: int = 2            # tables in FROM
+    predicates: int = 4        # comparisons in WHERE
+    nesting: int = 2           # deepest bracket nesting in WHERE
+    literal_size: int = 8      # characters in names and string constants
+    count_ratio: float = 0.2   # share of columns that are count_func
+    max_ratio: float = 0.1     # share of columns that are max_func
+    alias_ratio: float = 0.1   # share of columns that are aliased
+    group_by: float = 0.5      # chance of a GROUP BY clause (with HAVING half the time)
+    order_by: float = 0.5      # chance of an ORDER BY clause
+
+class QueryGenerator:
+    """Random XQL queries that always scan, parse and generate."""
+    def __init__(self, options: WorkloadOptions = None, seed: int = 0):
+        self.options = options or WorkloadOptions()
+        self.random = random.Random(seed)
+
+    def name(self) -> str:
+        # Identifiers only use letters and digits, so code generation accepts them
+        size = max(1, self.options.literal_size)
+        return self.random.choice(string.ascii_lowercase) + "".join(
+            self.random.choices(string.ascii_lowercase + string.digits, k=size - 1))
+
+    def function(self) -> str:
+        tag = "count_func" if self.random.random() < 0.5 else "max_func"
+        if tag == "count_func" and self.random.random() < 0.5:
+            return f'<{tag}>"*"</{tag}>'
+        return f'<{tag}><column>"{self.name()}"</column></{tag}>'
+
+    def column(self) -> str:
+        options = self.options
+        roll = self.random.random()
+        if roll < options.alias_ratio:
+            inner = self.function() if self.random.random() < 0.5 else f'"{self.name()}"'
+            return f'<column><alias><lhs>{inner}</lhs><rhs>"{self.name()}"</rhs></alias></column>'
+        roll -= options.alias_ratio
+        if roll < options.count_ratio:
+            return f'<column><count_func>"*"</count_func></column>'
+        roll -= options.count_ratio
+        if roll < options.max_ratio:
+            return f'<column><max_func>"{self.name()}"</max_func></column>'
+        return f'<column>"{self.name()}"</column>'
+
+    def comparison(self) -> str:
+        tag = "eq_op" if self.random.random() < 0.7 else "gt_op"
+        roll = self.random.random()
+        if roll < 0.6:
+            left = f'<ref_table>"{self.name()}"</ref_table><ref_col>"{self.name()}"</ref_col>'
+        elif roll < 0.9:
+            left = f'"{self.name()}"'
+        else:
+            left = self.function()
+        if self.random.random() < 0.5:
+            right = f'<string_constant>"{self.name()}"</string_constant>'
+        else:
+            right = f'<int_constant>{self.random.randrange(100000)}</int_constant>'
+        return f'<{tag}><lhs>{left}</lhs><rhs>{right}</rhs></{tag}>'
+
+    def condition(self, predicates: int, depth: int) -> str:
+        # predicates comparisons joined by and/or. The grammar only allows a
+        # bracket as the last term of a chain, so the rest of the predicates
+        # may be grouped into one, nested up to depth.
+        parts = []
+        remaining = predicates
+        while remaining > 0:
+            if parts:
+                parts.append("<and/>" if self.random.random() < 0.6 else "<or/>")
+            if depth > 0 and remaining > 1 and self.random.random() < 0.3:
+                parts.append(f'<bracket>{self.condition(remaining, depth - 1)}</bracket>')
+                break
+            parts.append(self.comparison())
+            remaining -= 1
+        return "".join(parts)
+
+    def query(self) -> str:
+        options = self.options
+        parts = ["<query>", "<select>"]
+        parts.extend(self.column() for _ in range(max(1, options.columns)))
+        parts.append("</select><from>")
+        parts.extend(f'<table>"{self.name()}"</table>' for _ in range(max(1, options.tables)))
+        parts.append("</from>")
+        if options.predicates > 0:
+            parts.append(f"<where>{self.condition(options.predicates, options.nesting)}</where>")
+        if self.random.random() < options.group_by:
+            parts.append(f'<group_by><column>"{self.name()}"</column></group_by>')
+            if self.random.random() < 0.5:
+                parts.append(f'<having><gt_op><lhs><count_func>"*"</count_func></lhs>'
+                             f'<rhs><int_constant>{self.random.randrange(100)}</int_constant></rhs></gt_op></having>')
+        if self.random.random() < options.order_by:
+            direction = "asc" if self.random.random() < 0.5 else "desc"
+            parts.append(f'<order_by><{direction}><ref_col>"{self.name()}"</ref_col></{direction}></order_by>')
+        parts.append("</query>\n")
+        return "".join(parts)
+
+    def queries(self, count: int) -> list:
+        return [self.query() for _ in range(count)]
+
+def write_workload(output_dir: str, files: int, options: WorkloadOptions = None, seed: int = 0) -> list:
+    # One query per file, named so that they sort in generation order
+    os.makedirs(output_dir, exist_ok=True)
+    generator = QueryGenerator(options, seed)
+    filenames = []
+    for index in range(files):
+        filename = f"gen_{index:06d}.xml"
+        with open(os.path.join(output_dir, filename), 'w') as f:
+            f.write(generator.query())
+        filenames.append(filename)
+    return filenames
+
+def add_workload_arguments(parser):
+    # One command line flag per WorkloadOptions field
+    for field, default in asdict(WorkloadOptions()).items():
+        parser.add_argument(f"--{field.replace('_', '-')}", type=type(default), default=default,
+                            help=f"Workload knob {field} (default: {default})")
+
+def workload_options(args) -> WorkloadOptions:
+    return WorkloadOptions(**{field: getattr(args, field) for field in asdict(WorkloadOptions())})
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate random valid XQL queries')
+    parser.add_argument('--output', default='./workload',
+                      help='Output directory for the generated files (default: ./workload)')
+    parser.add_argument('--files', type=int, default=1000,
+                      help='Number of files, one query each (default: 1000)')
+    parser.add_argument('--seed', type=int, default=0,
+                      help='Random seed (default: 0)')
+    add_workload_arguments(parser)
+
+    args = parser.parse_args()
+    write_workload(args.output, args.files, workload_options(args), args.seed)
+    print(f"Wrote {args.files} queries to {args.output}")